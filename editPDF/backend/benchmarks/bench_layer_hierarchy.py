@@ -0,0 +1,117 @@
+"""
+Benchmark for _build_layer_hierarchy on synthetic pages with many layers.
+
+Generates nested boxes (page sections > cards > path/text leaves, like a
+chart or map page) and times the indexed implementation. For sizes up to
+--verify-max it also runs the original quadratic algorithm and checks the
+parent assignment is identical.
+
+Usage (from editPDF/backend):
+    python benchmarks/bench_layer_hierarchy.py
+    python benchmarks/bench_layer_hierarchy.py --sizes 1000 10000 50000 --verify-max 10000
+"""
+import argparse
+import copy
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from services.layer_extraction_service import _build_layer_hierarchy
+
+PAGE_W, PAGE_H = 612, 792
+
+
+def make_layers(n, seed=0):
+    rnd = random.Random(seed)
+    layers = []
+
+    def add(x, y, w, h):
+        layers.append({"id": f"layer-{len(layers)}", "x": x, "y": y, "width": w, "height": h})
+
+    # A few containers at different scales, then mostly small leaves
+    for _ in range(max(1, n // 200)):
+        w, h = rnd.uniform(100, 400), rnd.uniform(100, 400)
+        add(rnd.uniform(0, PAGE_W - w), rnd.uniform(0, PAGE_H - h), w, h)
+    for _ in range(max(1, n // 20)):
+        w, h = rnd.uniform(10, 80), rnd.uniform(10, 80)
+        add(rnd.uniform(0, PAGE_W - w), rnd.uniform(0, PAGE_H - h), w, h)
+    while len(layers) < n:
+        w, h = rnd.uniform(0.5, 8), rnd.uniform(0.5, 8)
+        # Snap some to a grid so equal-area ties and exact edges are exercised
+        x, y = rnd.uniform(0, PAGE_W - w), rnd.uniform(0, PAGE_H - h)
+        if rnd.random() < 0.2:
+            x, y, w, h = round(x), round(y), 4, 4
+        add(x, y, w, h)
+
+    rnd.shuffle(layers)
+    return layers
+
+
+def reference_hierarchy(layers):
+    """
+    The original O(n^2) algorithm, kept here as the ground truth.
+    """
+    for layer in layers:
+        layer['parentId'] = None
+    sorted_by_area = sorted(
+        enumerate(layers),
+        key=lambda x: x[1].get('width', 0) * x[1].get('height', 0),
+        reverse=True
+    )
+    for layer in layers:
+        lx, ly = layer.get('x', 0), layer.get('y', 0)
+        lw, lh = layer.get('width', 0), layer.get('height', 0)
+        best_parent_id = None
+        best_parent_area = float('inf')
+        for _, potential_parent in sorted_by_area:
+            if potential_parent['id'] == layer['id']:
+                continue
+            px, py = potential_parent.get('x', 0), potential_parent.get('y', 0)
+            pw, ph = potential_parent.get('width', 0), potential_parent.get('height', 0)
+            parent_area = pw * ph
+            if parent_area <= lw * lh:
+                continue
+            tolerance = 2
+            if (lx >= px - tolerance and ly >= py - tolerance and
+                    lx + lw <= px + pw + tolerance and ly + lh <= py + ph + tolerance):
+                if parent_area < best_parent_area:
+                    best_parent_area = parent_area
+                    best_parent_id = potential_parent['id']
+        layer['parentId'] = best_parent_id
+    return layers
+
+
+def timed(fn, layers):
+    start = time.perf_counter()
+    result = fn(layers)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 50000])
+    parser.add_argument("--verify-max", type=int, default=1000,
+                        help="run the quadratic reference for sizes up to this (it is slow)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print(f"{'layers':>8} {'indexed':>10} {'reference':>10} {'speedup':>8}  match")
+    for n in args.sizes:
+        layers = make_layers(n, args.seed)
+        indexed, t_indexed = timed(_build_layer_hierarchy, copy.deepcopy(layers))
+
+        if n <= args.verify_max:
+            reference, t_reference = timed(reference_hierarchy, copy.deepcopy(layers))
+            match = [l["parentId"] for l in indexed] == [l["parentId"] for l in reference]
+            print(f"{n:>8} {t_indexed * 1000:>8.1f}ms {t_reference * 1000:>8.1f}ms {t_reference / t_indexed:>7.1f}x  {match}")
+            if not match:
+                sys.exit(1)
+        else:
+            print(f"{n:>8} {t_indexed * 1000:>8.1f}ms {'-':>10} {'-':>8}  -")
+
+
+if __name__ == "__main__":
+    main()
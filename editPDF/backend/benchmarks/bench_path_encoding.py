@@ -0,0 +1,82 @@
+"""
+Reports the size of path layer 'd' data per page: the compact PathEncoder
+output against the original full-precision absolute encoding.
+
+Usage (from editPDF/backend):
+    python benchmarks/bench_path_encoding.py                 # bundled sample PDFs
+    python benchmarks/bench_path_encoding.py some.pdf --precision 1
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import fitz
+from services.layer_extraction_service import _drawings_to_svg, PATH_PRECISION
+
+REPO_ROOT = os.path.join(os.path.dirname(__file__), "..", "..", "..")
+
+
+def legacy_drawings_to_svg(items, rect):
+    """
+    The original encoder, kept here as the baseline.
+    """
+    d_commands = []
+    ox, oy = rect[0], rect[1]
+    start_point = None
+    for item in items:
+        cmd = item[0]
+        if cmd == "l":
+            p1, p2 = item[1], item[2]
+            if start_point != p1:
+                d_commands.append(f"M {p1.x - ox} {p1.y - oy}")
+            d_commands.append(f"L {p2.x - ox} {p2.y - oy}")
+            start_point = p2
+        elif cmd == "c":
+            p1, p2, p3, p4 = item[1], item[2], item[3], item[4]
+            if start_point != p1:
+                d_commands.append(f"M {p1.x - ox} {p1.y - oy}")
+            d_commands.append(f"C {p2.x - ox} {p2.y - oy}, {p3.x - ox} {p3.y - oy}, {p4.x - ox} {p4.y - oy}")
+            start_point = p4
+        elif cmd == "re":
+            r = item[1]
+            x, y, w, h = r.x0 - ox, r.y0 - oy, r.width, r.height
+            d_commands.append(f"M {x} {y} L {x+w} {y} L {x+w} {y+h} L {x} {y+h} Z")
+            start_point = fitz.Point(r.x0, r.y0)
+    return " ".join(d_commands)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("pdfs", nargs="*")
+    parser.add_argument("--precision", type=int, default=PATH_PRECISION)
+    args = parser.parse_args()
+
+    pdfs = args.pdfs or sorted(glob.glob(os.path.join(REPO_ROOT, "*.pdf")))
+
+    print(f"{'file':<24} {'page':>4} {'paths':>6} {'legacy':>10} {'compact':>10} {'saved':>10} {'ratio':>6} {'legacy t':>9} {'compact t':>9}")
+    for pdf in pdfs:
+        doc = fitz.open(pdf)
+        for page_num, page in enumerate(doc):
+            drawings = page.get_drawings()
+            if not drawings:
+                continue
+
+            start = time.perf_counter()
+            legacy = sum(len(legacy_drawings_to_svg(d["items"], d["rect"])) for d in drawings)
+            t_legacy = time.perf_counter() - start
+
+            start = time.perf_counter()
+            compact = sum(len(_drawings_to_svg(d["items"], d["rect"], args.precision)) for d in drawings)
+            t_compact = time.perf_counter() - start
+
+            ratio = legacy / compact if compact else 0
+            print(f"{os.path.basename(pdf):<24} {page_num:>4} {len(drawings):>6} {legacy:>10} {compact:>10} "
+                  f"{legacy - compact:>10} {ratio:>5.1f}x {t_legacy * 1000:>7.1f}ms {t_compact * 1000:>7.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
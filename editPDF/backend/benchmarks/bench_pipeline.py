@@ -0,0 +1,340 @@
+"""
+End-to-end benchmark of layer extraction and export.
+
+For every PDF, extracts all pages cold (fresh process, empty image store,
+no result cache) and then exports them all back in one process
+(services.pdf_creator.plan_edits, generate_pages_pdf, assemble_edits).
+Reports per-phase time (from services.metrics), layer payload bytes by
+layer type, export time and output size, and the process's peak RSS.
+Each run happens in its own process; timings are the median of --repeat
+runs.
+
+Besides the bundled sample PDFs, synthetic stress PDFs are generated
+locally: many small images, many editable paths, a vector drawing big
+enough to be flattened, and long multi-page text.
+
+Results are written as JSON (default benchmarks/results/<commit>.json);
+--compare flags metrics that got worse against an earlier results file
+and exits with status 1 if any did.
+
+Usage (from editPDF/backend):
+    python benchmarks/bench_pipeline.py                          # samples + stress PDFs
+    python benchmarks/bench_pipeline.py --compare benchmarks/results/abc1234.json
+    python benchmarks/bench_pipeline.py some.pdf --no-synthetic --repeat 5
+"""
+import argparse
+import contextlib
+import glob
+import io
+import json
+import multiprocessing
+import os
+import pathlib
+import platform
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import fitz
+
+REPO_ROOT = os.path.join(os.path.dirname(__file__), "..", "..", "..")
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+# (metric path, label) compared by --compare; all are lower-is-better
+COMPARED_METRICS = [
+    (("extract", "seconds"), "extract s"),
+    (("export", "seconds"), "export s"),
+    (("peakRssMb",), "peak RSS MB"),
+    (("extract", "payloadBytes", "total"), "payload B"),
+    (("export", "outputBytes"), "output B"),
+]
+
+
+def make_stress_pdfs(directory):
+    """
+    Writes the synthetic stress PDFs into directory and returns their paths.
+    Seeded, so every run benchmarks the same documents.
+    """
+    from PIL import Image
+
+    rnd = random.Random(0)
+    paths = []
+
+    # Many distinct small images, one per grid cell
+    doc = fitz.open()
+    page = doc.new_page()
+    for i in range(150):
+        buffer = io.BytesIO()
+        color = (rnd.randrange(256), rnd.randrange(256), rnd.randrange(256))
+        Image.new("RGB", (64, 64), color).save(buffer, "PNG")
+        x, y = 20 + (i % 12) * 48, 20 + (i // 12) * 58
+        page.insert_image(fitz.Rect(x, y, x + 40, y + 40), stream=buffer.getvalue())
+    paths.append(_save(doc, directory, "stress_images.pdf"))
+
+    # Editable paths: below the flattening threshold, so each is a layer
+    paths.append(_save(_drawing_doc(rnd, 2500), directory, "stress_paths.pdf"))
+    # Map-like drawing: above the threshold, so it becomes a background
+    paths.append(_save(_drawing_doc(rnd, 25000), directory, "stress_drawing.pdf"))
+
+    # Long text: full pages of paragraphs
+    doc = fitz.open()
+    words = ["lorem", "ipsum", "dolor", "sit", "amet", "consectetur", "adipiscing", "elit", "sed", "do"]
+    for _ in range(20):
+        page = doc.new_page()
+        text = "\n\n".join(
+            " ".join(rnd.choice(words) for _ in range(90)) for _ in range(6)
+        )
+        # insert_textbox writes nothing at all if the text doesn't fit
+        if page.insert_textbox(fitz.Rect(50, 50, 562, 742), text, fontsize=9) < 0:
+            raise RuntimeError("Stress text doesn't fit the page")
+    paths.append(_save(doc, directory, "stress_text.pdf"))
+
+    return paths
+
+
+def _drawing_doc(rnd, count):
+    doc = fitz.open()
+    page = doc.new_page()
+    shape = page.new_shape()
+    for i in range(count):
+        x, y = rnd.uniform(20, 580), rnd.uniform(20, 760)
+        if i % 3 == 0:
+            shape.draw_rect(fitz.Rect(x, y, x + rnd.uniform(2, 20), y + rnd.uniform(2, 20)))
+        else:
+            shape.draw_bezier((x, y), (x + 5, y - 5), (x + 10, y + 5), (x + 15, y))
+        # Alternate styles so coalescing-style grouping has something to do
+        shape.finish(color=(i % 2, 0, (i // 2) % 2), width=0.5)
+    shape.commit()
+    page.insert_text((40, 40), f"Synthetic drawing with {count} paths", fontsize=14)
+    return doc
+
+
+def _save(doc, directory, name):
+    path = os.path.join(directory, name)
+    doc.save(path)
+    doc.close()
+    return path
+
+
+def _peak_rss_mb():
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def _phase_seconds(phases):
+    totals = {}
+    for name, seconds, _, _ in phases:
+        totals[name] = totals.get(name, 0.0) + seconds
+    return totals
+
+
+def run_case(pdf):
+    """
+    One cold run over pdf. Meant to run in a fresh process (see main).
+    """
+    from services.image_store import image_store
+    from services.layer_extraction_service import extract_pdf_layers
+    from services.metrics import collect_phases
+    from services.overlay_export import EXPORT_REBUILD
+    from services.pdf_creator import assemble_edits, edited_pages, generate_pages_pdf, plan_edits
+
+    with tempfile.TemporaryDirectory() as store_dir:
+        # Extracted images go to a throwaway store, so none are cached yet
+        image_store.root = pathlib.Path(store_dir)
+        import_rss = _peak_rss_mb()
+
+        pages = []
+        payload = {}
+        modifications = {}
+        # The services print progress; keep it out of the report
+        quiet = contextlib.redirect_stdout(io.StringIO())
+        with quiet, collect_phases() as extract_phases:
+            start = time.perf_counter()
+            for page_num in range(len(fitz.open(pdf))):
+                page_start = time.perf_counter()
+                result = extract_pdf_layers(pdf, page_num)
+                seconds = time.perf_counter() - page_start
+                size = len(json.dumps(result, separators=(",", ":")))
+                for layer in result["layers"]:
+                    kind = "background" if layer.get("background") else layer["type"]
+                    payload[kind] = payload.get(kind, 0) + len(json.dumps(layer, separators=(",", ":")))
+                payload["total"] = payload.get("total", 0) + size
+                pages.append({
+                    "page": page_num,
+                    "seconds": seconds,
+                    "strategy": result["strategy"]["name"],
+                    "layers": len(result["layers"]),
+                    "payloadBytes": size,
+                })
+                modifications[page_num] = {
+                    "layers": result["layers"],
+                    "width": result["width"],
+                    "height": result["height"],
+                }
+            extract_seconds = time.perf_counter() - start
+
+        # Round trip: every page regenerated (overlay export would see
+        # that nothing changed and keep the pages as they are)
+        with quiet, collect_phases() as export_phases:
+            start = time.perf_counter()
+            edit_plan = plan_edits(pdf, modifications, mode=EXPORT_REBUILD)
+            generate = edited_pages(modifications, edit_plan)
+            # All on one canvas, so an image on many pages is embedded once
+            output = assemble_edits(pdf, edit_plan, [generate_pages_pdf(generate)] if generate else [])
+            export_seconds = time.perf_counter() - start
+
+    return {
+        "name": os.path.basename(pdf),
+        "fileBytes": os.path.getsize(pdf),
+        "extract": {
+            "seconds": extract_seconds,
+            "phases": _phase_seconds(extract_phases),
+            "payloadBytes": payload,
+            "pages": pages,
+        },
+        "export": {
+            "seconds": export_seconds,
+            "phases": _phase_seconds(export_phases),
+            "outputBytes": len(output),
+        },
+        "importRssMb": import_rss,
+        "peakRssMb": _peak_rss_mb(),
+    }
+
+
+def median_of_runs(runs):
+    """
+    Combines same-shaped run results: floats become their median, anything
+    else (counts, sizes, names) is taken from the first run.
+    """
+    first = runs[0]
+    if isinstance(first, dict):
+        return {key: median_of_runs([run[key] for run in runs if key in run]) for key in first}
+    if isinstance(first, list):
+        return [median_of_runs(list(items)) for items in zip(*runs)]
+    if isinstance(first, float):
+        return statistics.median(runs)
+    return first
+
+
+def _git(*args):
+    try:
+        return subprocess.run(["git", *args], cwd=REPO_ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def environment():
+    return {
+        "commit": _git("rev-parse", "--short", "HEAD"),
+        "dirty": bool(_git("status", "--porcelain", "--untracked-files=no")),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "pymupdf": fitz.VersionBind,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def _metric(case, path):
+    value = case
+    for key in path:
+        value = value.get(key) if isinstance(value, dict) else None
+    return value
+
+
+def _format(value):
+    return f"{value:,}" if isinstance(value, int) else f"{value:.4g}"
+
+
+def compare(baseline, results, threshold):
+    """
+    Prints every compared metric against the baseline. Returns the number
+    of metrics that got worse by more than threshold (a fraction).
+    """
+    before = {case["name"]: case for case in baseline["cases"]}
+    regressions = 0
+    print()
+    print(f"vs {baseline['environment'].get('commit')} ({baseline['environment'].get('timestamp')})")
+    print(f"{'file':<24} {'metric':<12} {'before':>12} {'after':>12} {'change':>8}")
+    for case in results["cases"]:
+        old = before.get(case["name"])
+        if old is None:
+            continue
+        for path, label in COMPARED_METRICS:
+            a, b = _metric(old, path), _metric(case, path)
+            if not a or b is None:
+                continue
+            change = b / a - 1
+            flag = ""
+            if change > threshold:
+                flag = "  WORSE"
+                regressions += 1
+            print(f"{case['name']:<24} {label:<12} {_format(a):>12} {_format(b):>12} {change:>+7.0%}{flag}")
+    return regressions
+
+
+def print_case(case):
+    extract, export = case["extract"], case["export"]
+    strategies = sorted({page["strategy"] for page in extract["pages"]})
+    print(f"{case['name']:<24} {len(extract['pages']):>5} {extract['seconds'] * 1000:>9.1f}ms "
+          f"{extract['payloadBytes'].get('total', 0):>10} {export['seconds'] * 1000:>9.1f}ms "
+          f"{export['outputBytes']:>10} {case['peakRssMb']:>8.1f}  {','.join(strategies)}")
+    for name, seconds in sorted(extract["phases"].items(), key=lambda item: -item[1]):
+        print(f"{'':<26}{name:<20} {seconds * 1000:>9.1f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("pdfs", nargs="*")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--no-synthetic", action="store_true", help="skip the generated stress PDFs")
+    parser.add_argument("--output", help="results file (default benchmarks/results/<commit>.json)")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10, help="change counted as a regression (default 0.10)")
+    args = parser.parse_args()
+
+    pdfs = args.pdfs or sorted(glob.glob(os.path.join(REPO_ROOT, "*.pdf")))
+    # Fresh interpreter per run: cold caches and a meaningful peak RSS
+    context = multiprocessing.get_context("spawn")
+
+    with tempfile.TemporaryDirectory() as stress_dir:
+        if not args.no_synthetic:
+            pdfs = pdfs + make_stress_pdfs(stress_dir)
+
+        print(f"{'file':<24} {'pages':>5} {'extract':>11} {'payload B':>10} {'export':>11} "
+              f"{'output B':>10} {'RSS MB':>8}  strategy")
+        cases = []
+        for pdf in pdfs:
+            runs = []
+            for _ in range(args.repeat):
+                with context.Pool(1, maxtasksperchild=1) as pool:
+                    runs.append(pool.apply(run_case, (os.path.abspath(pdf),)))
+            case = median_of_runs(runs)
+            case["runs"] = len(runs)
+            cases.append(case)
+            print_case(case)
+
+    results = {"environment": environment(), "cases": cases}
+    output = args.output or os.path.join(RESULTS_DIR, f"{results['environment']['commit'] or 'results'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nWrote {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(baseline, results, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
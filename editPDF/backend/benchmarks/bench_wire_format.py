@@ -0,0 +1,94 @@
+"""
+Compares the /process-page wire formats on each page: JSON against
+MessagePack, each uncompressed, gzipped and zstd compressed. Reports bytes
+and encode/decode time (median of --repeat runs, compression included).
+
+Usage (from editPDF/backend):
+    python benchmarks/bench_wire_format.py                 # bundled sample PDFs
+    python benchmarks/bench_wire_format.py some.pdf --repeat 50
+"""
+import argparse
+import glob
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import fitz
+from services.layer_extraction_service import extract_pdf_layers
+from services import wire_format
+
+REPO_ROOT = os.path.join(os.path.dirname(__file__), "..", "..", "..")
+
+
+def timed(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        out = fn()
+        times.append(time.perf_counter() - start)
+    return out, statistics.median(times)
+
+
+def formats():
+    """
+    (name, encode, decode) for every format that can be benchmarked here.
+    """
+    def to_json(obj):
+        return json.dumps(obj, separators=(",", ":")).encode("utf-8")
+
+    candidates = [("json", to_json, json.loads)]
+    if wire_format.msgpack is not None:
+        candidates.append(("msgpack", wire_format.pack, wire_format.unpack))
+
+    encodings = ["gzip"] + (["zstd"] if wire_format.zstandard is not None else [])
+    for name, encode, decode in list(candidates):
+        for encoding in encodings:
+            candidates.append((
+                f"{name}+{encoding}",
+                lambda obj, encode=encode, encoding=encoding: wire_format.compress(encode(obj), encoding),
+                lambda data, decode=decode, encoding=encoding: decode(wire_format.decompress(data, encoding)),
+            ))
+    return candidates
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("pdfs", nargs="*", help="PDFs to measure (default: the sample PDFs at the repository root)")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    pdfs = args.pdfs or sorted(glob.glob(os.path.join(REPO_ROOT, "*.pdf")))
+    if not pdfs:
+        sys.exit("No input PDFs: pass their paths, or run from a checkout with the sample PDFs at its root")
+    candidates = formats()
+    totals = {name: [0, 0.0, 0.0] for name, _, _ in candidates}
+
+    print(f"{'file':<24} {'page':>4} {'format':<14} {'bytes':>10} {'vs json':>8} {'encode':>9} {'decode':>9}")
+    for pdf in pdfs:
+        for page_num in range(len(fitz.open(pdf))):
+            result = extract_pdf_layers(pdf, page_num)
+            json_size = None
+            for name, encode, decode in candidates:
+                data, t_encode = timed(lambda: encode(result), args.repeat)
+                _, t_decode = timed(lambda: decode(data), args.repeat)
+                json_size = json_size or len(data)
+                totals[name][0] += len(data)
+                totals[name][1] += t_encode
+                totals[name][2] += t_decode
+                print(f"{os.path.basename(pdf):<24} {page_num:>4} {name:<14} {len(data):>10} "
+                      f"{len(data) / json_size:>7.0%} {t_encode * 1000:>7.2f}ms {t_decode * 1000:>7.2f}ms")
+
+    json_total = totals["json"][0]
+    print()
+    print(f"{'total':<29} {'format':<14} {'bytes':>10} {'vs json':>8} {'encode':>9} {'decode':>9}")
+    for name, (size, t_encode, t_decode) in totals.items():
+        print(f"{'':<29} {name:<14} {size:>10} {size / json_total:>7.0%} "
+              f"{t_encode * 1000:>7.2f}ms {t_decode * 1000:>7.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
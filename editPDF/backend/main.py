@@ -1,12 +1,17 @@
 import os
+import json
 import shutil
-from fastapi import FastAPI, UploadFile, File, Response
+import tempfile
+import asyncio
+from fastapi import FastAPI, UploadFile, File, Response, Request, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse
 from pathlib import Path
 from pydantic import BaseModel
 from typing import List, Optional, Any
 from services.pdf_creator import generate_pdf_from_json
+from services.worker_pool import get_worker_pool, shutdown_worker_pool, PoolSaturated
+from services.metrics import server_timing, render_metrics
 
 app = FastAPI()
 
@@ -17,22 +22,49 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Sprite-Layout", "Server-Timing"],
 )
 
 UPLOAD_DIR = Path("uploads")
 UPLOAD_DIR.mkdir(exist_ok=True)
 
+def _busy_response(e: PoolSaturated):
+    # Backpressure: the worker pool is full, ask the client to retry
+    print(f"Rejecting request, worker pool saturated: {e}")
+    return Response(
+        content=json.dumps({"error": "Server busy, please retry"}),
+        status_code=503,
+        media_type="application/json",
+        headers={"Retry-After": "1"},
+    )
+
 @app.get("/")
 def read_root():
     return {"message": "Live PDF Editor Backend Running"}
 
 @app.post("/upload")
-async def upload_file(file: UploadFile = File(...)):
+async def upload_file(background_tasks: BackgroundTasks, file: UploadFile = File(...)):
     file_location = UPLOAD_DIR / file.filename
-    with open(file_location, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    # Written beside the target and renamed into place: a job may still be
+    # reading an earlier upload of the same name through an open handle
+    fd, tmp_path = tempfile.mkstemp(dir=UPLOAD_DIR, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as buffer:
+            shutil.copyfileobj(file.file, buffer)
+        os.replace(tmp_path, file_location)
+    except Exception:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
     
-    # Just save the file, no processing yet
+    # Start extracting pages (first ones first) and rendering thumbnails
+    # in the background, so first visits hit the result cache
+    if PRE_EXTRACT_ON_UPLOAD:
+        background_tasks.add_task(_schedule_ingest, str(file_location))
+    if PREGENERATE_THUMBNAILS:
+        background_tasks.add_task(_schedule_thumbnails, str(file_location))
     return {
         "filename": file.filename, 
         "url": f"http://localhost:8000/files/{file.filename}"
@@ -45,6 +77,26 @@ async def get_file(filename: str):
         return FileResponse(file_path)
     return {"error": "File not found"}
 
+from services.image_store import image_store, is_valid_key, media_type_for
+
+@app.get("/images/{key}")
+async def get_image(key: str, request: Request):
+    # Keys are content addresses, so a stored image never changes
+    if not is_valid_key(key):
+        return Response(status_code=404)
+    image_path = image_store.find(key)
+    if image_path is None:
+        return Response(status_code=404)
+
+    etag = f'"{key}"'
+    headers = {
+        "ETag": etag,
+        "Cache-Control": "public, max-age=31536000, immutable",
+    }
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return FileResponse(image_path, media_type=media_type_for(image_path), headers=headers)
+
 class FormElement(BaseModel):
     id: str
     type: str
@@ -61,55 +113,390 @@ class GenerateRequest(BaseModel):
 
 @app.post("/generate")
 async def generate_pdf(req: GenerateRequest):
-    pdf_bytes = generate_pdf_from_json(
-        [e if isinstance(e, dict) else e.dict() for e in req.elements], 
-        req.width, 
-        req.height,
-        req.backgroundImage
-    )
-    return Response(content=pdf_bytes, media_type="application/pdf", headers={"Content-Disposition": "attachment; filename=generated.pdf"})
+    try:
+        future = get_worker_pool().submit(
+            generate_pdf_from_json,
+            [e if isinstance(e, dict) else e.dict() for e in req.elements], 
+            req.width, 
+            req.height,
+            req.backgroundImage
+        )
+        pdf_bytes = await asyncio.wrap_future(future)
+    except PoolSaturated as e:
+        return _busy_response(e)
+    return Response(content=pdf_bytes, media_type="application/pdf", headers={
+        "Content-Disposition": "attachment; filename=generated.pdf",
+        "Server-Timing": server_timing(future.phases),
+    })
 
 class ProcessRequest(BaseModel):
     filename: str
     page: int = 0
+    dpi: Optional[float] = None # Target DPI for image layers (None = full resolution)
+    devicePixelRatio: Optional[float] = None # Alternative to dpi: screen DPR at 100% zoom
+    stream: bool = False # Respond with NDJSON records as layers become available
+    coalescePaths: bool = False # Merge same-styled drawings into compound path layers
+
+def _target_dpi(dpi: Optional[float], device_pixel_ratio: Optional[float]) -> Optional[float]:
+    # The editor draws one CSS pixel per PDF point at 100% zoom, i.e. 72 DPI per unit of DPR
+    if dpi:
+        return dpi
+    if device_pixel_ratio:
+        return 72 * device_pixel_ratio
+    return None
 
-from services.layer_extraction_service import extract_pdf_layers
+from services.ingest_queue import (
+    ingest_queue, submit_page_extraction, submit_page_stream, submit_cached_pages, schedule_document,
+    document_status, document_page_count, PRIORITY_INTERACTIVE, PRIORITY_FIRST_PAGES, MAX_WAITING_JOBS,
+)
+
+PRE_EXTRACT_ON_UPLOAD = True
+
+async def _schedule_ingest(file_path: str):
+    try:
+        # The document and result cache are only read in the workers
+        cached = await asyncio.wrap_future(submit_cached_pages(file_path))
+        page_count = schedule_document(file_path, cached)
+        print(f"Queued {page_count} pages of {file_path} for extraction")
+    except Exception as e:
+        print(f"Could not queue {file_path} for extraction: {e}")
+
+@app.get("/status/{filename}")
+async def extraction_status(filename: str):
+    """
+    Per-page readiness of an uploaded document:
+    {"pageCount": n, "ready": k, "pages": ["ready" | "running" | "queued" | "pending", ...]}
+    """
+    file_path = UPLOAD_DIR / filename
+    if not file_path.exists():
+        return {"error": "File not found"}
+    try:
+        cached = await asyncio.wrap_future(submit_cached_pages(str(file_path), max_waiting=MAX_WAITING_JOBS))
+        return document_status(str(file_path), cached)
+    except PoolSaturated as e:
+        return _busy_response(e)
+    except Exception as e:
+        print(f"Error reading status: {e}")
+        return {"error": str(e)}
+
+from services.wire_format import encode_response, decode_request, RequestTooLarge
 
 @app.post("/process-page")
-async def process_page(req: ProcessRequest):
+async def process_page(req: ProcessRequest, request: Request):
     file_path = UPLOAD_DIR / req.filename
     if not file_path.exists():
         return {"error": "File not found"}
     
+    target_dpi = _target_dpi(req.dpi, req.devicePixelRatio)
+    if req.stream:
+        # meta first, then text/path/image layers, then a hierarchy patch.
+        # The worker writes them to a file that is sent on as it grows
+        try:
+            future, records_path = submit_page_stream(str(file_path), req.page, target_dpi, req.coalescePaths)
+        except PoolSaturated as e:
+            return _busy_response(e)
+        return StreamingResponse(
+            _stream_page_records(future, records_path),
+            media_type="application/x-ndjson"
+        )
+    
     # New Native Layer Extraction
     try:
-        result = extract_pdf_layers(str(file_path), req.page)
-        print(f"DEBUG: process-page returning: {result['width']} x {result['height']}")
-        return result
+        # Runs on the pool ahead of any queued background extraction, or
+        # joins the job if this page is already being extracted. Cached
+        # pages are answered by the worker straight from the result cache
+        future = submit_page_extraction(str(file_path), req.page, target_dpi, req.coalescePaths, priority=PRIORITY_INTERACTIVE)
+        result_json = await asyncio.wrap_future(future)
+        timing = server_timing(future.phases)
+        # JSON or MessagePack per Accept, zstd/gzip per Accept-Encoding
+        body, media_type, headers = encode_response(
+            result_json,
+            request.headers.get("accept", ""),
+            request.headers.get("accept-encoding", ""),
+        )
+        headers["Server-Timing"] = timing
+        return Response(content=body, media_type=media_type, headers=headers)
+    except PoolSaturated as e:
+        return _busy_response(e)
     except Exception as e:
         print(f"Error processing page: {e}")
         return {"error": str(e)}
 
+# How often a streamed page's records file is checked for new lines
+STREAM_POLL_SECONDS = 0.02
+
+async def _stream_page_records(future, records_path: str):
+    try:
+        with open(records_path, "rb") as f:
+            partial = b""
+            while True:
+                # Checked before reading, so nothing written before the job finished is missed
+                finished = future.done()
+                partial += f.read()
+                end = partial.rfind(b"\n") + 1
+                if end:
+                    yield partial[:end]
+                    partial = partial[end:]
+                elif finished:
+                    break
+                else:
+                    await asyncio.sleep(STREAM_POLL_SECONDS)
+        if future.exception() is not None:
+            # Headers are already sent, so report the failure as a final record
+            print(f"Error streaming page: {future.exception()}")
+            yield (json.dumps({"kind": "error", "error": str(future.exception())}) + "\n").encode("utf-8")
+    finally:
+        try:
+            os.remove(records_path)
+        except OSError:
+            pass
+
+class ProcessPagesRequest(BaseModel):
+    filename: str
+    pages: Optional[List[int]] = None # Explicit list of 0-based pages
+    start: Optional[int] = None # Range start (inclusive), used when pages is not given
+    end: Optional[int] = None # Range end (exclusive)
+    dpi: Optional[float] = None
+    devicePixelRatio: Optional[float] = None
+    coalescePaths: bool = False
+
+from services.extraction_pool import extract_page_record
+
+@app.on_event("shutdown")
+def on_shutdown():
+    shutdown_worker_pool()
+
+@app.post("/process-pages")
+async def process_pages(req: ProcessPagesRequest):
+    """
+    Extracts several pages in parallel on the process pool and streams them
+    back as NDJSON, one {"page": n, "result": {...}} line per page in
+    completion order (not page order).
+    """
+    file_path = UPLOAD_DIR / req.filename
+    if not file_path.exists():
+        return {"error": "File not found"}
+
+    try:
+        page_count = await asyncio.wrap_future(get_worker_pool().submit(document_page_count, str(file_path), affinity=str(file_path)))
+    except PoolSaturated as e:
+        return _busy_response(e)
+    except Exception as e:
+        print(f"Error opening document: {e}")
+        return {"error": str(e)}
+
+    if req.pages is not None:
+        pages = req.pages
+    else:
+        start = req.start or 0
+        end = req.end if req.end is not None else page_count
+        pages = range(start, end)
+    # De-duplicate and drop out of range pages, keeping request order
+    pages = [p for p in dict.fromkeys(pages) if 0 <= p < page_count]
+
+    # Behind interactive page loads, ahead of background pre-extraction.
+    # Admitted or turned away as a whole
+    target_dpi = _target_dpi(req.dpi, req.devicePixelRatio)
+    try:
+        futures = ingest_queue.submit_all(
+            [
+                (("record", str(file_path), p, target_dpi, req.coalescePaths),
+                 extract_page_record, (str(file_path), p, target_dpi, req.coalescePaths))
+                for p in pages
+            ],
+            priority=PRIORITY_FIRST_PAGES, max_waiting=MAX_WAITING_JOBS,
+        )
+    except PoolSaturated as e:
+        return _busy_response(e)
+    futures = [asyncio.wrap_future(f) for f in futures]
+
+    async def stream():
+        for fut in asyncio.as_completed(futures):
+            yield await fut
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+from services.thumbnail_service import find_thumbnail, render_sprite, thumbnail_options, PageOutOfRange, SPRITE_COLUMNS
+from services.ingest_queue import submit_thumbnail, schedule_thumbnails
+
+PREGENERATE_THUMBNAILS = True
+
+async def _schedule_thumbnails(file_path: str):
+    def report(fut):
+        if not fut.cancelled() and fut.exception():
+            print(f"Thumbnail pre-generation failed for {file_path}: {fut.exception()}")
+    try:
+        # Shares the page survey with _schedule_ingest when both run
+        cached = await asyncio.wrap_future(submit_cached_pages(file_path))
+        for future in schedule_thumbnails(file_path, len(cached)):
+            future.add_done_callback(report)
+    except Exception as e:
+        print(f"Could not schedule thumbnails for {file_path}: {e}")
+
+def _thumbnail_response(path, key: str, request: Request, headers: dict = None):
+    # The key covers the document hash, so it changes whenever the file does
+    etag = f'"{key}"'
+    headers = dict(headers or {}, ETag=etag)
+    headers["Cache-Control"] = "no-cache"
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return FileResponse(path, media_type=media_type_for(path), headers=headers)
+
+@app.get("/thumbnails/{filename}/sprite")
+async def get_thumbnail_sprite(filename: str, request: Request, pages: Optional[str] = None, dpi: Optional[float] = None, format: Optional[str] = None, columns: Optional[int] = None):
+    """
+    All (or the comma separated 0-based pages) thumbnails in one image.
+    Tile positions are sent as JSON in the X-Sprite-Layout header.
+    """
+    file_path = UPLOAD_DIR / filename
+    if not file_path.exists():
+        return Response(status_code=404)
+
+    try:
+        page_list = [int(p) for p in pages.split(",") if p.strip()] if pages else None
+    except ValueError:
+        return Response(status_code=400)
+
+    dpi, fmt = thumbnail_options(dpi, format)
+    columns = columns or SPRITE_COLUMNS
+    try:
+        # Pages are resolved against the document in the worker
+        path, key, layout = await asyncio.wrap_future(ingest_queue.submit(
+            ("sprite", str(file_path), tuple(page_list) if page_list is not None else None, dpi, fmt, columns),
+            render_sprite, str(file_path), page_list, dpi, fmt, columns,
+            priority=PRIORITY_INTERACTIVE,
+        ))
+    except PageOutOfRange:
+        return Response(status_code=404)
+    except Exception as e:
+        print(f"Error rendering sprite: {e}")
+        return Response(status_code=500)
+    return _thumbnail_response(path, key, request, {"X-Sprite-Layout": json.dumps(layout, separators=(",", ":"))})
+
+@app.get("/thumbnails/{filename}/{page}")
+async def get_thumbnail(filename: str, page: int, request: Request, dpi: Optional[float] = None, format: Optional[str] = None):
+    """
+    Low-DPI render of one 0-based page, cached on disk by document hash.
+    """
+    file_path = UPLOAD_DIR / filename
+    if not file_path.exists():
+        return Response(status_code=404)
+
+    dpi, fmt = thumbnail_options(dpi, format)
+    try:
+        # Already rendered: straight from disk, without waiting for a worker
+        found = await asyncio.to_thread(find_thumbnail, str(file_path), page, dpi, fmt)
+        if found is None:
+            found = await asyncio.wrap_future(submit_thumbnail(str(file_path), page, dpi, fmt))
+        path, key = found
+    except PageOutOfRange:
+        return Response(status_code=404)
+    except Exception as e:
+        print(f"Error rendering thumbnail: {e}")
+        return Response(status_code=500)
+    return _thumbnail_response(path, key, request)
+
+@app.get("/cache-stats")
+def cache_stats():
+    """
+    Cache counters of the worker processes, where the caches live, added
+    up across workers as of each one's latest task.
+    """
+    stats = get_worker_pool().worker_stats()
+    return {
+        "documentCache": stats.get("documentCache", {}),
+        "resultCache": stats.get("resultCache", {}),
+        "imageEncoding": stats.get("imageEncoding", {}),
+    }
+
+@app.get("/metrics")
+def metrics():
+    """
+    Phase timing histograms and layer/byte counters in the Prometheus text
+    format. Pool workers report their phases back with each result, so
+    these cover all workers.
+    """
+    return Response(content=render_metrics(), media_type="text/plain; version=0.0.4")
+
+@app.get("/pool-stats")
+def pool_stats():
+    """
+    Worker pool load with queue-wait and run-time totals, plus the ingest
+    queue's state.
+    """
+    return {
+        "workerPool": get_worker_pool().stats(),
+        "ingestQueue": ingest_queue.stats(),
+    }
+
 class ExportAllRequest(BaseModel):
     filename: str
     modifications: dict # { page_num: { layers: [], width, height } }
     pageOrder: Optional[List[int]] = None # New field
+    mode: str = "overlay" # "overlay": keep original page content where possible; "rebuild": regenerate edited pages
+    exportId: Optional[str] = None # Client-chosen id to poll /export-status/{exportId} with
 
-from services.pdf_creator import merge_edits_into_pdf
+from starlette.background import BackgroundTask
+from services.parallel_export import export_pdf, export_tracker, remove_export_file
 
 @app.post("/export-all")
-async def export_all(req: ExportAllRequest):
+async def export_all(request: Request):
+    # The body may be JSON or MessagePack (Content-Type), optionally
+    # gzip/zstd compressed (Content-Encoding)
+    try:
+        req = ExportAllRequest(**decode_request(
+            await request.body(),
+            request.headers.get("content-type", ""),
+            request.headers.get("content-encoding", ""),
+        ))
+    except RequestTooLarge as e:
+        return Response(
+            content=json.dumps({"error": str(e)}),
+            status_code=413,
+            media_type="application/json",
+        )
+    except Exception as e:
+        return Response(
+            content=json.dumps({"error": f"Invalid request body: {e}"}),
+            status_code=400,
+            media_type="application/json",
+        )
+
     file_path = UPLOAD_DIR / req.filename
     if not file_path.exists():
         return {"error": "File not found"}
         
     try:
-        pdf_bytes = merge_edits_into_pdf(str(file_path), req.modifications, req.pageOrder)
-        return Response(
-            content=pdf_bytes, 
-            media_type="application/pdf", 
-            headers={"Content-Disposition": "attachment; filename=exported_full.pdf"}
+        # Planned and assembled on the document's worker, which may
+        # already have it open; edited pages are generated in parallel
+        output_path, phases = await export_pdf(
+            str(file_path), req.modifications, req.pageOrder, req.mode, req.exportId
         )
+        # Streamed from disk; the file is deleted once it has been sent
+        return FileResponse(
+            output_path,
+            media_type="application/pdf",
+            headers={
+                "Content-Disposition": "attachment; filename=exported_full.pdf",
+                "Server-Timing": server_timing(phases),
+            },
+            background=BackgroundTask(remove_export_file, output_path),
+        )
+    except PoolSaturated as e:
+        return _busy_response(e)
     except Exception as e:
         print(f"Export error: {e}")
         return {"error": str(e)}
+
+@app.get("/export-status/{export_id}")
+def export_status(export_id: str):
+    """
+    Progress of an /export-all request sent with this exportId:
+    {"state": "planning" | "generating" | "assembling" | "done" | "failed",
+     "pages": pages to generate, "generated": pages generated so far,
+     "peakRss": largest worker peak RSS in bytes, ...}
+    """
+    progress = export_tracker.get(export_id)
+    if progress is None:
+        return {"error": "Unknown export"}
+    return progress
@@ -0,0 +1,15 @@
+import json
+from services.layer_extraction_service import extract_pdf_layers_json
+
+
+def extract_page_record(pdf_path: str, page_num: int, target_dpi: float = None, coalesce_paths: bool = False) -> bytes:
+    """
+    Runs in a pool worker. Returns one NDJSON line: {"page": n, "result": {...}}
+    or {"page": n, "error": "..."}. The cached layer JSON is spliced in as-is
+    rather than parsed and re-serialized.
+    """
+    try:
+        result_json = extract_pdf_layers_json(pdf_path, page_num, target_dpi, coalesce_paths)
+    except Exception as e:
+        return json.dumps({"page": page_num, "error": str(e)}).encode("utf-8") + b"\n"
+    return b'{"page":%d,"result":' % page_num + result_json + b"}\n"
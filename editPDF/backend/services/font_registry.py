@@ -0,0 +1,387 @@
+import difflib
+import hashlib
+import json
+import logging
+import os
+import re
+import struct
+import tempfile
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+
+try:
+    import fontTools  # Converts CFF (.otf) faces to TrueType for ReportLab
+except ImportError:  # CFF faces fall back to built-in fonts
+    fontTools = None
+
+logger = logging.getLogger(__name__)
+
+FONTS_DIR = Path(__file__).resolve().parent.parent.parent / "fonts"
+FONT_INDEX_PATH = Path("cache/fonts/index.json")
+# TrueType copies of CFF faces, made the first time a face is used
+CONVERTED_DIR = Path("cache/fonts/truetype")
+# Bump when the index entry format changes
+FONT_INDEX_VERSION = 1
+
+# Parsed faces kept registered with ReportLab; a TTFont holds its whole font file
+MAX_LOADED_FONTS = 32
+# difflib ratio a family name needs to count as a fuzzy match
+FUZZY_CUTOFF = 0.85
+# Largest deviation (font units) of the quadratic curves replacing a CFF
+# face's cubic ones; fontTools' own default
+CU2QU_MAX_ERR = 1.0
+DEFAULT_FONT = "Helvetica"
+
+# Built-in ReportLab fonts, chosen when a family name contains the fragment
+STANDARD_FONTS = [
+    ("times", "Times-Roman"),
+    ("courier", "Courier"),
+    ("helvetica", "Helvetica"),
+    ("arial", "Helvetica"),
+]
+
+FONT_EXTENSIONS = (".ttf", ".otf")
+
+# Trailing words that don't tell families apart ("Lato Regular" is "Lato")
+_NEUTRAL_SUFFIX_RE = re.compile(r"(regular|normal|book|plain|roman)$")
+# Weight/style suffixes, dropped to fall back to the family's regular face
+_STYLE_SUFFIX_RE = re.compile(r"(bold|italic|oblique|semibold|light|medium|black|heavy|thin|condensed|mt|ps)$")
+# Subset prefix of embedded PDF fonts, e.g. "ABCDEF+Roboto-Regular"
+_SUBSET_PREFIX_RE = re.compile(r"^[A-Z]{6}\+")
+
+
+def normalize_family(name: str) -> str:
+    """
+    Lowercase alphanumerics of a family name, without a subset prefix or
+    a trailing "Regular".
+    """
+    name = _SUBSET_PREFIX_RE.sub("", name or "")
+    name = re.sub(r"[^0-9a-z]", "", name.lower())
+    return _NEUTRAL_SUFFIX_RE.sub("", name) or name
+
+
+def _strip_styles(key: str) -> str:
+    while True:
+        stripped = _STYLE_SUFFIX_RE.sub("", key)
+        if stripped == key or not stripped:
+            return key
+        key = stripped
+
+
+def _sfnt_tables(path: Path) -> set:
+    """
+    Table tags of a TrueType/OpenType file, read from its header only.
+    """
+    with open(path, "rb") as f:
+        header = f.read(12)
+        if len(header) < 12:
+            return set()
+        count = struct.unpack(">H", header[4:6])[0]
+        directory = f.read(16 * count)
+    return {directory[i:i + 4].decode("latin-1") for i in range(0, len(directory), 16)}
+
+
+def _convert_cff(src: Path, dst: Path):
+    """
+    Writes a TrueType copy of a CFF-flavoured OpenType font, its cubic
+    outlines approximated by quadratic ones (fontTools' otf2ttf recipe).
+    Hinting is dropped; metrics, cmap and names are kept.
+    """
+    from fontTools.ttLib import TTFont as OpenTypeFont, newTable
+    from fontTools.pens.cu2quPen import Cu2QuPen
+    from fontTools.pens.ttGlyphPen import TTGlyphPen
+
+    font = OpenTypeFont(str(src))
+    if font.sfntVersion != "OTTO" or "CFF " not in font:
+        raise ValueError("not a CFF OpenType font")
+
+    glyph_order = font.getGlyphOrder()
+    glyph_set = font.getGlyphSet()
+    glyf = newTable("glyf")
+    glyf.glyphOrder = glyph_order
+    glyf.glyphs = {}
+    for name in glyph_order:
+        pen = TTGlyphPen(glyph_set)
+        glyph_set[name].draw(Cu2QuPen(pen, CU2QU_MAX_ERR, reverse_direction=True))
+        glyf.glyphs[name] = pen.glyph()
+
+    font["loca"] = newTable("loca")
+    font["glyf"] = glyf
+    del font["CFF "]
+    if "VORG" in font:
+        del font["VORG"]
+    glyf.compile(font)
+    hmtx = font["hmtx"]
+    for name, glyph in glyf.glyphs.items():
+        if hasattr(glyph, "xMin"):
+            hmtx[name] = (hmtx[name][0], glyph.xMin)
+
+    maxp = font["maxp"] = newTable("maxp")
+    maxp.tableVersion = 0x00010000
+    maxp.maxZones = 1
+    maxp.maxTwilightPoints = 0
+    maxp.maxStorage = 0
+    maxp.maxFunctionDefs = 0
+    maxp.maxInstructionDefs = 0
+    maxp.maxStackElements = 0
+    maxp.maxSizeOfInstructions = 0
+    maxp.maxComponentElements = max((len(getattr(g, "components", [])) for g in glyf.glyphs.values()), default=0)
+    maxp.compile(font)
+
+    post = font["post"]
+    post.formatType = 2.0
+    post.extraNames = []
+    post.mapping = {}
+    post.glyphOrder = glyph_order
+    font["head"].glyphDataFormat = 0
+    font.sfntVersion = "\000\001\000\000"
+
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=dst.parent, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            font.save(f)
+        os.replace(tmp_path, dst)
+    except Exception:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def _index_entry(path: Path) -> dict:
+    import fitz  # PyMuPDF, only needed to read names while indexing
+
+    tables = _sfnt_tables(path)
+    try:
+        family = fitz.Font(fontfile=str(path)).name
+    except Exception:
+        family = path.stem
+    return {
+        "file": path.name,
+        "family": family,
+        # ReportLab only embeds TrueType outlines; CFF (.otf) faces are
+        # converted on first use (see _convert_cff)
+        "truetype": "glyf" in tables,
+    }
+
+
+class FontRegistry:
+    """
+    Maps text layer fontFamily names to ReportLab fonts, on demand.
+    ReportLab only embeds TrueType outlines, so CFF (.otf) faces are
+    converted to TrueType once and the copies kept on disk.
+
+    The font directory is indexed once (family name and outline format per
+    file) and the index is kept on disk, keyed by the directory listing, so
+    start-up never touches the font files. A face is parsed and registered
+    with ReportLab the first time a layer uses it; at most max_loaded faces
+    stay registered, least recently used first out, and only while no
+    canvas in this process is using fonts (see drawing).
+
+    Names are matched exactly after normalization, then with weight/style
+    suffixes dropped, then against ReportLab's built-in families, and
+    finally fuzzily; anything else gets DEFAULT_FONT.
+    """
+
+    def __init__(self, fonts_dir: Path = FONTS_DIR, index_path: Path = FONT_INDEX_PATH, max_loaded: int = MAX_LOADED_FONTS,
+                 converted_dir: Path = CONVERTED_DIR):
+        self.fonts_dir = Path(fonts_dir)
+        self.index_path = Path(index_path)
+        self.converted_dir = Path(converted_dir)
+        self.max_loaded = max_loaded
+        self._lock = threading.RLock()
+        self._by_key = None  # normalized name -> index entry
+        self._resolved = {}  # fontFamily -> ReportLab font name
+        self._loaded = OrderedDict()  # ReportLab font name -> TTFont
+        self._drawing = 0  # Canvases open in this process
+        self.loads = 0
+        self.evictions = 0
+        self.conversions = 0
+
+    def _listing(self):
+        if not self.fonts_dir.is_dir():
+            return []
+        listing = []
+        for entry in os.scandir(self.fonts_dir):
+            if entry.name.lower().endswith(FONT_EXTENSIONS) and entry.is_file():
+                st = entry.stat()
+                listing.append((entry.name, st.st_size, st.st_mtime_ns))
+        return sorted(listing)
+
+    def _load_index(self) -> list:
+        listing = self._listing()
+        signature = hashlib.sha256(json.dumps([FONT_INDEX_VERSION, listing]).encode("utf-8")).hexdigest()
+        try:
+            with open(self.index_path) as f:
+                index = json.load(f)
+            if index.get("signature") == signature:
+                return index["fonts"]
+        except (OSError, ValueError, KeyError):
+            pass
+
+        fonts = []
+        for name, _, _ in listing:
+            try:
+                fonts.append(_index_entry(self.fonts_dir / name))
+            except Exception as e:
+                logger.warning("Failed to index font %s: %s", name, e)
+        self._save_index({"signature": signature, "fonts": fonts})
+        return fonts
+
+    def _save_index(self, index: dict):
+        try:
+            self.index_path.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.index_path.parent, suffix=".tmp")
+            with os.fdopen(fd, "w") as f:
+                json.dump(index, f)
+            os.replace(tmp_path, self.index_path)
+        except OSError as e:
+            # Still usable, just rebuilt next time
+            logger.warning("Failed to write font index: %s", e)
+
+    def _keys(self) -> dict:
+        if self._by_key is None:
+            fonts = self._load_index()
+            by_key = {}
+            for entry in fonts:
+                # File names are what the editor offers; they win over
+                # (possibly truncated) names from the font's name table
+                by_key.setdefault(normalize_family(Path(entry["file"]).stem), entry)
+            for entry in fonts:
+                by_key.setdefault(normalize_family(entry["family"]), entry)
+            self._by_key = by_key
+        return self._by_key
+
+    def match(self, family: str):
+        """
+        The index entry for a family name, or None if it matches no
+        installed font.
+        """
+        with self._lock:
+            keys = self._keys()
+            key = normalize_family(family)
+            if not key:
+                return None
+            entry = keys.get(key) or keys.get(_strip_styles(key))
+            if entry is not None:
+                return entry
+            if any(fragment in key for fragment, _ in STANDARD_FONTS):
+                return None
+            close = difflib.get_close_matches(key, keys.keys(), n=1, cutoff=FUZZY_CUTOFF)
+            return keys[close[0]] if close else None
+
+    def font_file(self, family: str):
+        """
+        Path of the installed font file for a family name, or None.
+        """
+        entry = self.match(family)
+        return self.fonts_dir / entry["file"] if entry else None
+
+    def reportlab_font(self, family: str) -> str:
+        """
+        Name of a registered ReportLab font for a layer's fontFamily,
+        parsing and registering the matching face if it isn't loaded.
+        """
+        with self._lock:
+            name = self._resolved.get(family)
+            if name is None:
+                name = self._resolve(family)
+                self._resolved[family] = name
+            if name in self._loaded:
+                self._loaded.move_to_end(name)
+            elif name not in _builtin_names():
+                name = self._register(name, family)
+            return name
+
+    def _resolve(self, family: str) -> str:
+        entry = self.match(family)
+        if entry is not None and (entry["truetype"] or fontTools is not None):
+            return Path(entry["file"]).stem
+        key = normalize_family(family)
+        for fragment, builtin in STANDARD_FONTS:
+            if fragment in key:
+                return builtin
+        return DEFAULT_FONT
+
+    def _register(self, name: str, family: str) -> str:
+        from reportlab.pdfbase import pdfmetrics
+        from reportlab.pdfbase.ttfonts import TTFont
+
+        entry = self.match(family)
+        try:
+            path = self.fonts_dir / entry["file"]
+            if not entry["truetype"]:
+                path = self._truetype_copy(path)
+            font = TTFont(name, str(path))
+        except Exception as e:
+            logger.warning("Failed to load font %s: %s", entry["file"], e)
+            self._resolved[family] = DEFAULT_FONT
+            return DEFAULT_FONT
+        pdfmetrics.registerFont(font)
+        self._loaded[name] = font
+        self.loads += 1
+        return name
+
+    def _truetype_copy(self, path: Path) -> Path:
+        """
+        The TrueType conversion of a CFF face, converting it the first time.
+        Kept on disk, keyed by the source file's name, size and mtime.
+        """
+        st = path.stat()
+        digest = hashlib.sha256(f"{path.name}:{st.st_size}:{st.st_mtime_ns}".encode("utf-8")).hexdigest()[:16]
+        converted = self.converted_dir / f"{path.stem}-{digest}.ttf"
+        if not converted.exists():
+            _convert_cff(path, converted)
+            self.conversions += 1
+        return converted
+
+    @contextmanager
+    def drawing(self):
+        """
+        Wraps the life of a canvas, from creation to save: a canvas looks
+        its fonts up again when it is saved, so none are unregistered until
+        every open canvas is done. Faces beyond max_loaded are dropped when
+        a canvas starts while no other is open.
+        """
+        with self._lock:
+            if not self._drawing:
+                self._trim()
+            self._drawing += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._drawing -= 1
+
+    def _trim(self):
+        from reportlab.pdfbase import pdfmetrics
+
+        while len(self._loaded) > self.max_loaded:
+            name, font = self._loaded.popitem(last=False)
+            # ReportLab has no unregister; these are its registries
+            pdfmetrics._fonts.pop(name, None)
+            pdfmetrics._dynFaceNames.pop(font.face.name, None)
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "indexed": len({entry["file"] for entry in self._by_key.values()}) if self._by_key else 0,
+                "loaded": len(self._loaded),
+                "max_loaded": self.max_loaded,
+                "loads": self.loads,
+                "evictions": self.evictions,
+                "conversions": self.conversions,
+            }
+
+
+def _builtin_names():
+    from reportlab.pdfbase import pdfmetrics
+    return pdfmetrics.standardFonts
+
+
+font_registry = FontRegistry()
@@ -0,0 +1,128 @@
+import base64
+import hashlib
+import os
+import re
+import tempfile
+from pathlib import Path
+from services.result_cache import BoundedDirectory
+
+IMAGE_DIR = Path("cache/images")
+DEFAULT_MAX_BYTES = 2 * 1024 * 1024 * 1024  # 2 GB
+PUBLIC_URL = "http://localhost:8000"
+
+MIME_TYPES = {
+    "png": "image/png",
+    "jpeg": "image/jpeg",
+    "jpg": "image/jpeg",
+    "jpx": "image/jp2",
+    "webp": "image/webp",
+}
+
+_KEY_RE = re.compile(r"^[0-9a-f]{64}$")
+_URL_RE = re.compile(r"/images/([0-9a-f]{64})(?:[?#].*)?$")
+# Image URLs inside serialized layers
+_URL_IN_JSON_RE = re.compile(rb"/images/([0-9a-f]{64})")
+
+
+def image_key(doc_hash: str, xref: int, variant: str = "") -> str:
+    """
+    Content address of an extracted image: the same xref in the same
+    document always maps to the same key, whichever page it appears on.
+    """
+    return hashlib.sha256(f"{doc_hash}:{xref}:{variant}".encode("utf-8")).hexdigest()
+
+
+def is_valid_key(key: str) -> bool:
+    return bool(_KEY_RE.match(key))
+
+
+def image_url(key: str) -> str:
+    return f"{PUBLIC_URL}/images/{key}"
+
+
+class ImageStore(BoundedDirectory):
+    """
+    Write-once on-disk store of extracted images, one file per key.
+    Since keys are derived from the source document hash, stored files never
+    change and can be served with immutable cache headers.
+
+    Bounded like the result cache: past max_bytes the least recently found
+    images are deleted. Extraction re-creates them (see has_all).
+    """
+
+    def __init__(self, root: Path = IMAGE_DIR, max_bytes: int = DEFAULT_MAX_BYTES):
+        super().__init__(root, max_bytes)
+
+    def _dir(self, key: str) -> Path:
+        return self.root / key[:2]
+
+    def find(self, key: str):
+        """
+        Returns the stored file path for key, or None.
+        """
+        directory = self._dir(key)
+        for ext in MIME_TYPES:
+            path = directory / f"{key}.{ext}"
+            if path.exists():
+                self._touch(path)
+                return path
+        return None
+
+    def has_all(self, serialized: bytes) -> bool:
+        """
+        Whether every /images/{key} URL in serialized layers is still
+        stored (marking them used), i.e. whether a cached result can be
+        served as it is.
+        """
+        return all(self.find(key.decode("ascii")) is not None for key in set(_URL_IN_JSON_RE.findall(serialized)))
+
+    def put(self, key: str, data: bytes, ext: str = "png") -> Path:
+        directory = self._dir(key)
+        directory.mkdir(parents=True, exist_ok=True)
+        path = directory / f"{key}.{ext}"
+
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except Exception:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+        self._added(len(data))
+        return path
+
+    def get_bytes(self, key: str):
+        path = self.find(key)
+        if path is None:
+            return None
+        with open(path, "rb") as f:
+            return f.read()
+
+
+image_store = ImageStore()
+
+
+def media_type_for(path: Path) -> str:
+    return MIME_TYPES.get(path.suffix.lstrip("."), "application/octet-stream")
+
+
+def load_image_src(src: str):
+    """
+    Resolves a layer's image src to raw bytes. Accepts both inline data URLs
+    (user-inserted images) and /images/{key} URLs produced by extraction.
+    Returns None if the src can't be resolved.
+    """
+    if not src:
+        return None
+    if src.startswith("data:image"):
+        header, encoded = src.split(",", 1)
+        return base64.b64decode(encoded)
+
+    match = _URL_RE.search(src)
+    if match:
+        return image_store.get_bytes(match.group(1))
+    return None
@@ -0,0 +1,327 @@
+import heapq
+import itertools
+import os
+import tempfile
+import threading
+from collections import Counter
+from concurrent.futures import Future
+from pathlib import Path
+from services.worker_pool import get_worker_pool, PoolSaturated
+from services.layer_extraction_service import extract_pdf_layers_json, has_cached_pdf_layers, write_pdf_layers_ndjson, document_cache
+from services.thumbnail_service import render_thumbnail, DEFAULT_THUMBNAIL_DPI, DEFAULT_THUMBNAIL_FORMAT
+
+# Lower runs first
+PRIORITY_INTERACTIVE = 0  # A user is waiting on this page
+PRIORITY_FIRST_PAGES = 1  # Pages a user will open first after upload
+PRIORITY_BACKGROUND = 2   # Everything else
+
+# Pages of a fresh upload extracted ahead of the rest
+INGEST_FIRST_PAGES = 3
+# Jobs the queue keeps in each worker; more would hide them from re-prioritizing
+IN_FLIGHT_PER_WORKER = 1
+# Jobs waiting in the whole queue, at the submitted priority or above, before
+# bounded submissions get a 503. Unlike the pool's MAX_QUEUE_DEPTH, not per worker
+MAX_WAITING_JOBS = int(os.environ.get("EDITPDF_MAX_WAITING_JOBS") or 8)
+
+# Streamed page extractions are written here by the worker and read back as they grow
+STREAM_DIR = Path("cache/streams")
+
+
+class _Job:
+    __slots__ = ("key", "fn", "args", "priority", "affinity", "future", "state")
+
+    def __init__(self, key, fn, args, priority, affinity):
+        self.key = key
+        self.fn = fn
+        self.args = args
+        self.priority = priority
+        self.affinity = affinity
+        self.future = Future()
+        self.state = "queued"  # -> "running" -> removed once done
+
+
+class IngestQueue:
+    """
+    Priority queue in front of the worker pool.
+
+    Worker lanes run work in submission order, so handing them every page
+    of an upload at once would put an interactive request behind the whole
+    document. Instead jobs wait here and a dispatcher thread keeps at most
+    in_flight_per_worker of them in each lane, always taking the most
+    urgent job whose lane has room. Jobs with an affinity (the document
+    path) go to that document's lane. Jobs are de-duplicated by key:
+    submitting a key that is already queued returns the same future and can
+    only raise its priority.
+    """
+
+    def __init__(self, in_flight_per_worker: int = IN_FLIGHT_PER_WORKER):
+        self.in_flight_per_worker = in_flight_per_worker
+        self._heap = []  # (priority, seq, job); stale entries are skipped on pop
+        self._jobs = {}  # key -> queued or running job
+        self._seq = itertools.count()
+        self._waiting = Counter()  # priority -> queued jobs
+        self._busy = Counter()  # lane -> jobs in flight
+        self._cond = threading.Condition()
+        self._thread = None
+        self.completed = 0
+        self.failed = 0
+
+    def submit(self, key, fn, *args, priority: int = PRIORITY_BACKGROUND, affinity=None, max_waiting: int = None) -> Future:
+        """
+        Schedules fn(*args) on the worker pool. Returns a
+        concurrent.futures.Future for its result, carrying the run's
+        phase timings like the pool's own futures.
+        With max_waiting, raises PoolSaturated if that many jobs of the same
+        or higher priority are already waiting; lower priority work never
+        causes a rejection.
+        """
+        return self.submit_all([(key, fn, args)], priority=priority, affinity=affinity, max_waiting=max_waiting)[0]
+
+    def submit_all(self, jobs: list, priority: int = PRIORITY_BACKGROUND, affinity=None, max_waiting: int = None) -> list:
+        """
+        submit for several (key, fn, args) jobs, returning their futures.
+        The jobs are admitted or rejected together: max_waiting is checked
+        once, against the jobs waiting before this call.
+        """
+        with self._cond:
+            if max_waiting is not None and any(self._needs_queueing(key, priority) for key, _, _ in jobs):
+                if sum(self._waiting[p] for p in range(priority + 1)) >= max_waiting:
+                    raise PoolSaturated(f"{max_waiting} jobs already waiting")
+            futures = [self._enqueue(key, fn, args, priority, affinity) for key, fn, args in jobs]
+            self._ensure_dispatcher()
+            self._cond.notify()
+            return futures
+
+    def _needs_queueing(self, key, priority) -> bool:
+        job = self._jobs.get(key)
+        return job is None or (job.state == "queued" and priority < job.priority)
+
+    def _enqueue(self, key, fn, args, priority, affinity) -> Future:
+        if not self._needs_queueing(key, priority):
+            return self._jobs[key].future
+        job = self._jobs.get(key)
+        if job is None:
+            job = _Job(key, fn, args, priority, affinity)
+            self._jobs[key] = job
+        else:
+            self._waiting[job.priority] -= 1
+        # New job, or an existing one jumping ahead: the older heap
+        # entry (if any) is now stale
+        job.priority = priority
+        self._waiting[priority] += 1
+        heapq.heappush(self._heap, (priority, next(self._seq), job))
+        return job.future
+
+    def state(self, key):
+        """
+        "queued", "running", or None if the key isn't scheduled.
+        """
+        with self._cond:
+            job = self._jobs.get(key)
+            return job.state if job else None
+
+    def _ensure_dispatcher(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._dispatch, name="ingest-dispatcher", daemon=True)
+            self._thread.start()
+
+    def _next_job(self, pool):
+        """
+        Pops the most urgent queued job whose lane has room.
+        Returns (job, lane), or (None, None) if nothing can run yet.
+        """
+        if all(self._busy[i] >= self.in_flight_per_worker for i in range(pool.size)):
+            return None, None
+        blocked = []
+        found = (None, None)
+        while self._heap:
+            entry = heapq.heappop(self._heap)
+            priority, _, job = entry
+            if job.state != "queued" or priority != job.priority:
+                continue  # Stale entry
+            if job.affinity is not None:
+                lane = pool.lane_for(job.affinity)
+            else:
+                lane = min(range(pool.size), key=lambda i: self._busy[i])
+            if self._busy[lane] >= self.in_flight_per_worker:
+                blocked.append(entry)
+                continue
+            found = (job, lane)
+            break
+        for entry in blocked:
+            heapq.heappush(self._heap, entry)
+        return found
+
+    def _dispatch(self):
+        while True:
+            pool = get_worker_pool()
+            with self._cond:
+                job, lane = self._next_job(pool)
+                if job is None:
+                    self._cond.wait()
+                    continue
+                job.state = "running"
+                self._waiting[job.priority] -= 1
+                self._busy[lane] += 1
+
+            try:
+                # The queue bounds its own in-flight work
+                pool_future = pool.submit(job.fn, *job.args, lane=lane, bounded=False)
+            except Exception as e:
+                self._finish(job, lane, None, e)
+                continue
+            pool_future.add_done_callback(lambda f, job=job, lane=lane: self._on_done(job, lane, f))
+
+    def _on_done(self, job, lane, pool_future):
+        if pool_future.cancelled():
+            self._finish(job, lane, None, RuntimeError("Worker pool shut down"))
+        elif pool_future.exception() is not None:
+            self._finish(job, lane, None, pool_future.exception())
+        else:
+            # Pass the run's phase timings on to whoever awaits the job
+            job.future.phases = pool_future.phases
+            self._finish(job, lane, pool_future.result(), None)
+
+    def _finish(self, job, lane, result, error):
+        with self._cond:
+            self._busy[lane] -= 1
+            if self._jobs.get(job.key) is job:
+                del self._jobs[job.key]
+            if error is None:
+                self.completed += 1
+            else:
+                self.failed += 1
+            self._cond.notify()
+        if error is None:
+            job.future.set_result(result)
+        else:
+            job.future.set_exception(error)
+
+    def stats(self) -> dict:
+        with self._cond:
+            states = [job.state for job in self._jobs.values()]
+            return {
+                "queued": states.count("queued"),
+                "running": states.count("running"),
+                "completed": self.completed,
+                "failed": self.failed,
+            }
+
+
+ingest_queue = IngestQueue()
+
+
+def layers_job_key(pdf_path: str, page_num: int, target_dpi: float = None, coalesce_paths: bool = False):
+    return ("layers", pdf_path, page_num, round(target_dpi) if target_dpi else None, coalesce_paths)
+
+
+def submit_page_extraction(pdf_path: str, page_num: int, target_dpi: float = None, coalesce_paths: bool = False,
+                           priority: int = PRIORITY_INTERACTIVE) -> Future:
+    """
+    Queues extract_pdf_layers_json for one page. Resolves to the page's
+    serialized JSON; the worker also fills the shared result cache.
+    Routed to the document's worker, whose open handle is reused.
+    Interactive submissions are bounded: past MAX_WAITING_JOBS waiting
+    interactive jobs they raise PoolSaturated.
+    """
+    key = layers_job_key(pdf_path, page_num, target_dpi, coalesce_paths)
+    max_waiting = MAX_WAITING_JOBS if priority == PRIORITY_INTERACTIVE else None
+    return ingest_queue.submit(key, extract_pdf_layers_json, pdf_path, page_num, target_dpi, coalesce_paths,
+                               priority=priority, affinity=pdf_path, max_waiting=max_waiting)
+
+
+def submit_thumbnail(pdf_path: str, page_num: int, dpi: int, fmt: str, priority: int = PRIORITY_INTERACTIVE) -> Future:
+    """
+    Queues render_thumbnail for one page. Resolves to (path, key).
+    Not tied to the document's worker, so a page of thumbnails spreads
+    over all workers, and never rejected: thumbnails are <img> requests,
+    which browsers don't retry.
+    """
+    return ingest_queue.submit(("thumbnail", pdf_path, page_num, dpi, fmt), render_thumbnail, pdf_path, page_num, dpi, fmt,
+                               priority=priority)
+
+
+def schedule_thumbnails(pdf_path: str, page_count: int, dpi: int = DEFAULT_THUMBNAIL_DPI, fmt: str = DEFAULT_THUMBNAIL_FORMAT) -> list:
+    """
+    Queues every page's thumbnail in the background, one job per page, so
+    the pages requested first jump ahead of the rest and a long document
+    never holds up other work. Returns the jobs' futures.
+    """
+    return [submit_thumbnail(pdf_path, page_num, dpi, fmt, priority=PRIORITY_BACKGROUND) for page_num in range(page_count)]
+
+
+def document_page_count(pdf_path: str) -> int:
+    """
+    Runs in a worker: the document's page count.
+    """
+    return len(document_cache.get(pdf_path))
+
+
+def cached_pages(pdf_path: str) -> list:
+    """
+    Runs in a worker: whether each page's default-variant extraction is
+    in the result cache, one entry per page.
+    """
+    return [has_cached_pdf_layers(pdf_path, page_num) for page_num in range(len(document_cache.get(pdf_path)))]
+
+
+def submit_cached_pages(pdf_path: str, max_waiting: int = None) -> Future:
+    """
+    Queues cached_pages on the document's worker, ahead of its extraction
+    work. Concurrent calls for one document share the job.
+    """
+    return ingest_queue.submit(("cached", pdf_path), cached_pages, pdf_path,
+                               priority=PRIORITY_INTERACTIVE, affinity=pdf_path, max_waiting=max_waiting)
+
+
+def schedule_document(pdf_path: str, cached: list, first_pages: int = INGEST_FIRST_PAGES) -> int:
+    """
+    Queues default-variant extraction of every page of a freshly uploaded
+    document: the first pages right away, the rest in the background.
+    cached is the document's cached_pages; those pages are skipped.
+    Returns the page count.
+    """
+    for page_num, ready in enumerate(cached):
+        if ready:
+            continue  # Same file uploaded before
+        priority = PRIORITY_FIRST_PAGES if page_num < first_pages else PRIORITY_BACKGROUND
+        submit_page_extraction(pdf_path, page_num, priority=priority)
+    return len(cached)
+
+
+def document_status(pdf_path: str, cached: list) -> dict:
+    """
+    Per-page readiness of a document's default-variant extraction, from
+    its cached_pages: "ready" (in the result cache), "running", "queued"
+    or "pending" (not scheduled, will be extracted on first visit).
+    """
+    pages = []
+    for page_num, ready in enumerate(cached):
+        if ready:
+            pages.append("ready")
+        else:
+            pages.append(ingest_queue.state(layers_job_key(pdf_path, page_num)) or "pending")
+    return {
+        "pageCount": len(cached),
+        "ready": pages.count("ready"),
+        "pages": pages,
+    }
+
+
+def submit_page_stream(pdf_path: str, page_num: int, target_dpi: float = None, coalesce_paths: bool = False):
+    """
+    Queues write_pdf_layers_ndjson for one page into a new file in
+    STREAM_DIR, on the document's worker. Returns (future, file path);
+    the caller streams the file as it grows and then deletes it.
+    Bounded like interactive extraction.
+    """
+    STREAM_DIR.mkdir(parents=True, exist_ok=True)
+    fd, path = tempfile.mkstemp(dir=STREAM_DIR, suffix=".ndjson")
+    os.close(fd)
+    try:
+        future = ingest_queue.submit(("stream", path), write_pdf_layers_ndjson, path, pdf_path, page_num, target_dpi, coalesce_paths,
+                                     priority=PRIORITY_INTERACTIVE, affinity=pdf_path, max_waiting=MAX_WAITING_JOBS)
+    except Exception:
+        os.remove(path)
+        raise
+    return future, path
@@ -1,26 +1,193 @@
 import fitz  # PyMuPDF
-import base64
 import io
+import bisect
+import html
+import itertools
+import json
+import math
+import os
+import re
+import threading
+from collections import OrderedDict, Counter
+from services.result_cache import result_cache, file_sha256
+from services.image_store import image_store, image_key, image_url
+from services.spatial_index import ContainmentIndex, IntervalIndex
+from services.svg_path import PathEncoder
+from services.metrics import Phase, timed, register_worker_stats
+from services.page_strategy import scan_page, choose_strategy, STRATEGY_FULL, STRATEGY_TEXT_ONLY
 
-def extract_pdf_layers(pdf_path: str, page_num: int = 0):
+# TextPage flags shared by text and image extraction: get_text("dict")'s
+# defaults. They include TEXT_PRESERVE_IMAGES, since image blocks give the
+# image placements and also end text blocks.
+TEXT_FLAGS = fitz.TEXTFLAGS_DICT
+# In TextPage.extractXML output: a top-level block (text or image, in
+# block order), or a font run with its first character. MuPDF writes one
+# element per line, each font's characters right after it.
+XML_STYLE_RE = re.compile(r'^<(block|image)\b|^<font name="([^"]*)" size="([^"]*)">\n<char [^>]*?\bcolor="#([0-9a-fA-F]{6})"', re.M)
+
+# Bump whenever the shape or content of extract_pdf_layers output changes,
+# so stale entries in the persistent result cache are never served.
+EXTRACTOR_VERSION = 6
+
+
+class DocumentCache:
+    """
+    Bounded LRU cache of open fitz.Document handles.
+
+    Re-opening a large PDF re-parses its xref table and page tree, which we
+    would otherwise pay on every /process-page call while the user pages
+    through a document. Entries are keyed by (path, mtime, size) so a
+    re-uploaded file with the same name is never served from a stale handle.
+    Evicts by entry count and by an estimate of the memory each document
+    holds; evicted handles are closed.
+    """
+
+    # Rough per-page overhead of a parsed page tree entry, on top of the file size
+    PAGE_OVERHEAD_BYTES = 4096
+
+    def __init__(self, max_entries: int = 8, max_bytes: int = 512 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (doc, estimated_bytes)
+        self._lock = threading.RLock()
+        self._total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, pdf_path: str):
+        """
+        Returns an open document for pdf_path, opening it on a miss.
+        """
+        path = os.path.abspath(pdf_path)
+        st = os.stat(path)
+        key = (path, st.st_mtime_ns, st.st_size)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+
+            self.misses += 1
+            # Drop handles for older versions of the same file
+            for stale_key in [k for k in self._entries if k[0] == path]:
+                self._evict(stale_key)
+
+            doc = fitz.open(path)
+            estimated = st.st_size + len(doc) * self.PAGE_OVERHEAD_BYTES
+            self._entries[key] = (doc, estimated)
+            self._total_bytes += estimated
+
+            # Always keep the document we just opened, even if it alone exceeds the budget
+            while len(self._entries) > 1 and (
+                len(self._entries) > self.max_entries or self._total_bytes > self.max_bytes
+            ):
+                self._evict(next(iter(self._entries)))
+
+            return doc
+
+    def _evict(self, key):
+        doc, estimated = self._entries.pop(key)
+        self._total_bytes -= estimated
+        self.evictions += 1
+        try:
+            doc.close()
+        except Exception as e:
+            print(f"Failed to close cached document {key[0]}: {e}")
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._entries):
+                self._evict(key)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "estimated_bytes": self._total_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+document_cache = DocumentCache()
+
+# Reported to the parent with every pool result, for /cache-stats. The
+# result cache's size is left out: each worker only estimates the shared
+# directory, so the estimates don't add up
+register_worker_stats("documentCache", document_cache.stats)
+register_worker_stats("resultCache", lambda: {"hits": result_cache.hits, "misses": result_cache.misses})
+
+
+def extract_pdf_layers(pdf_path: str, page_num: int = 0, target_dpi: float = None, coalesce_paths: bool = False):
     """
     Extracts PDF content as a list of independent layers:
     - Text Layers
     - Image Layers
     - Path/Vector Layers
     
+    If target_dpi is given, image layers are downsampled to what their
+    on-page box needs at that DPI; the full resolution image stays
+    available under the layer's "originalSrc".
+    
+    If coalesce_paths is set, runs of same-styled drawings are merged into
+    compound path layers (see _coalesce_drawings).
+    
+    Pages too complex to edit in full are flattened into a background
+    image layer (see services.page_strategy); "strategy" says how the page
+    was extracted and why.
+    
     Returns:
         dict: {
             "width": float,
             "height": float,
+            "strategy": {"name": str, "reason": str or None, "complexity": {...}},
             "layers": [ ... ]
         }
     """
-    doc = fitz.open(pdf_path)
+    result = {}
+    layers_by_id = {}
+    
+    for record in iter_pdf_layers(pdf_path, page_num, target_dpi, coalesce_paths):
+        if record["kind"] == "meta":
+            result["width"] = record["width"]
+            result["height"] = record["height"]
+            result["strategy"] = record["strategy"]
+        elif record["kind"] == "layer":
+            layers_by_id[record["layer"]["id"]] = record["layer"]
+        elif record["kind"] == "hierarchy":
+            layers = [layers_by_id[layer_id] for layer_id in record["order"]]
+            for layer in layers:
+                layer["parentId"] = record["parents"].get(layer["id"])
+            result["layers"] = layers
+            
+    return result
+
+def iter_pdf_layers(pdf_path: str, page_num: int = 0, target_dpi: float = None, coalesce_paths: bool = False):
+    """
+    Generator form of extract_pdf_layers, for streaming responses.
+    Yields, in order:
+    - {"kind": "meta", "width", "height", "strategy"}
+    - {"kind": "layer", "layer": {...}} for text, then path, then image layers,
+      then the background layer of a flattened page (cheapest first, so the
+      editor can paint text before images are decoded)
+    - {"kind": "hierarchy", "order": [ids in z-order], "parents": {id: parentId}}
+    """
+    doc = document_cache.get(pdf_path)
     if page_num >= len(doc):
         raise ValueError("Page number out of range")
         
     page = doc[page_num]
+    parse_phase = Phase("parse_page")
+    with parse_phase:
+        parsed = ParsedPage(page)
+        # Decide up front what is worth extracting as layers
+        strategy = choose_strategy(scan_page(page))
+    parse_phase.done()
+    flatten = strategy["name"] != STRATEGY_FULL
     
     # Use CropBox effectively (visible area)
     # If rotation is 90 or 270, we must swap width and height for the canvas
@@ -34,134 +201,552 @@ def extract_pdf_layers(pdf_path: str, page_num: int = 0):
     else:
         width, height = rect.width, rect.height
     
-    layers = []
+    yield {"kind": "meta", "width": width, "height": height, "strategy": strategy}
     
-    # 1. Extract Images (Logical Layout: Background)
-    images = _extract_images(doc, page, ox, oy)
-    layers.extend(images)
+    # 1. Locate Images (Logical Layout: Background)
+    # Only positions here; decoding is the slow part and happens last
+    # Timed across both steps, but not while suspended in between
+    images_phase = Phase("extract_images")
+    with images_phase:
+        if strategy["name"] == STRATEGY_TEXT_ONLY:
+            placements = []
+        else:
+            placements = _image_placements(parsed)
+    image_boxes = [_image_box(info, ox, oy) for info in placements]
     
     # 2. Extract Paths (Logical Layout: Middle)
-    paths = _extract_paths(page, ox, oy)
-    layers.extend(paths)
+    # Flattened pages draw them into the background instead
+    paths = [] if flatten else _extract_paths(parsed, ox, oy, coalesce_paths)
     
     # 3. Extract Text (Logical Layout: Top)
     # Pass images to text extraction to prevent merging across images
-    text = _extract_text(page, images, ox, oy) 
-    layers.extend(text)
+    text = _extract_text(parsed, image_boxes, ox, oy) 
     
-    # Assign simpler IDs for frontend
-    for i, layer in enumerate(layers):
+    # Assign simpler IDs for frontend, in z-order (images, paths, text)
+    for i, layer in enumerate(paths + text, start=len(placements)):
         if not layer.get("id"):
             layer["id"] = f"layer-{i}"
     
-    # 4. Build layer hierarchy based on spatial containment
-    layers = _build_layer_hierarchy(layers)
-            
+    for layer in text:
+        yield {"kind": "layer", "layer": layer}
+    for layer in paths:
+        yield {"kind": "layer", "layer": layer}
+    
+    # 4. Decode Images
+    doc_hash = file_sha256(pdf_path)
+    images = []
+    for i, img_info in enumerate(placements):
+        with images_phase:
+            layer = _image_layer(doc, img_info, ox, oy, doc_hash, target_dpi)
+        if layer is None:
+            continue
+        layer["id"] = f"layer-{i}"
+        images.append(layer)
+        yield {"kind": "layer", "layer": layer}
+    images_phase.done(layers=len(images))
+    
+    # 5. Render the flattened content
+    background = None
+    if flatten:
+        keep_images = strategy["name"] == STRATEGY_TEXT_ONLY
+        background = _background_layer(doc, page_num, width, height, doc_hash, keep_images, target_dpi)
+        if background is not None:
+            yield {"kind": "layer", "layer": background}
+    
+    # 6. Build layer hierarchy based on spatial containment
+    # Run on copies so layers already handed out aren't mutated.
+    # The background covers the whole page, so it's kept out: it would
+    # otherwise become every layer's parent.
+    layers = _build_layer_hierarchy([dict(layer) for layer in images + paths + text])
+    order = [layer["id"] for layer in layers]
+    if background is not None:
+        order.insert(0, background["id"])
+    yield {
+        "kind": "hierarchy",
+        "order": order,
+        "parents": {layer["id"]: layer["parentId"] for layer in layers if layer["parentId"]},
+    }
+
+def _result_cache_key(pdf_path, page_num, target_dpi, coalesce_paths):
+    variant = ";".join(part for part in (
+        f"dpi={target_dpi}" if target_dpi else "",
+        "coalesce" if coalesce_paths else "",
+    ) if part)
+    return result_cache.make_key(file_sha256(pdf_path), page_num, EXTRACTOR_VERSION, variant)
+
+def _cached_result(key):
+    """
+    A result cache entry, unless the image store has since evicted one of
+    the images it links to: then the page has to be extracted again.
+    """
+    cached = result_cache.get(key)
+    if cached is not None and not image_store.has_all(cached):
+        return None
+    return cached
+
+def has_cached_pdf_layers(pdf_path: str, page_num: int = 0, target_dpi: float = None, coalesce_paths: bool = False) -> bool:
+    if target_dpi:
+        target_dpi = round(target_dpi)
+    return result_cache.contains(_result_cache_key(pdf_path, page_num, target_dpi, coalesce_paths))
+
+def extract_pdf_layers_json(pdf_path: str, page_num: int = 0, target_dpi: float = None, coalesce_paths: bool = False) -> bytes:
+    """
+    Same as extract_pdf_layers, but returns the serialized JSON and goes
+    through the persistent result cache keyed by (file sha256, page, version).
+    """
+    if target_dpi:
+        # Round so near-identical DPIs share a cache entry
+        target_dpi = round(target_dpi)
+    key = _result_cache_key(pdf_path, page_num, target_dpi, coalesce_paths)
+    cached = _cached_result(key)
+    if cached is not None:
+        return cached
+
+    result = extract_pdf_layers(pdf_path, page_num, target_dpi, coalesce_paths)
+    serialize_phase = Phase("serialize_layers")
+    with serialize_phase:
+        data = json.dumps(result, separators=(",", ":")).encode("utf-8")
+    serialize_phase.done(layers=len(result["layers"]), nbytes=len(data))
+    result_cache.put(key, data)
+    return data
+
+def stream_pdf_layers_ndjson(pdf_path: str, page_num: int = 0, target_dpi: float = None, coalesce_paths: bool = False):
+    """
+    Yields iter_pdf_layers records as NDJSON lines.
+    A cached result is replayed in the same record order; otherwise the
+    page is extracted incrementally and the assembled result is cached
+    once the stream completes.
+    """
+    if target_dpi:
+        target_dpi = round(target_dpi)
+    key = _result_cache_key(pdf_path, page_num, target_dpi, coalesce_paths)
+    cached = _cached_result(key)
+    
+    if cached is not None:
+        records = _records_from_result(json.loads(cached))
+    else:
+        records = iter_pdf_layers(pdf_path, page_num, target_dpi, coalesce_paths)
+    
+    result = {}
+    layers_by_id = {}
+    for record in records:
+        yield json.dumps(record, separators=(",", ":")).encode("utf-8") + b"\n"
+        if cached is not None:
+            continue
+        # Assemble the regular result alongside, for the result cache
+        if record["kind"] == "meta":
+            result["width"] = record["width"]
+            result["height"] = record["height"]
+            result["strategy"] = record["strategy"]
+        elif record["kind"] == "layer":
+            layers_by_id[record["layer"]["id"]] = record["layer"]
+        elif record["kind"] == "hierarchy":
+            layers = [layers_by_id[layer_id] for layer_id in record["order"]]
+            for layer in layers:
+                layer["parentId"] = record["parents"].get(layer["id"])
+            result["layers"] = layers
+            result_cache.put(key, json.dumps(result, separators=(",", ":")).encode("utf-8"))
+
+def write_pdf_layers_ndjson(out_path: str, pdf_path: str, page_num: int = 0, target_dpi: float = None, coalesce_paths: bool = False):
+    """
+    Runs in a worker: appends stream_pdf_layers_ndjson's lines to out_path
+    as they are produced, flushing each, so the main process can stream
+    the file while it grows. A failure ends it with an error record.
+    """
+    with open(out_path, "ab") as f:
+        try:
+            for line in stream_pdf_layers_ndjson(pdf_path, page_num, target_dpi, coalesce_paths):
+                f.write(line)
+                f.flush()
+        except Exception as e:
+            print(f"Error streaming page: {e}")
+            f.write((json.dumps({"kind": "error", "error": str(e)}) + "\n").encode("utf-8"))
+
+def _records_from_result(result):
+    """
+    Converts a full extract_pdf_layers result back into iter_pdf_layers records.
+    """
+    yield {"kind": "meta", "width": result["width"], "height": result["height"], "strategy": result["strategy"]}
+    
+    parents = {}
+    for layer in result["layers"]:
+        layer = dict(layer)
+        parent_id = layer.pop("parentId", None)
+        if parent_id:
+            parents[layer["id"]] = parent_id
+    for kind in ("text", "path", "image", "background"):
+        for layer in result["layers"]:
+            layer_kind = "background" if layer.get("background") else layer["type"]
+            if layer_kind == kind:
+                layer = dict(layer)
+                layer.pop("parentId", None)
+                yield {"kind": "layer", "layer": layer}
+    
+    yield {
+        "kind": "hierarchy",
+        "order": [layer["id"] for layer in result["layers"]],
+        "parents": parents,
+    }
+
+class ParsedPage:
+    """
+    One interpretation of a page's content, shared by the text, image and
+    drawing extractors.
+
+    The page is run once into a TextPage (with image blocks, which also
+    delimit text blocks). Image placements and text blocks are both read
+    from it, where page.get_image_info and page.get_text("dict") would each
+    run the page again. Drawings still come from page.get_drawings, which
+    PyMuPDF only produces by running the page through its own device.
+    """
+
+    def __init__(self, page):
+        self.page = page
+        self.textpage = page.get_textpage(flags=TEXT_FLAGS)
+        self._image_info = None
+
+    def image_info(self) -> list:
+        """
+        Same as page.get_image_info(xrefs=True), but only decodes images
+        whose xref can't be told from metadata (see _match_image_xrefs).
+        Images lying entirely outside the page aren't listed.
+        """
+        if self._image_info is None:
+            self._image_info = self.textpage.extractIMGINFO()
+            for img in self._image_info:
+                # The text flags clip boxes to the page; layers keep the
+                # full placement, as get_image_info reports it
+                img["bbox"] = tuple(fitz.Rect(0, 0, 1, 1) * fitz.Matrix(img["transform"]))
+            _match_image_xrefs(self.page, self._image_info, self.textpage)
+        return self._image_info
+
+    def text_blocks(self) -> list:
+        """
+        Text blocks as (bbox, lines, style), where style is the
+        {"size", "font", "color"} of the block's first span (None for a
+        block without any). Lines are the same strings get_text("dict")
+        spans would add up to; blank lines are dropped.
+
+        Blocks come from extractBLOCKS, so images still end them, and
+        styles from extractXML on the same TextPage (see _block_styles),
+        matched by block number. extractDICT would also encode every image
+        block to bytes we'd only throw away.
+        """
+        blocks = [b for b in self.textpage.extractBLOCKS() if b[6] == 0]
+        styles = _block_styles(self.textpage) if blocks else []
+        return [
+            (b[:4], [line for line in b[4].split("\n") if line.strip()], styles[b[5]] if b[5] < len(styles) else None)
+            for b in blocks
+        ]
+
+    def drawings(self) -> list:
+        return self.page.get_drawings()
+
+def _block_styles(textpage) -> list:
+    """
+    The {"size", "font", "color"} of each TextPage block's first character,
+    indexed by block number like extractBLOCKS; None for image blocks and
+    text blocks without characters.
+    """
+    styles = []
+    in_text_block = False
+    for m in XML_STYLE_RE.finditer(textpage.extractXML()):
+        if m.group(1):
+            styles.append(None)
+            in_text_block = m.group(1) == "block"
+        elif in_text_block:
+            font, size, color = m.group(2, 3, 4)
+            styles[-1] = {"size": float(size), "font": html.unescape(font), "color": int(color, 16)}
+            in_text_block = False
+    return styles
+
+def _match_image_xrefs(page, info, textpage):
+    """
+    Sets info["xref"] for every image placement, 0 if it has none (inline
+    images).
+    
+    get_image_info(xrefs=True) decodes every placed image and every image
+    xref on the page to match them by pixel digest. Most pages can be
+    matched without that: a placement whose pixel size belongs to exactly
+    one of the page's image xrefs, and whose compressed size equals that
+    xref's stream length, is that xref. Only if some placement is left
+    ambiguous are digests computed, and then only for its candidates.
+    """
+    doc = page.parent
+    by_size = {}
+    for item in page.get_images(full=True):
+        xref, width, height = item[0], item[2], item[3]
+        candidates = by_size.setdefault((width, height), [])
+        if xref not in candidates:
+            candidates.append(xref)
+    
+    unmatched = []
+    for i, img in enumerate(info):
+        candidates = by_size.get((img["width"], img["height"]), [])
+        if len(candidates) == 1 and img["size"] == len(doc.xref_stream_raw(candidates[0]) or b""):
+            img["xref"] = candidates[0]
+        elif candidates:
+            unmatched.append(i)
+        else:
+            img["xref"] = 0
+    if not unmatched:
+        return
+    
+    hashed = textpage.extractIMGINFO(hashes=True)
+    digests = {}
+    hashed_xrefs = set()
+    for i in unmatched:
+        for xref in by_size[(info[i]["width"], info[i]["height"])]:
+            if xref not in hashed_xrefs:
+                digests[fitz.Pixmap(doc, xref).digest] = xref
+                hashed_xrefs.add(xref)
+        info[i]["xref"] = digests.get(hashed[i]["digest"], 0)
+
+def _image_placements(parsed):
+    """
+    Where images are drawn on the page, without decoding them.
+    Inline images (xref 0) can't be extracted by xref and are skipped.
+    """
+    return [info for info in parsed.image_info() if info['xref'] > 0]
+
+def _image_box(img_info, ox=0, oy=0):
+    bbox = img_info['bbox'] # [x0, y0, x1, y1]
     return {
-        "width": width,
-        "height": height,
-        "layers": layers
+        "x": bbox[0] - ox,
+        "y": bbox[1] - oy,
+        "width": bbox[2] - bbox[0],
+        "height": bbox[3] - bbox[1],
     }
 
-def _extract_images(doc, page, ox=0, oy=0):
+def _image_layer(doc, img_info, ox, oy, doc_hash, target_dpi=None):
     """
-    Extracts images as Base64 encoded layers, handling transparency (SMask).
+    Builds the layer for one image placement, decoding and storing the image
+    if this document's xref hasn't been seen before.
+    Returns None if the image can't be decoded.
     """
-    image_layers = []
+    xref = img_info['xref']
     
-    # get_image_info(xrefs=True) gives us position
-    image_list = page.get_image_info(xrefs=True)
+    # Logos and backgrounds repeat across pages: only decode on first sight
+    key = image_key(doc_hash, xref)
+    if image_store.find(key) is not None:
+        image_encoding_counts["store_hit"] += 1
+    else:
+        image_bytes, ext = _encode_image(doc, xref)
+        if image_bytes is None:
+            return None
+        image_store.put(key, image_bytes, ext)
     
-    for img_info in image_list:
-        xref = img_info['xref']
-        bbox = img_info['bbox'] # [x0, y0, x1, y1]
-        
-        # 1. Create Pixmap from xref (this is the base image)
+    layer = {"type": "image", "src": image_url(key)}
+    layer.update(_image_box(img_info, ox, oy))
+    layer["rotation"] = 0
+    
+    if target_dpi:
+        tier = _image_tier(img_info, target_dpi)
+        tier_key = _downsampled_image(key, doc_hash, xref, tier) if tier else None
+        if tier_key:
+            layer["src"] = image_url(tier_key)
+            layer["originalSrc"] = image_url(key)
+    
+    return layer
+
+# Resolution of a flattened page's background when no target DPI is given
+BACKGROUND_DPI = 144
+# Longest side cap, so poster-sized drawings don't produce huge rasters
+MAX_BACKGROUND_PX = 4096
+
+@timed("render_background", layers=lambda layer: int(layer is not None))
+def _background_layer(doc, page_num, width, height, doc_hash, keep_images, target_dpi=None):
+    """
+    Renders a page's drawings (and, with keep_images, its images) into one
+    image layer covering the page, for pages whose content is too complex
+    to edit as separate layers. Text is removed first, since it stays
+    editable as text layers. Stored like extracted images, so each page
+    is only rendered once per DPI.
+    Returns None if the page can't be rendered.
+    """
+    dpi = round(target_dpi) if target_dpi else BACKGROUND_DPI
+    variant = f"background:{'images' if keep_images else 'vectors'}:{dpi}"
+    key = image_key(doc_hash, f"page{page_num}", variant)
+    
+    if image_store.find(key) is None:
+        # Redact a scratch copy; the cached document handle stays untouched
+        scratch = fitz.open()
         try:
-            pix = fitz.Pixmap(doc, xref)
+            scratch.insert_pdf(doc, from_page=page_num, to_page=page_num)
+            page = scratch[0]
+            page.add_redact_annot(page.mediabox, fill=False, cross_out=False)
+            page.apply_redactions(
+                images=fitz.PDF_REDACT_IMAGE_NONE if keep_images else fitz.PDF_REDACT_IMAGE_REMOVE,
+                graphics=fitz.PDF_REDACT_LINE_ART_NONE,
+                text=fitz.PDF_REDACT_TEXT_REMOVE,
+            )
+            scale = min(dpi / 72, MAX_BACKGROUND_PX / max(page.rect.width, page.rect.height, 1))
+            pix = page.get_pixmap(matrix=fitz.Matrix(scale, scale), alpha=True, annots=False)
+            image_store.put(key, pix.tobytes("png"), "png")
         except Exception as e:
-            # print(f"Skipping bad image xref {xref}: {e}")
-            continue
+            print(f"Failed to render background of page {page_num}: {e}")
+            return None
+        finally:
+            scratch.close()
+    
+    return {
+        "id": "layer-background",
+        "type": "image",
+        "src": image_url(key),
+        "x": 0,
+        "y": 0,
+        "width": width,
+        "height": height,
+        "rotation": 0,
+        "background": True,
+    }
 
-        # 2. Check for Soft Mask (transparency)
-        # base_image dict extraction is needed to check for smask presence easily if not checking pixmap directly?
-        # fitz.Pixmap(doc, xref) automatically handles simple alpha, but separate smask needs manual merge.
-        # Actually, let's check the smask xref.
-        
-        # We can try to construct the final transparent pixmap
-        # If the image has an smask, pix.alpha is usually 0 initially (it's opaque),
-        # but there's a separate smask object.
-        
-        # Easier way: extract raw image info to find smask xref
+# Smallest downsampling tier; tiers are powers of two above this
+MIN_IMAGE_TIER = 64
+
+def _image_tier(img_info, target_dpi):
+    """
+    Picks the longest-side pixel size an image needs to look sharp in its
+    on-page box at target_dpi, rounded up to a power of two so that nearby
+    box sizes and DPIs share one downsampled variant.
+    Returns None if the original is already that small.
+    """
+    bbox = img_info['bbox']
+    box_pt = max(bbox[2] - bbox[0], bbox[3] - bbox[1])
+    needed_px = box_pt * target_dpi / 72
+
+    tier = MIN_IMAGE_TIER
+    while tier < needed_px:
+        tier *= 2
+
+    if tier >= max(img_info.get('width', 0), img_info.get('height', 0)):
+        return None
+    return tier
+
+def _downsampled_image(original_key, doc_hash, xref, tier):
+    """
+    Returns the image store key of the tier-sized variant of an image,
+    generating it from the stored original the first time it's needed.
+    Returns None if the variant couldn't be produced.
+    """
+    tier_key = image_key(doc_hash, xref, f"tier{tier}")
+    if image_store.find(tier_key) is not None:
+        return tier_key
+
+    original_path = image_store.find(original_key)
+    if original_path is None:
+        return None
+    try:
+        pix = fitz.Pixmap(str(original_path))
+        scale = tier / max(pix.width, pix.height)
+        small = fitz.Pixmap(pix, max(1, round(pix.width * scale)), max(1, round(pix.height * scale)), None)
+        # Keep photos as JPEG; anything with transparency needs PNG
+        if original_path.suffix == ".jpeg" and not small.alpha:
+            image_store.put(tier_key, small.tobytes("jpeg", jpg_quality=85), "jpeg")
+        else:
+            image_store.put(tier_key, small.tobytes("png"), "png")
+    except Exception as e:
+        print(f"Failed to downsample image xref {xref} to {tier}px: {e}")
+        return None
+
+    image_encoding_counts["downsampled"] += 1
+    return tier_key
+
+# Formats whose original stream bytes a browser can display as-is
+PASSTHROUGH_FORMATS = ("jpeg", "png")
+
+# How each extracted image was encoded: passed through or re-encoded as PNG
+image_encoding_counts = Counter()
+register_worker_stats("imageEncoding", lambda: dict(image_encoding_counts))
+
+def _encode_image(doc, xref):
+    """
+    Returns (bytes, ext) for an image xref.
+    Opaque Gray/RGB JPEGs (and images MuPDF already hands back as PNG) are
+    passed through as-is; anything with a soft mask, a CMYK/other colorspace
+    or a format browsers can't show (JPX, JBIG2, ...) is re-encoded as PNG.
+    """
+    try:
+        base_image_info = doc.extract_image(xref)
+    except Exception:
+        base_image_info = None
+
+    if base_image_info:
+        ext = base_image_info.get("ext")
+        if (ext in PASSTHROUGH_FORMATS
+                and not base_image_info.get("smask")
+                and base_image_info.get("colorspace") in (1, 3)):
+            image_encoding_counts[f"passthrough_{ext}"] += 1
+            return base_image_info["image"], ext
+
+    image_bytes = _render_image_png(doc, xref, base_image_info)
+    if image_bytes is None:
+        image_encoding_counts["failed"] += 1
+        return None, None
+    image_encoding_counts["reencoded_png"] += 1
+    return image_bytes, "png"
+
+def _render_image_png(doc, xref, base_image_info=None):
+    """
+    Decodes an image xref to PNG bytes, merging its soft mask if it has one.
+    Returns None if the image can't be decoded.
+    """
+    # 1. Create Pixmap from xref (this is the base image)
+    try:
+        pix = fitz.Pixmap(doc, xref)
+    except Exception as e:
+        # print(f"Skipping bad image xref {xref}: {e}")
+        return None
+
+    # 2. Check for Soft Mask (transparency)
+    # base_image dict extraction is needed to check for smask presence easily if not checking pixmap directly?
+    # fitz.Pixmap(doc, xref) automatically handles simple alpha, but separate smask needs manual merge.
+    # Actually, let's check the smask xref.
+
+    # We can try to construct the final transparent pixmap
+    # If the image has an smask, pix.alpha is usually 0 initially (it's opaque),
+    # but there's a separate smask object.
+
+    # Easier way: extract raw image info to find smask xref
+    smask_xref = base_image_info.get("smask", 0) if base_image_info else 0
+
+    if smask_xref > 0:
         try:
-            base_image_info = doc.extract_image(xref)
-            smask_xref = base_image_info.get("smask", 0)
-        except Exception:
-            smask_xref = 0
-
-        if smask_xref > 0:
-            try:
-                # Load the mask
-                mask = fitz.Pixmap(doc, smask_xref)
-                
-                # Check if we can merge. Base must be RGB (colorspace 1-3?)
-                # If CMYK, convert to RGB first
-                if pix.colorspace and pix.colorspace.n >= 4: # CMYK
-                     temp = fitz.Pixmap(fitz.csRGB, pix)
-                     pix = temp
-                
-                # Merge mask
-                # fitz.Pixmap(pix, mask) returns a NEW pixmap with alpha
-                # IF the mask is compatible.
-                pix = fitz.Pixmap(pix, mask)
-            except Exception as e:
-                print(f"Failed to merge smask for xref {xref}: {e}")
-        
-        # 3. Ensure we have a valid PNG format (lossless, supports alpha)
-        # If pixmap is CMYK or something else weird, convert to RGB
-        if pix.n - pix.alpha >= 4: # CMYK
-            pix = fitz.Pixmap(fitz.csRGB, pix)
-            
-        # Get PNG bytes
-        image_bytes = pix.tobytes("png")
-        
-        # Encode
-        b64_str = base64.b64encode(image_bytes).decode("utf-8")
-        
-        image_layers.append({
-            "type": "image",
-            "src": f"data:image/png;base64,{b64_str}", # Always PNG
-            "x": bbox[0] - ox,
-            "y": bbox[1] - oy,
-            "width": bbox[2] - bbox[0],
-            "height": bbox[3] - bbox[1],
-            "rotation": 0
-        })
-        
-    return image_layers
+            # Load the mask
+            mask = fitz.Pixmap(doc, smask_xref)
+
+            # Check if we can merge. Base must be RGB (colorspace 1-3?)
+            # If CMYK, convert to RGB first
+            if pix.colorspace and pix.colorspace.n >= 4: # CMYK
+                 temp = fitz.Pixmap(fitz.csRGB, pix)
+                 pix = temp
+
+            # Merge mask
+            # fitz.Pixmap(pix, mask) returns a NEW pixmap with alpha
+            # IF the mask is compatible.
+            pix = fitz.Pixmap(pix, mask)
+        except Exception as e:
+            print(f"Failed to merge smask for xref {xref}: {e}")
 
-def _extract_paths(page, ox=0, oy=0):
+    # 3. Ensure we have a valid PNG format (lossless, supports alpha)
+    # If pixmap is CMYK or something else weird, convert to RGB
+    if pix.n - pix.alpha >= 4: # CMYK
+        pix = fitz.Pixmap(fitz.csRGB, pix)
+
+    return pix.tobytes("png")
+
+@timed("extract_paths", layers=len)
+def _extract_paths(parsed, ox=0, oy=0, coalesce=False):
     """
     Extracts vector drawings and converts to SVG Path layers.
+    With coalesce, same-styled drawings are merged into compound layers.
     """
-    path_layers = []
-    drawings = page.get_drawings()
+    page = parsed.page
+    drawings = []  # (shape, stroke_hex, fill_hex) of the visible drawings
     
-    for shape in drawings:
+    for shape in parsed.drawings():
         rect = shape["rect"]
         
-        # Convert items to SVG d string
-        # IMPORTANT: _drawings_to_svg needs to know about offsets for path coordinates?
-        # My implementation of _drawings_to_svg uses (p1.x - ox, p1.y - oy) where ox/oy passed to it are the rect origin.
-        # But here rect is absolute.
-        # So inside _drawings_to_svg, we normalize to (0,0) of the layer bounding box.
-        # Layer x,y should be absolute space - page origin.
-        
-        layer_x = rect[0] - ox
-        layer_y = rect[1] - oy
-        
-        svg_d = _drawings_to_svg(shape["items"], shape["rect"])
-        
         # Color
         stroke = shape.get("color")
         fill = shape.get("fill")
@@ -181,92 +766,162 @@ def _extract_paths(page, ox=0, oy=0):
         if is_white_fill and is_large:
             # print(f"Skipping large white background path: {rect}")
             continue
+        
+        drawings.append((shape, stroke_hex, fill_hex))
+    
+    if coalesce:
+        groups = _coalesce_drawings(drawings)
+    else:
+        groups = [[drawing] for drawing in drawings]
+    
+    return [_path_layer(group, ox, oy) for group in groups]
 
-        path_layers.append({
-            "type": "path",
-            "d": svg_d,
-            "x": layer_x,
-            "y": layer_y,
-            "width": rect[2] - rect[0],
-            "height": rect[3] - rect[1],
-            "fill": fill_hex,
-            "stroke": stroke_hex,
-            "strokeWidth": shape.get("width", 1)
-        })
+def _path_layer(group, ox=0, oy=0):
+    """
+    Builds one path layer from a list of same-styled drawings.
+    """
+    shape, stroke_hex, fill_hex = group[0]
+    
+    if len(group) == 1:
+        rect = shape["rect"]
+        # Convert items to SVG d string
+        # _drawings_to_svg normalizes to (0,0) of the layer bounding box,
+        # while layer x,y is absolute space - page origin.
+        svg_d = _drawings_to_svg(shape["items"], rect)
+    else:
+        rect = fitz.Rect(shape["rect"])
+        for member, _, _ in group[1:]:
+            rect |= member["rect"]
+        enc = PathEncoder(PATH_PRECISION)
+        for member, _, _ in group:
+            # Each drawing starts its own subpath(s)
+            enc.break_subpath()
+            _encode_drawing(enc, member["items"], rect[0], rect[1])
+        svg_d = enc.getvalue()
+    
+    return {
+        "type": "path",
+        "d": svg_d,
+        "x": rect[0] - ox,
+        "y": rect[1] - oy,
+        "width": rect[2] - rect[0],
+        "height": rect[3] - rect[1],
+        "fill": fill_hex,
+        "stroke": stroke_hex,
+        "strokeWidth": shape.get("width", 1)
+    }
+
+# Most drawings merged into one compound path layer, so it stays editable
+COALESCE_MAX_PATHS = 200
+# How many groups back a drawing may be moved to join a same-styled group
+COALESCE_LOOKBACK = 32
+
+def _coalesce_drawings(drawings, max_paths=COALESCE_MAX_PATHS):
+    """
+    Groups same-styled drawings (fill, stroke, stroke width, fill rule) so
+    they can be emitted as one compound path.
+    
+    A drawing joins an earlier group only if no group painted in between
+    overlaps it, so the visible stacking order never changes. Filled
+    drawings also must not overlap other members of their group, since
+    overlapping subpaths of one fill can cancel out under the fill rule.
+    """
+    groups = []
+    for drawing in drawings:
+        shape, stroke_hex, fill_hex = drawing
+        filled = fill_hex != "transparent"
+        key = (fill_hex, stroke_hex, shape.get("width"), shape.get("even_odd") if filled else None)
+        box = _paint_box(shape)
         
-    return path_layers
+        target = None
+        for group in reversed(groups[-COALESCE_LOOKBACK:]):
+            if (group["key"] == key
+                    and len(group["members"]) < max_paths
+                    and not (filled and _overlaps_member(group, box))):
+                target = group
+                break
+            # Can't move this drawing below something it overlaps
+            if _boxes_overlap(group["box"], box):
+                break
+        
+        if target is None:
+            groups.append({"key": key, "members": [drawing], "boxes": [box], "box": box})
+        else:
+            target["members"].append(drawing)
+            target["boxes"].append(box)
+            gb = target["box"]
+            target["box"] = (min(gb[0], box[0]), min(gb[1], box[1]), max(gb[2], box[2]), max(gb[3], box[3]))
+    
+    return [group["members"] for group in groups]
+
+def _paint_box(shape):
+    """
+    Drawing bounds grown by half the stroke width (plus slack), as a tuple.
+    Unlike fitz.Rect.intersects this also works for zero-height lines.
+    """
+    r = shape["rect"]
+    pad = (shape.get("width") or 0) / 2 + 0.5
+    return (r[0] - pad, r[1] - pad, r[2] + pad, r[3] + pad)
 
-def _extract_text(page, images=[], ox=0, oy=0):
+def _boxes_overlap(a, b):
+    return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+def _overlaps_member(group, box):
+    if not _boxes_overlap(group["box"], box):
+        return False
+    return any(_boxes_overlap(member_box, box) for member_box in group["boxes"])
+
+@timed("extract_text", layers=len)
+def _extract_text(parsed, images=[], ox=0, oy=0):
     """
     Extracts text as individual text block layers.
     Includes logic to merge separate blocks that act as a single paragraph.
     """
     raw_layers = []
-    text_dict = page.get_text("dict")
     
-    blocks = text_dict["blocks"]
-    for b in blocks:
-        if b["type"] == 0: # Text Block
-            # Aggregate content for the entire block
-            block_text_lines = []
-            
-            # Reprsentative style
-            ref_span = None
-            
-            for line in b["lines"]:
-                line_text = ""
-                for span in line["spans"]:
-                    # Concatenate spans in a line
-                    line_text += span["text"]
-                    if not ref_span:
-                        ref_span = span
-                
-                if line_text.strip():
-                     block_text_lines.append(line_text)
-            
-            full_text = "\n".join(block_text_lines)
-            if not full_text:
-                continue
-                
-            # Use block bbox
-            bbox = b["bbox"]
-            
-            # Default styles
-            font_size = ref_span["size"] if ref_span else 12
-            font_family = ref_span["font"] if ref_span else "Arial"
-            color_int = ref_span["color"] if ref_span else 0
-            
-            # Hex color
-            r = (color_int >> 16) & 0xFF
-            g = (color_int >> 8) & 0xFF
-            b_col = color_int & 0xFF
-            hex_color = "#{:02x}{:02x}{:02x}".format(r, g, b_col)
-            
-            # Recalculate height? 
-            # DANGEROUS: Extending height artificially causes overlaps with subsequent layers because we don't shift them down.
-            # Better to rely on merging to solve fragmentation, and let single layers flow/overflow naturally.
-            final_height = bbox[3] - bbox[1]
-            
-            # Line height as a RATIO (not pixels) - frontend CSS expects a multiplier
-            # Using 1.2 as a standard line-height ratio
-            render_line_height = 1.2
-
-            raw_layers.append({
-                "type": "text",
-                "text": full_text,
-                "x": bbox[0] - ox,
-                "y": bbox[1] - oy,
-                "width": (bbox[2] - bbox[0]),
-                "height": final_height,
-                "fontSize": font_size,
-                "fontFamily": font_family,
-                "color": hex_color,
-                "lineHeight": render_line_height
-            })
-            
+    # Blocks arrive with their lines already joined per line
+    for bbox, block_text_lines, ref_span in parsed.text_blocks():
+        full_text = "\n".join(block_text_lines)
+        if not full_text:
+            continue
+        
+        # Default styles
+        font_size = ref_span["size"] if ref_span else 12
+        font_family = ref_span["font"] if ref_span else "Arial"
+        color_int = ref_span["color"] if ref_span else 0
+        
+        # Hex color
+        r = (color_int >> 16) & 0xFF
+        g = (color_int >> 8) & 0xFF
+        b_col = color_int & 0xFF
+        hex_color = "#{:02x}{:02x}{:02x}".format(r, g, b_col)
+        
+        # Recalculate height? 
+        # DANGEROUS: Extending height artificially causes overlaps with subsequent layers because we don't shift them down.
+        # Better to rely on merging to solve fragmentation, and let single layers flow/overflow naturally.
+        final_height = bbox[3] - bbox[1]
+        
+        # Line height as a RATIO (not pixels) - frontend CSS expects a multiplier
+        # Using 1.2 as a standard line-height ratio
+        render_line_height = 1.2
+
+        raw_layers.append({
+            "type": "text",
+            "text": full_text,
+            "x": bbox[0] - ox,
+            "y": bbox[1] - oy,
+            "width": (bbox[2] - bbox[0]),
+            "height": final_height,
+            "fontSize": font_size,
+            "fontFamily": font_family,
+            "color": hex_color,
+            "lineHeight": render_line_height
+        })
+        
     # Merge Logic
     return _merge_nearby_text_layers(raw_layers, images)
 
+@timed("merge_text", layers=len)
 def _merge_nearby_text_layers(layers, images=[]):
     """
     Merges text layers that form paragraphs.
@@ -326,13 +981,17 @@ def _merge_nearby_text_layers(layers, images=[]):
     column_boundaries.append(page_right + 100)  # End boundary
     
     # Assign layers to columns based on their X position
+    # Boundaries are ascending, so the column is found by bisection
     columns = {i: [] for i in range(len(column_boundaries) - 1)}
     for layer in h_merged:
         layer_x = layer["x"]
-        for i in range(len(column_boundaries) - 1):
-            if column_boundaries[i] <= layer_x < column_boundaries[i + 1]:
-                columns[i].append(layer)
-                break
+        i = bisect.bisect_right(column_boundaries, layer_x) - 1
+        if 0 <= i < len(column_boundaries) - 1 and column_boundaries[i] <= layer_x < column_boundaries[i + 1]:
+            columns[i].append(layer)
+    
+    # Index image y-ranges so each obstruction check only looks at images
+    # overlapping the gap instead of all of them
+    image_index, unindexed_images = _image_y_index(images)
     
     # Phase 3: Merge vertically within each column
     final_merged = []
@@ -353,12 +1012,13 @@ def _merge_nearby_text_layers(layers, images=[]):
             max_vertical_gap = current["fontSize"] * 1.3
             is_continuation = vertical_gap >= -2 and vertical_gap <= max_vertical_gap
             
-            # Image obstruction check
+            # Image obstruction check (only matters if we'd merge otherwise)
             is_obstructed = False
             gap_top = current["y"] + current["height"]
             gap_bottom = next_layer["y"]
-            if gap_bottom > gap_top:
-                for img in images:
+            if is_continuation and gap_bottom > gap_top:
+                candidates = itertools.chain(image_index.overlapping(gap_top, gap_bottom), unindexed_images)
+                for img in candidates:
                     img_y_start = img["y"]
                     img_y_end = img["y"] + img["height"]
                     overlaps_gap = not (img_y_end < gap_top or img_y_start > gap_bottom)
@@ -391,56 +1051,72 @@ def _merge_nearby_text_layers(layers, images=[]):
         
     return final_merged
 
-def _drawings_to_svg(items, rect):
+def _image_y_index(images):
+    """
+    Splits images into an IntervalIndex over their y-ranges and a list of
+    images the index can't hold (negative height or non-finite values),
+    which callers check unconditionally.
+    """
+    intervals = []
+    unindexed = []
+    for img in images:
+        y_start = img["y"]
+        y_end = img["y"] + img["height"]
+        if math.isfinite(y_start) and math.isfinite(y_end) and y_start <= y_end:
+            intervals.append((y_start, y_end, img))
+        else:
+            unindexed.append(img)
+    return IntervalIndex(intervals), unindexed
+
+# Decimal places kept in path coordinates (PDF points); 2 is well below a device pixel
+PATH_PRECISION = 2
+
+def _drawings_to_svg(items, rect, precision=PATH_PRECISION):
     """
     Converts PyMuPDF drawing items to SVG path data 'd' string.
-    Note: Coordinates in 'd' will be relative to the page, but the rendered SVG
-    container will likely be absolute.
-    To make it easier for frontend, we can leave coordinates Absolute (relative to 0,0 of page)
-    and just position the SVG at 0,0, OR relative to the rect.
+    Coordinates are relative to the top-left of 'rect', so the frontend can
+    render a small SVG positioned at the layer's x/y.
     
-    Decision: Use absolute coordinates in the Path 'd' for simplicity, 
-    and frontend renders an SVG covering the whole drawing area, OR
-    frontend renders small SVG at 'rect'.
-    
-    If we render small SVG at 'rect', we need to offset points by -rect.x, -rect.y.
+    Uses PathEncoder for a compact encoding: quantized coordinates, relative
+    commands and shorthands (h/v/s, implicit repeats).
     """
-    d_commands = []
-    
-    # Helper to offset
-    ox, oy = rect[0], rect[1]
-    
-    start_point = None
+    enc = PathEncoder(precision)
+    _encode_drawing(enc, items, rect[0], rect[1])
+    return enc.getvalue()
+
+def _encode_drawing(enc, items, ox, oy):
+    """
+    Feeds PyMuPDF drawing items into a PathEncoder, offset by (ox, oy).
+    """
+    q = enc.quantize
     
     for item in items:
         cmd = item[0]
         if cmd == "l": # line
             p1, p2 = item[1], item[2]
-            # If start_point is different from p1, move there?
             # PyMuPDF "l" implies a segment from p1 to p2.
-            # SVG path needs M first if not continuous.
-            if start_point != p1:
-                d_commands.append(f"M {p1.x - ox} {p1.y - oy}")
-            d_commands.append(f"L {p2.x - ox} {p2.y - oy}")
-            start_point = p2
+            # SVG path needs a move first if not continuous.
+            start = (q(p1.x - ox), q(p1.y - oy))
+            if enc.current_point != start:
+                enc.move_to(*start)
+            enc.line_to(q(p2.x - ox), q(p2.y - oy))
             
         elif cmd == "c": # curve
             p1, p2, p3, p4 = item[1], item[2], item[3], item[4]
             # p1 is start anchor (current point), p2, p3 are controls, p4 is end
-            if start_point != p1:
-                d_commands.append(f"M {p1.x - ox} {p1.y - oy}")
-            d_commands.append(f"C {p2.x - ox} {p2.y - oy}, {p3.x - ox} {p3.y - oy}, {p4.x - ox} {p4.y - oy}")
-            start_point = p4
+            start = (q(p1.x - ox), q(p1.y - oy))
+            if enc.current_point != start:
+                enc.move_to(*start)
+            enc.curve_to(
+                q(p2.x - ox), q(p2.y - oy),
+                q(p3.x - ox), q(p3.y - oy),
+                q(p4.x - ox), q(p4.y - oy)
+            )
             
         elif cmd == "re": # rect
             r = item[1]
-            # M x y H x+w V y+h H x Z
-            # Rect is (x0, y0, x1, y1)
-            x, y, w, h = r.x0 - ox, r.y0 - oy, r.width, r.height
-            d_commands.append(f"M {x} {y} L {x+w} {y} L {x+w} {y+h} L {x} {y+h} Z")
-            start_point = fitz.Point(r.x0, r.y0) # Resets roughly
-            
-    return " ".join(d_commands)
+            # Rect is (x0, y0, x1, y1); the pen ends back at (x0, y0)
+            enc.rect(q(r.x0 - ox), q(r.y0 - oy), q(r.x1 - ox), q(r.y1 - oy))
 
 def _rgb_to_hex(rgb):
     if not rgb: return "transparent"
@@ -453,63 +1129,111 @@ def _rgb_to_hex(rgb):
     return "#000000"
 
 
+# Slack allowed when deciding whether one layer sits inside another
+HIERARCHY_TOLERANCE = 2
+
+@timed("build_hierarchy", layers=len)
 def _build_layer_hierarchy(layers: list) -> list:
     """
     Detect parent-child relationships based on spatial containment.
-    A layer becomes a child of another if it is fully contained within it.
+    A layer becomes a child of another if it is fully contained within it;
+    its parent is the smallest such container (ties go to the earlier layer).
+    
+    Containers are found through a ContainmentIndex over the layer boxes
+    instead of scanning every other layer, which made this O(n^2) on
+    vector-heavy pages.
     """
     if not layers:
         return layers
     
-    # Initialize parentId for all layers
+    tolerance = HIERARCHY_TOLERANCE
+    geometry = []
     for layer in layers:
-        layer['parentId'] = None
+        g = (layer.get('x', 0), layer.get('y', 0), layer.get('width', 0), layer.get('height', 0))
+        geometry.append(g + (g[2] * g[3],))
+    
+    # The index needs finite, non-negative boxes. Degenerate layers are
+    # rare, so rather than special-casing them fall back to the plain scan.
+    if not all(all(math.isfinite(v) for v in g) for g in geometry):
+        return _build_layer_hierarchy_scan(layers, geometry)
+    
+    # Insert smallest first so every bucket is sorted by (area, index);
+    # a scan can then start at the first candidate bigger than the layer
+    # and stop at the first one that contains it
+    by_area = sorted(range(len(layers)), key=lambda j: (geometry[j][4], j))
+    boxes = []
+    unindexed = []  # Negative width/height: tested against every layer
+    for j in by_area:
+        px, py, pw, ph, area = geometry[j]
+        entry = (px, py, pw, ph, area, j)
+        if pw < 0 or ph < 0:
+            unindexed.append(entry)
+        else:
+            boxes.append((px - tolerance, py - tolerance, px + pw + tolerance, py + ph + tolerance, entry))
+    index = ContainmentIndex(boxes)
+    everything = [geometry[j] + (j,) for j in by_area]
+    
+    for i, layer in enumerate(layers):
+        lx, ly, lw, lh, layer_area = geometry[i]
+        
+        # A container must cover the layer's top-left corner; a negative
+        # size breaks that assumption, so those layers check every candidate
+        if lw < 0 or lh < 0:
+            buckets = [everything]
+        else:
+            buckets = itertools.chain(index.buckets(lx, ly), [unindexed])
+        
+        best = None  # (area, index) of the smallest container so far
+        for bucket in buckets:
+            # Only bigger layers can be containers
+            start = bisect.bisect_right(bucket, layer_area, key=_entry_area)
+            for k in range(start, len(bucket)):
+                px, py, pw, ph, parent_area, j = bucket[k]
+                if best is not None and (parent_area, j) >= best:
+                    break
+                if layers[j]['id'] == layer['id']:
+                    continue
+                if (lx >= px - tolerance and 
+                    ly >= py - tolerance and 
+                    lx + lw <= px + pw + tolerance and 
+                    ly + lh <= py + ph + tolerance):
+                    best = (parent_area, j)
+                    break
+        
+        layer['parentId'] = layers[best[1]]['id'] if best else None
+    
+    return layers
+
+def _entry_area(entry):
+    return entry[4]
+
+def _build_layer_hierarchy_scan(layers, geometry):
+    """
+    Quadratic version of _build_layer_hierarchy, for pages with
+    non-finite layer geometry.
+    """
+    tolerance = HIERARCHY_TOLERANCE
     
     # Sort by area descending (largest first) - candidates for parents
-    sorted_by_area = sorted(
-        enumerate(layers), 
-        key=lambda x: x[1].get('width', 0) * x[1].get('height', 0), 
-        reverse=True
-    )
+    sorted_by_area = sorted(range(len(layers)), key=lambda j: geometry[j][4], reverse=True)
     
-    # For each layer, find its smallest containing parent
     for i, layer in enumerate(layers):
-        lx = layer.get('x', 0)
-        ly = layer.get('y', 0)
-        lw = layer.get('width', 0)
-        lh = layer.get('height', 0)
+        lx, ly, lw, lh, layer_area = geometry[i]
         
         best_parent_id = None
         best_parent_area = float('inf')
         
-        for _, potential_parent in sorted_by_area:
-            # Skip self
-            if potential_parent['id'] == layer['id']:
+        for j in sorted_by_area:
+            px, py, pw, ph, parent_area = geometry[j]
+            if layers[j]['id'] == layer['id'] or parent_area <= layer_area:
                 continue
-                
-            px = potential_parent.get('x', 0)
-            py = potential_parent.get('y', 0)
-            pw = potential_parent.get('width', 0)
-            ph = potential_parent.get('height', 0)
-            
-            parent_area = pw * ph
-            layer_area = lw * lh
-            
-            # Skip if potential parent is smaller than layer
-            if parent_area <= layer_area:
-                continue
-            
-            # Check if layer is fully inside potential parent (with 2px tolerance)
-            tolerance = 2
             if (lx >= px - tolerance and 
                 ly >= py - tolerance and 
                 lx + lw <= px + pw + tolerance and 
                 ly + lh <= py + ph + tolerance):
-                
-                # Found a container, check if it's smaller than current best
                 if parent_area < best_parent_area:
                     best_parent_area = parent_area
-                    best_parent_id = potential_parent['id']
+                    best_parent_id = layers[j]['id']
         
         layer['parentId'] = best_parent_id
     
@@ -0,0 +1,188 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+# Upper bounds (seconds) of the phase duration histogram buckets
+PHASE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# Upper bounds (bytes) of the export peak memory histogram buckets
+RSS_BUCKETS = tuple(mb * 1024 * 1024 for mb in (64, 128, 256, 512, 1024, 2048, 4096, 8192))
+
+
+class Histogram:
+    """
+    Prometheus-style histogram with one series per label value.
+    """
+
+    def __init__(self, name: str, help_text: str, label: str, buckets=PHASE_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self.buckets = tuple(buckets)
+        self._series = {}  # label value -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, label_value: str, value: float):
+        with self._lock:
+            series = self._series.get(label_value)
+            if series is None:
+                series = self._series[label_value] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[bisect.bisect_left(self.buckets, value)] += 1
+            series[-1] += value
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for label_value, series in sorted(self._series.items()):
+                label = f'{self.label}="{label_value}"'
+                cumulative = 0
+                for bound, count in zip(self.buckets + ("+Inf",), series):
+                    cumulative += count
+                    lines.append(f'{self.name}_bucket{{{label},le="{bound}"}} {cumulative}')
+                lines.append(f"{self.name}_sum{{{label}}} {series[-1]}")
+                lines.append(f"{self.name}_count{{{label}}} {cumulative}")
+        return lines
+
+
+class CounterFamily:
+    """
+    Prometheus-style counter with one series per label value.
+    """
+
+    def __init__(self, name: str, help_text: str, label: str):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, label_value: str, amount: float = 1):
+        with self._lock:
+            self._values[label_value] = self._values.get(label_value, 0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for label_value, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{{{self.label}="{label_value}"}} {value}')
+        return lines
+
+
+phase_seconds = Histogram("editpdf_phase_duration_seconds", "Time spent in each extraction/export phase.", "phase")
+phase_layers = CounterFamily("editpdf_phase_layers_total", "Layers produced or consumed by each phase.", "phase")
+phase_bytes = CounterFamily("editpdf_phase_bytes_total", "Bytes produced by each phase.", "phase")
+export_peak_rss = Histogram("editpdf_export_peak_rss_bytes", "Largest worker peak RSS of each export.", "mode", RSS_BUCKETS)
+
+_local = threading.local()
+
+
+def record_phases(phases: list):
+    """
+    Adds (name, seconds, layers, bytes) phase records to the metrics.
+    """
+    for name, seconds, layers, nbytes in phases:
+        phase_seconds.observe(name, seconds)
+        if layers:
+            phase_layers.inc(name, layers)
+        if nbytes:
+            phase_bytes.inc(name, nbytes)
+
+
+_worker_stats = {}
+
+
+def register_worker_stats(name: str, fn):
+    """
+    Registers fn() -> {counter: number} as per-process stats that pool
+    workers send back with every result (see worker_pool._run_timed),
+    for the parent to add up across workers.
+    """
+    _worker_stats[name] = fn
+
+
+def worker_stats() -> dict:
+    return {name: fn() for name, fn in _worker_stats.items()}
+
+
+@contextmanager
+def collect_phases():
+    """
+    Gathers the phases finished in this thread into the yielded list
+    instead of recording them, so a pool worker can send them back with
+    its result (see worker_pool._run_timed).
+    """
+    outer = getattr(_local, "phases", None)
+    phases = []
+    _local.phases = phases
+    try:
+        yield phases
+    finally:
+        _local.phases = outer
+        if outer is not None:
+            outer.extend(phases)
+
+
+class Phase:
+    """
+    Times one phase of a request. Usable as a context manager several
+    times (time between uses, e.g. while a generator is suspended, doesn't
+    count); done() then records it once, with its counters.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.seconds = 0.0
+        self._started = None
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.seconds += time.perf_counter() - self._started
+        return False
+
+    def done(self, layers: int = 0, nbytes: int = 0):
+        record = (self.name, self.seconds, layers, nbytes)
+        phases = getattr(_local, "phases", None)
+        if phases is not None:
+            phases.append(record)
+        else:
+            record_phases([record])
+
+
+def timed(name: str, layers=None, nbytes=None):
+    """
+    Decorator recording every successful call as a phase. layers and
+    nbytes, if given, map the return value to the phase's counters.
+    """
+    def decorate(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            phase = Phase(name)
+            with phase:
+                result = fn(*args, **kwargs)
+            phase.done(layers(result) if layers else 0, nbytes(result) if nbytes else 0)
+            return result
+        return wrapper
+    return decorate
+
+
+def server_timing(phases: list) -> str:
+    """
+    Server-Timing header value for phase records, durations summed per
+    phase name. Phases nest (extract_text includes merge_text), so they
+    don't add up to the request's total.
+    """
+    totals = {}
+    for name, seconds, _, _ in phases:
+        totals[name] = totals.get(name, 0.0) + seconds
+    return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in totals.items())
+
+
+def render_metrics() -> str:
+    lines = []
+    for metric in (phase_seconds, phase_layers, phase_bytes, export_peak_rss):
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,235 @@
+import json
+import math
+import re
+
+import fitz
+
+from services.layer_extraction_service import extract_pdf_layers_json
+
+# How an edited page is exported
+EXPORT_OVERLAY = "overlay"  # Clear the changed regions of the original page and draw over them
+EXPORT_REBUILD = "rebuild"  # Regenerate the whole page from its layers
+EXPORT_MODES = (EXPORT_OVERLAY, EXPORT_REBUILD)
+
+# Layer keys that only matter to the editor UI
+UI_KEYS = {"parentId", "collapsed", "locked", "name", "z"}
+
+# Past this share of a page's layers redrawn, overlaying saves nothing
+# over rebuilding and risks more, so the page is rebuilt
+MAX_OVERLAY_FRACTION = 0.5
+
+# Extra margin (points) around a cleared drawing's stroke; drawings are
+# only removed when the redaction covers them completely
+PATH_CLEAR_MARGIN = 1
+# Cleared text regions are inset vertically by this share of the font size.
+# Any glyph the region overlaps by a tenth or so of its height is removed,
+# and neighbouring lines' boxes overlap by a few points; a quarter still
+# takes a block's own first and last lines but not its neighbours'
+TEXT_CLEAR_INSET = 0.25
+# Largest distance (points) between an image layer and a placement on the
+# page for them to be taken as the same
+IMAGE_MATCH_TOLERANCE = 0.5
+# Numbers closer than this still count as unchanged: a layer that went
+# through float32 (older MessagePack payloads, typed arrays in the editor)
+# comes back slightly off
+FLOAT_REL_TOLERANCE = 1e-6
+FLOAT_ABS_TOLERANCE = 1e-4
+
+_NONE = dict(
+    text=fitz.PDF_REDACT_TEXT_NONE,
+    images=fitz.PDF_REDACT_IMAGE_NONE,
+    graphics=fitz.PDF_REDACT_LINE_ART_NONE,
+)
+# One redaction pass per layer type, each removing only that kind of content:
+# glyphs touching the region, drawings inside it, images touching it
+CLEAR_PASSES = [
+    ("text", {**_NONE, "text": fitz.PDF_REDACT_TEXT_REMOVE}),
+    ("path", {**_NONE, "graphics": fitz.PDF_REDACT_LINE_ART_REMOVE_IF_COVERED}),
+    ("image", {**_NONE, "images": fitz.PDF_REDACT_IMAGE_REMOVE}),
+]
+
+
+def original_layers(pdf_path: str, page_num: int):
+    """
+    The layers extraction produced for a page (normally straight from the
+    result cache, as the editor had to load the page to edit it), or None
+    if the page can't be extracted.
+    """
+    try:
+        return json.loads(extract_pdf_layers_json(pdf_path, page_num))["layers"]
+    except Exception as e:
+        print(f"Overlay export: can't extract page {page_num + 1}: {e}")
+        return None
+
+
+def _same_value(a, b) -> bool:
+    if isinstance(a, float) or isinstance(b, float):
+        if isinstance(a, (int, float)) and isinstance(b, (int, float)) and not isinstance(a, bool) and not isinstance(b, bool):
+            return math.isclose(a, b, rel_tol=FLOAT_REL_TOLERANCE, abs_tol=FLOAT_ABS_TOLERANCE)
+        return False
+    if isinstance(a, dict) and isinstance(b, dict):
+        return a.keys() == b.keys() and all(_same_value(a[key], b[key]) for key in a)
+    if isinstance(a, (list, tuple)) and isinstance(b, (list, tuple)):
+        return len(a) == len(b) and all(_same_value(x, y) for x, y in zip(a, b))
+    return a == b
+
+
+def _same_layer(original: dict, layer: dict) -> bool:
+    if layer is None:
+        return False
+    for key in original.keys() | layer.keys():
+        if key not in UI_KEYS and not _same_value(original.get(key), layer.get(key)):
+            return False
+    return True
+
+
+def _layer_rect(layer: dict, ox: float, oy: float) -> fitz.Rect:
+    x, y = layer.get('x', 0) + ox, layer.get('y', 0) + oy
+    return fitz.Rect(x, y, x + layer.get('width', 0), y + layer.get('height', 0))
+
+
+def _clear_rect(layer: dict, ox: float, oy: float) -> fitz.Rect:
+    rect = _layer_rect(layer, ox, oy)
+    if layer.get('type') == 'path':
+        margin = (layer.get('strokeWidth') or 0) / 2 + PATH_CLEAR_MARGIN
+        rect = rect + (-margin, -margin, margin, margin)
+    elif layer.get('type') == 'text':
+        inset = min((layer.get('fontSize') or 0) * TEXT_CLEAR_INSET, rect.height / 4)
+        rect = rect + (0, inset, 0, -inset)
+    return rect
+
+
+def _do_pattern(name: str):
+    return re.compile(rb"/" + re.escape(name.encode("latin-1")) + rb"\s+Do\b")
+
+
+def _own_image_placements(page) -> dict:
+    """
+    {xref: (rect, resource name)} of the images drawn exactly once, by the
+    page's own content stream. Such a placement can be removed by deleting
+    its Do operator, whatever else (other pages, a background) uses it.
+    """
+    placements = {}
+    for info in page.get_image_info(xrefs=True):
+        if info["xref"] > 0:
+            placements.setdefault(info["xref"], []).append(fitz.Rect(0, 0, 1, 1) * fitz.Matrix(info["transform"]))
+    # Images the page's resources name directly (not inside a form)
+    names = {image[0]: image[7] for image in page.get_images(full=True) if image[-1] == 0}
+    doc = page.parent
+    contents = b"\n".join(doc.xref_stream(xref) or b"" for xref in page.get_contents())
+
+    own = {}
+    for xref, rects in placements.items():
+        name = names.get(xref)
+        if len(rects) == 1 and name and len(_do_pattern(name).findall(contents)) == 1:
+            own[xref] = (rects[0], name)
+    return own
+
+
+def _match_image(own: dict, rect: fitz.Rect):
+    for xref, (placed, _) in own.items():
+        if all(abs(a - b) <= IMAGE_MATCH_TOLERANCE for a, b in zip(placed, rect)):
+            return xref
+    return None
+
+
+def _remove_image_placement(page, name: str):
+    doc = page.parent
+    pattern = _do_pattern(name)
+    for xref in page.get_contents():
+        stream = doc.xref_stream(xref) or b""
+        if pattern.search(stream):
+            doc.update_stream(xref, pattern.sub(b"", stream, count=1))
+            return
+
+
+def plan_overlay(page, originals: list, layers: list):
+    """
+    Works out how to apply an edited layer list to the original page
+    without regenerating it.
+
+    Layers are matched to the extracted originals by id. Changed and
+    deleted originals are cleared from the page; changed and new layers
+    are drawn over it. An unchanged layer is redrawn as well when a
+    clearing pass would remove (part of) it, or when it is stacked above
+    a redrawn layer it overlaps, so the page still looks as edited.
+
+    Returns {"clear": {type: [rects]}, "images": [image names to remove],
+    "draw": [indices into layers]} (all empty if nothing changed), or None
+    if the page has to be rebuilt.
+    """
+    if page.rotation or originals is None:
+        return None
+    ox, oy = page.rect.x0, page.rect.y0
+
+    by_id = {original["id"]: original for original in originals}
+    edited = {}
+    for layer in layers:
+        if layer.get("id") in by_id:
+            edited.setdefault(layer["id"], layer)
+
+    # The flattened background isn't page content that can be cleared
+    if any(original.get("background") and not _same_layer(original, edited.get(original["id"])) for original in originals):
+        return None
+    # Restacked layers would need their neighbours redrawn as well
+    if [layer["id"] for layer in layers if layer.get("id") in by_id] != [o["id"] for o in originals if o["id"] in edited]:
+        return None
+
+    clear_rects = []
+    removed_images = []  # Resource names of image placements to delete
+    own = None
+    for original in originals:
+        if _same_layer(original, edited.get(original["id"])):
+            continue
+        if original["type"] == "image":
+            # A placement of its own can go without touching what's around it
+            if own is None:
+                own = _own_image_placements(page)
+            xref = _match_image(own, _layer_rect(original, ox, oy))
+            if xref is not None:
+                removed_images.append(own.pop(xref)[1])
+                continue
+        clear_rects.append((original["type"], _clear_rect(original, ox, oy)))
+    deleted = sum(1 for original in originals if original["id"] not in edited)
+    drawn = {i for i, layer in enumerate(layers) if layer.get("id") not in by_id or not _same_layer(by_id[layer["id"]], layer)}
+    rects = [_layer_rect(layer, ox, oy) for layer in layers]
+
+    limit = MAX_OVERLAY_FRACTION * max(len(originals), 1)
+    while True:
+        if len(drawn) + deleted > limit:
+            return None
+        added = False
+        for i, layer in enumerate(layers):
+            if i in drawn or layer.get("background"):
+                continue
+            if any(kind == layer["type"] and clear.intersects(rects[i]) for kind, clear in clear_rects) or any(
+                j < i and rects[j].intersects(rects[i]) for j in drawn
+            ):
+                drawn.add(i)
+                clear_rects.append((layer["type"], _clear_rect(layer, ox, oy)))
+                added = True
+        if not added:
+            break
+
+    clear = {}
+    for kind, rect in clear_rects:
+        clear.setdefault(kind, []).append(rect)
+    return {"clear": clear, "images": removed_images, "draw": sorted(drawn)}
+
+
+def clear_changed(page, plan: dict):
+    """
+    Removes a plan's cleared content from the page: image placements by
+    their Do operator, everything else with one redaction pass per layer
+    type, so e.g. clearing a text block leaves the image under it.
+    """
+    for name in plan["images"]:
+        _remove_image_placement(page, name)
+    clear = plan["clear"]
+    for kind, options in CLEAR_PASSES:
+        rects = clear.get(kind)
+        if not rects:
+            continue
+        for rect in rects:
+            page.add_redact_annot(rect, fill=False, cross_out=False)
+        page.apply_redactions(**options)
@@ -0,0 +1,70 @@
+from collections import Counter
+
+# How a page is turned into layers
+STRATEGY_FULL = "full"                # Every image, drawing and text block is its own layer
+STRATEGY_FLATTEN_VECTORS = "flatten-vectors"  # Drawings become one background image
+STRATEGY_TEXT_ONLY = "text-only"      # Drawings and images become one background image
+
+# Past these, path layers are too slow to extract and too heavy for the
+# browser to edit (engineering drawings, maps)
+MAX_EDITABLE_DRAWINGS = 3000
+MAX_EDITABLE_PATH_SEGMENTS = 60000
+# Past this, decoding every image and showing it as a layer isn't worth it
+MAX_EDITABLE_IMAGES = 300
+
+# Content stream operators, as whitespace-separated tokens
+PATH_CONSTRUCTION_OPS = {b"m", b"l", b"c", b"v", b"y", b"re", b"h"}
+PATH_PAINTING_OPS = {b"S", b"s", b"f", b"F", b"f*", b"B", b"B*", b"b", b"b*"}
+
+
+def scan_page(page) -> dict:
+    """
+    Estimates a page's drawing, image and text counts by tokenizing its
+    content streams, without interpreting them. Costs a fraction of
+    get_drawings on vector-heavy pages.
+
+    Form XObjects are counted once each, however often they are drawn, and
+    operators inside strings or inline image data can be miscounted; the
+    numbers only need to be good enough to pick a strategy.
+    """
+    doc = page.parent
+    streams = [page.read_contents()]
+    for xref, _, _, _ in page.get_xobjects():
+        try:
+            streams.append(doc.xref_stream(xref) or b"")
+        except Exception:
+            continue  # Broken form; the page still renders without it
+
+    ops = Counter()
+    for stream in streams:
+        ops.update(stream.split())
+
+    return {
+        "drawings": sum(ops[op] for op in PATH_PAINTING_OPS),
+        "pathSegments": sum(ops[op] for op in PATH_CONSTRUCTION_OPS),
+        "images": len(page.get_images()) + ops[b"BI"],
+        "textObjects": ops[b"BT"],
+    }
+
+
+def choose_strategy(complexity: dict) -> dict:
+    """
+    Picks how to extract a page from its scan_page counts.
+    Returns {"name", "reason", "complexity"}; reason is None for full
+    extraction and otherwise a sentence the editor can show as is.
+    """
+    name = STRATEGY_FULL
+    reason = None
+
+    drawings = complexity["drawings"]
+    segments = complexity["pathSegments"]
+    if complexity["images"] > MAX_EDITABLE_IMAGES:
+        name = STRATEGY_TEXT_ONLY
+        reason = (f"This page has about {complexity['images']:,} images, so images and drawings "
+                  f"are shown as one background and only text can be edited.")
+    elif drawings > MAX_EDITABLE_DRAWINGS or segments > MAX_EDITABLE_PATH_SEGMENTS:
+        name = STRATEGY_FLATTEN_VECTORS
+        reason = (f"This page has about {drawings:,} vector drawings ({segments:,} path segments), "
+                  f"so they are shown as one background image instead of editable shapes.")
+
+    return {"name": name, "reason": reason, "complexity": complexity}
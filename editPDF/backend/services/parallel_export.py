@@ -0,0 +1,196 @@
+import asyncio
+import math
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+from services.metrics import export_peak_rss
+from services.overlay_export import EXPORT_OVERLAY
+from services.pdf_creator import assemble_edits, edited_pages, generate_pages_pdf, plan_edits
+from services.worker_pool import WORKER_POOL_SIZE, get_worker_pool
+
+# Page generation tasks one export keeps running at once
+EXPORT_WORKERS = int(os.environ.get("EDITPDF_EXPORT_WORKERS") or WORKER_POOL_SIZE)
+# Most pages per generation task. Pages of one task share decoded images;
+# smaller tasks balance better and report progress sooner
+EXPORT_CHUNK_PAGES = 8
+# Exports whose progress stays queryable after they finish
+MAX_TRACKED_EXPORTS = 64
+
+# Generated pages and exported PDFs go through files here rather than
+# through memory; /export-all streams the output and then deletes it
+EXPORT_DIR = Path("cache/exports")
+# Outputs whose download never finished (the client went away) are
+# deleted by the next export once they are this old
+STALE_EXPORT_SECONDS = 3600
+
+
+class ExportProgress:
+    """
+    Where one /export-all run is: planning, generating (pages done out of
+    pages to generate), assembling, then done or failed.
+    """
+
+    def __init__(self):
+        self.state = "planning"
+        self.pages = 0
+        self.generated = 0
+        self.started = time.time()
+        self.finished = None
+        self.error = None
+        self.peak_rss = 0  # Largest peak RSS (bytes) of a worker running the export
+
+    def as_dict(self) -> dict:
+        return {
+            "state": self.state,
+            "pages": self.pages,
+            "generated": self.generated,
+            "seconds": round((self.finished or time.time()) - self.started, 3),
+            "error": self.error,
+            "peakRss": self.peak_rss,
+        }
+
+
+class ExportTracker:
+    """
+    Progress of recent exports by client-chosen export id.
+    """
+
+    def __init__(self, max_tracked: int = MAX_TRACKED_EXPORTS):
+        self.max_tracked = max_tracked
+        self._exports = OrderedDict()
+        self._lock = threading.Lock()
+
+    def start(self, export_id: str) -> ExportProgress:
+        progress = ExportProgress()
+        with self._lock:
+            self._exports[export_id] = progress
+            self._exports.move_to_end(export_id)
+            while len(self._exports) > self.max_tracked:
+                self._exports.popitem(last=False)
+        return progress
+
+    def get(self, export_id: str):
+        with self._lock:
+            progress = self._exports.get(export_id)
+            return progress.as_dict() if progress else None
+
+
+export_tracker = ExportTracker()
+
+
+def new_export_file(suffix: str = ".pdf") -> str:
+    """
+    Path of a new, empty file in EXPORT_DIR.
+    """
+    EXPORT_DIR.mkdir(parents=True, exist_ok=True)
+    fd, path = tempfile.mkstemp(dir=EXPORT_DIR, suffix=suffix)
+    os.close(fd)
+    return path
+
+
+def remove_export_file(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def sweep_stale_exports(max_age: float = STALE_EXPORT_SECONDS):
+    """
+    Deletes export files older than max_age seconds.
+    """
+    cutoff = time.time() - max_age
+    try:
+        entries = list(os.scandir(EXPORT_DIR))
+    except FileNotFoundError:
+        return
+    for entry in entries:
+        try:
+            if entry.is_file() and entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+        except OSError:
+            pass
+
+
+def page_chunks(count: int, workers: int, chunk_pages: int = EXPORT_CHUNK_PAGES) -> list:
+    """
+    (start, end) ranges splitting count pages into generation tasks: at
+    most chunk_pages each, but small enough to give every worker one. With
+    a single worker the pages stay in one task.
+    """
+    if count <= 0:
+        return []
+    if workers <= 1:
+        return [(0, count)]
+    size = max(1, min(chunk_pages, math.ceil(count / max(1, workers))))
+    return [(start, min(start + size, count)) for start in range(0, count, size)]
+
+
+async def export_pdf(pdf_path: str, modifications: dict, page_order: list = None, mode: str = EXPORT_OVERLAY,
+                     export_id: str = None, workers: int = EXPORT_WORKERS):
+    """
+    Exports the original PDF with its edited pages (see plan_edits), with
+    page generation spread over the worker pool. Planning and assembly run on the document's worker; the edited pages
+    are generated in chunks on up to workers workers at once. Pages and
+    output travel as files in EXPORT_DIR, never as bytes.
+
+    Returns (path of the exported PDF, phase records of every step). The
+    caller deletes the file (remove_export_file) once it has sent it.
+    """
+    pool = get_worker_pool()
+    progress = export_tracker.start(export_id) if export_id else ExportProgress()
+    phases = []
+    chunk_paths = []
+    output_path = None
+
+    def finished(future):
+        phases.extend(future.phases)
+        progress.peak_rss = max(progress.peak_rss, future.peak_rss)
+
+    try:
+        sweep_stale_exports()
+        future = pool.submit(plan_edits, pdf_path, modifications, page_order, mode, affinity=pdf_path)
+        edit_plan = await asyncio.wrap_future(future)
+        finished(future)
+
+        pages = edited_pages(modifications, edit_plan)
+        chunks = page_chunks(len(pages), workers)
+        progress.state = "generating"
+        progress.pages = len(pages)
+
+        # Bounded by the export itself, so it never floods the pool
+        slots = asyncio.Semaphore(max(1, workers))
+
+        async def generate(start, end, path):
+            async with slots:
+                future = pool.submit(generate_pages_pdf, pages[start:end], None, path, bounded=False)
+                await asyncio.wrap_future(future)
+            finished(future)
+            progress.generated += end - start
+
+        chunk_paths = [new_export_file() for _ in chunks]
+        await asyncio.gather(*(generate(start, end, path) for (start, end), path in zip(chunks, chunk_paths)))
+
+        progress.state = "assembling"
+        output_path = new_export_file()
+        future = pool.submit(assemble_edits, pdf_path, edit_plan, chunk_paths, output_path, affinity=pdf_path)
+        await asyncio.wrap_future(future)
+        finished(future)
+        progress.state = "done"
+        export_peak_rss.observe(mode, progress.peak_rss)
+        print(f"Exported {progress.pages} generated pages of {pdf_path}, peak worker RSS {progress.peak_rss / 2**20:.0f} MB")
+        return output_path, phases
+    except Exception as e:
+        progress.state = "failed"
+        progress.error = str(e)
+        if output_path:
+            remove_export_file(output_path)
+        raise
+    finally:
+        progress.finished = time.time()
+        for path in chunk_paths:
+            remove_export_file(path)
@@ -1,35 +1,181 @@
 from reportlab.pdfgen import canvas
+from reportlab.pdfgen.canvas import FILL_NON_ZERO
+from reportlab.pdfgen.pathobject import PDFPathObject
 from reportlab.lib.pagesizes import A4
+from reportlab.lib.colors import toColor
+from reportlab.lib.utils import ImageReader
 import io
 import base64
+import functools
+import hashlib
 import logging
+import os
 from PIL import Image
+from services.image_store import load_image_src
+from services.metrics import timed
+from services.font_registry import font_registry
+from services.svg_path import parse_path
 
 logger = logging.getLogger(__name__)
 
+# Path layers kept converted to PDF path operators, by their d string;
+# a document's shapes are exported again after every edit
+PATH_CACHE_SIZE = 4096
+# SVG paint values that mean "don't paint"
+NO_PAINT = {None, "", "none", "transparent"}
+
+
+@functools.lru_cache(maxsize=PATH_CACHE_SIZE)
+def _path_object(d: str):
+    """
+    A ReportLab path for SVG path data, in the path's own coordinates
+    (y down). Returns None if d draws nothing.
+    """
+    ops = parse_path(d)
+    if not ops:
+        return None
+    path = PDFPathObject()
+    for op in ops:
+        if op[0] == "M":
+            path.moveTo(op[1], op[2])
+        elif op[0] == "L":
+            path.lineTo(op[1], op[2])
+        elif op[0] == "C":
+            path.curveTo(*op[1:])
+        else:
+            path.close()
+    return path
+
+
+@functools.lru_cache(maxsize=256)
+def _color(value: str):
+    # toColor rebuilds its table of named colors on every call
+    return toColor(value)
+
+
+def _draw_path(c, el: dict, x: float, y_visual_top: float):
+    """
+    Draws a path layer. Its d is relative to the layer's top-left corner,
+    like the editor's viewBox, and painted with SVG defaults (black
+    nonzero fill, no stroke).
+    """
+    path = _path_object(el.get('d') or "")
+    fill = el.get('fill', '#000000')
+    stroke = el.get('stroke', 'none')
+    do_fill = fill not in NO_PAINT
+    do_stroke = stroke not in NO_PAINT
+    if path is None or not (do_fill or do_stroke):
+        return
+
+    c.saveState()
+    # Layer origin at its top-left, y pointing down as in SVG
+    c.transform(1, 0, 0, -1, x, y_visual_top)
+    if do_fill:
+        c.setFillColor(_color(fill))
+    if do_stroke:
+        c.setStrokeColor(_color(stroke))
+        stroke_width = el.get('strokeWidth')
+        c.setLineWidth(1 if stroke_width is None else stroke_width)
+    c.drawPath(path, stroke=int(do_stroke), fill=int(do_fill), fillMode=FILL_NON_ZERO)
+    c.restoreState()
+
+
+class ImageCache:
+    """
+    Decoded images shared by the pages of one export, by content hash.
+
+    An image repeated on many pages (a logo, a letterhead) is read and
+    decoded once. ReportLab names image XObjects after their pixels, so
+    pages drawn on the same canvas also embed it only once.
+    """
+
+    def __init__(self):
+        self._digests = {}  # src -> content hash
+        self._readers = {}  # content hash -> ImageReader
+        self.hits = 0
+        self.misses = 0
+
+    def reader(self, src: str):
+        """
+        ImageReader for a layer's image src, or None if it can't be resolved.
+        """
+        digest = self._digests.get(src)
+        if digest is None:
+            img_bytes = load_image_src(src)
+            if not img_bytes:
+                return None
+            digest = hashlib.sha256(img_bytes).hexdigest()
+            self._digests[src] = digest
+            if digest not in self._readers:
+                self.misses += 1
+                self._readers[digest] = ImageReader(io.BytesIO(img_bytes))
+                return self._readers[digest]
+        self.hits += 1
+        return self._readers[digest]
+
+
+@timed("generate_pdf", nbytes=len)
 def generate_pdf_from_json(elements: list, page_width: float = None, page_height: float = None, background_image: str = None) -> bytes:
     """
     Generates a PDF file from a list of form elements (JSON).
     Elements: [{type, label, x, y, width, height, value, style ...}]
     """
     buffer = io.BytesIO()
-    
+    with font_registry.drawing():
+        c = canvas.Canvas(buffer)
+        _draw_page(c, elements, page_width, page_height, background_image, ImageCache())
+        c.save()
+    buffer.seek(0)
+    return buffer.getvalue()
+
+
+def _output_size(result) -> int:
+    # PDF bytes, or the path they were written to
+    return len(result) if isinstance(result, bytes) else os.path.getsize(result)
+
+
+@timed("generate_pdf", nbytes=_output_size)
+def generate_pages_pdf(pages: list, images: ImageCache = None, output_path: str = None):
+    """
+    Generates one PDF with a page per {layers, width, height} entry of
+    pages, in order. Images are decoded and embedded once however many
+    pages show them.
+
+    Returns the PDF bytes, or output_path once written there.
+    """
+    buffer = io.BytesIO()
+    images = images or ImageCache()
+
+    with font_registry.drawing():
+        c = canvas.Canvas(output_path or buffer)
+        for page in pages:
+            _draw_page(c, page.get('layers', []), page.get('width'), page.get('height'), page.get('backgroundImage'), images)
+            # Always ends the page, so a page without layers is still a page
+            c.showPage()
+        c.save()
+    if output_path:
+        return output_path
+    buffer.seek(0)
+    return buffer.getvalue()
+
+
+def _draw_page(c, elements: list, page_width: float, page_height: float, background_image: str, images: ImageCache):
+    """
+    Draws one page's layers onto the canvas's current page.
+    """
     # Default to A4 if not specified
     if not page_width or not page_height:
         page_width, page_height = A4
-        
-    c = canvas.Canvas(buffer, pagesize=(page_width, page_height))
+
+    c.setPageSize((page_width, page_height))
     width, height = page_width, page_height
     
     # 1. Draw Background Image (if provided)
     if background_image:
         try:
-            # Check if it's a data URL
-            if background_image.startswith('data:image'):
-                header, encoded = background_image.split(",", 1)
-                img_bytes = base64.b64decode(encoded)
-                from reportlab.lib.utils import ImageReader
-                img = ImageReader(io.BytesIO(img_bytes))
+            # Data URL or extracted /images/{key} URL
+            img = images.reader(background_image)
+            if img:
                 # Draw image to fill the page
                 c.drawImage(img, 0, 0, width=width, height=height)
         except Exception as e:
@@ -45,15 +191,15 @@ def generate_pdf_from_json(elements: list, page_width: float = None, page_height
         y_visual_top = height - el.get('y', 0)
         
         if el_type == 'image':
-            img_data = el.get('src')
+            # Prefer the full resolution original over a downsampled display tier
+            img_data = el.get('originalSrc') or el.get('src')
             w = el.get('width', 0)
             h = el.get('height', 0)
-            if img_data and img_data.startswith('data:image'):
+            if img_data:
                 try:
-                    header, encoded = img_data.split(",", 1)
-                    img_bytes = base64.b64decode(encoded)
-                    from reportlab.lib.utils import ImageReader
-                    img = ImageReader(io.BytesIO(img_bytes))
+                    img = images.reader(img_data)
+                    if not img:
+                        raise ValueError(f"Unresolvable image src: {img_data[:64]}")
                     # drawImage(image, x, y, width=None, height=None)
                     # y is bottom-left of image
                     c.drawImage(img, start_x, y_visual_top - h, width=w, height=h, mask='auto')
@@ -61,49 +207,8 @@ def generate_pdf_from_json(elements: list, page_width: float = None, page_height
                     print(f"Error drawing image: {e}")
                     
         elif el_type == 'path':
-            # Use svglib to render path
-            from svglib.svglib import svg2rlg
-            from reportlab.graphics import renderPDF
-            import tempfile
-            
-            d = el.get('d')
-            fill = el.get('fill', '#000000')
-            stroke = el.get('stroke', 'none')
-            stroke_width = el.get('strokeWidth', 1)
-            
-            # Simple SVG wrapper
-            svg_content = f'<svg xmlns="http://www.w3.org/2000/svg"><path d="{d}" fill="{fill}" stroke="{stroke}" stroke-width="{stroke_width}"/></svg>'
-            
             try:
-                # svglib reads files usually, but can read stringIO?
-                # svg2rlg takes a path usually.
-                with tempfile.NamedTemporaryFile(mode='w+', suffix='.svg') as tf:
-                    tf.write(svg_content)
-                    tf.flush()
-                    drawing = svg2rlg(tf.name)
-                    
-                # Drawing is at 0,0 internally
-                # We need to translate it to start_x, y_visual_top - h
-                # Actually, the path 'd' is relative to the element's bounding box top-left?
-                # In layer_extraction: "d" was created relative to rect (x0, y0).
-                # So "M 0 0" means Top-Left of the bounding box.
-                
-                # Render Drawing
-                # renderPDF.draw(drawing, c, x, y)
-                # Note: renderPDF.draw positions the drawing's (0,0) at (x,y)
-                # Our SVG (0,0) corresponds to Top-Left of the element.
-                # ReportLab (x,y) is Bottom-Left.
-                # So if we draw at x, y_top, the SVG will be drawn UPWARDS?
-                # No, ReportLab Drawing coordinates are usually Cartesian +Y Up.
-                # SVGLib converts SVG (Y Down) to ReportLab (Y Up) automatically?
-                # Usually svglib preserves the visual layout so (0,0) top-left in SVG becomes (0, height) in ReportLab drawing?
-                # Let's assume svglib produces a Drawing object where content is correctly oriented but might need shifting.
-                
-                # Verified behavior: svglib drawing usually has Y pointing down visually relative to its origin?
-                # Let's try drawing it at (start_x, y_visual_top - el_height).
-                # Or simply:
-                renderPDF.draw(drawing, c, start_x, y_visual_top - el.get('height', 0))
-                
+                _draw_path(c, el, start_x, y_visual_top)
             except Exception as e:
                 print(f"Error drawing path: {e}")
 
@@ -157,13 +262,8 @@ def generate_pdf_from_json(elements: list, page_width: float = None, page_height
             font_size = el.get('fontSize', style.get('fontSize', 12))
             font_family = el.get('fontFamily', style.get('fontFamily', 'Arial'))
             
-            # Map frontend font names
-            pdf_font = "Helvetica"
-            if "Roboto" in font_family: pdf_font = "Roboto"
-            elif "Lato" in font_family: pdf_font = "Lato"
-            elif "Montserrat" in font_family: pdf_font = "Montserrat"
-            elif "Times" in font_family: pdf_font = "Times-Roman"
-            elif "Courier" in font_family: pdf_font = "Courier"
+            # Map frontend font names (loaded on first use)
+            pdf_font = font_registry.reportlab_font(font_family)
             
             # Create a Paragraph Style
             # Alignment mapping
@@ -248,88 +348,132 @@ def generate_pdf_from_json(elements: list, page_width: float = None, page_height
             
             c.restoreState()
 
-    c.save()
-    buffer.seek(0)
-    return buffer.getvalue()
-
-# --- Font Registration ---
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
-import os
-
-FONTS_DIR = os.path.join(os.path.dirname(__file__), "../fonts")
+import fitz
+from services.overlay_export import EXPORT_MODES, EXPORT_OVERLAY, clear_changed, original_layers, plan_overlay
 
-def register_fonts():
-    # Attempt to register standard fonts if they exist
-    font_map = {
-        "Roboto": "Roboto-Regular.ttf",
-        "Roboto-Bold": "Roboto-Bold.ttf",
-        "Lato": "Lato-Regular.ttf",
-        "Montserrat": "Montserrat-Regular.ttf"
-    }
-    
-    for name, filename in font_map.items():
-        path = os.path.join(FONTS_DIR, filename)
-        if os.path.exists(path):
-            try:
-                pdfmetrics.registerFont(TTFont(name, path))
-                print(f"Registered font: {name}")
-            except Exception as e:
-                print(f"Failed to register font {name}: {e}")
 
-# Register on module import (or lazy load)
-register_fonts()
+def _page_mod(modifications: dict, page_idx: int):
+    return modifications.get(page_idx) or modifications.get(str(page_idx))
 
-import fitz
 
-def merge_edits_into_pdf(original_pdf_path: str, modifications: dict, page_order: list = None) -> bytes:
+@timed("plan_edits")
+def plan_edits(original_pdf_path: str, modifications: dict, page_order: list = None, mode: str = EXPORT_OVERLAY) -> dict:
     """
-    Merges single-page edits into the original PDF.
-    modifications: { 
-        page_index (int/str): { 
-            'layers': [...], 
-            'width': float, 
-            'height': float 
-        } 
+    Decides how each edited page is exported.
+    modifications: {
+        page_index (int/str): {
+            'layers': [...],
+            'width': float,
+            'height': float
+        }
     }
     page_order: list of int (0-based indices) representing the desired output order.
+    mode: "overlay" keeps each edited page's original content and only
+    replaces what changed (see services.overlay_export), falling back to
+    rebuilding pages where that isn't possible; "rebuild" regenerates
+    every edited page from its layers.
+
+    The pages are then generated with edited_pages / generate_pages_pdf
+    and put together with assemble_edits (see services.parallel_export).
+    Returns {
+        "pageOrder": [valid 0-based indices],
+        "pages": [{"page": index, "overlay": overlay plan, or None to rebuild}]
+    }, with pages in the order they are to be generated.
     """
-    try:
-        doc = fitz.open(original_pdf_path)
-        out_doc = fitz.open()
+    if mode not in EXPORT_MODES:
+        raise ValueError(f"Unknown export mode: {mode}")
+    with fitz.open(original_pdf_path) as doc:
+        page_count = len(doc)
 
         # Determine the sequence of pages to process
         # If no order provided, use natural order 0..N-1
         if not page_order:
-            page_order = list(range(len(doc)))
+            page_order = list(range(page_count))
+        # Skip out of range indices
+        page_order = [page_idx for page_idx in page_order if 0 <= page_idx < page_count]
 
-        for page_idx in page_order:
-            # check bounds
-            if page_idx < 0 or page_idx >= len(doc):
+        # Edited pages, each generated once even if it appears twice
+        pages = []
+        for page_idx in dict.fromkeys(page_order):
+            page_mod = _page_mod(modifications, page_idx)
+            if not page_mod:
                 continue
-                
-            # Check if this page has edits
-            page_mod = modifications.get(page_idx) or modifications.get(str(page_idx))
-            
-            if page_mod:
-                print(f"Processing page {page_idx+1} (edited)...")
-                # Generate new page PDF
-                new_pdf_bytes = generate_pdf_from_json(
-                    page_mod.get('layers', []), 
-                    page_mod.get('width'), 
-                    page_mod.get('height')
-                )
-                
-                # Insert the generated page
-                with fitz.open("pdf", new_pdf_bytes) as temp_doc:
-                    out_doc.insert_pdf(temp_doc)
-            else:
-                # Keep original page
-                # copy page_idx from source to out_doc
-                out_doc.insert_pdf(doc, from_page=page_idx, to_page=page_idx)
-                
-        return out_doc.tobytes()
-        
-    except Exception as e:
-        print(f"Merge error: {e}")
-        raise e
+            plan = None
+            if mode == EXPORT_OVERLAY:
+                plan = plan_overlay(doc[page_idx], original_layers(original_pdf_path, page_idx), page_mod.get('layers', []))
+                if plan is not None and not any(plan.values()):
+                    continue  # Loaded in the editor, but not changed
+                if plan is not None:
+                    # Drawn over the page at its own size
+                    plan["width"], plan["height"] = doc[page_idx].rect.width, doc[page_idx].rect.height
+            pages.append({"page": page_idx, "overlay": plan})
+
+    if pages:
+        print(", ".join(
+            f"page {entry['page'] + 1} ({'rebuilt' if entry['overlay'] is None else 'overlaid'})" for entry in pages
+        ))
+    return {"pageOrder": page_order, "pages": pages}
+
+
+def edited_pages(modifications: dict, edit_plan: dict) -> list:
+    """
+    generate_pages_pdf input for an edit plan's pages, in order: the whole
+    page for rebuilt pages, only the layers to draw for overlaid ones.
+    """
+    pages = []
+    for entry in edit_plan["pages"]:
+        page_mod = _page_mod(modifications, entry["page"])
+        plan = entry["overlay"]
+        if plan is None:
+            pages.append(page_mod)
+        else:
+            layers = page_mod.get('layers', [])
+            pages.append({'layers': [layers[i] for i in plan["draw"]], 'width': plan["width"], 'height': plan["height"]})
+    return pages
+
+
+@timed("assemble_edits", nbytes=_output_size)
+def assemble_edits(original_pdf_path: str, edit_plan: dict, generated: list, output_path: str = None):
+    """
+    Builds the exported PDF from the original and the generated pages.
+    generated: PDFs (bytes or file paths) holding the edit plan's pages in
+    order, split over any number of documents.
+
+    Returns the PDF bytes, or output_path once written there.
+    """
+    with fitz.open(original_pdf_path) as doc:
+        sources = [fitz.open(data) if isinstance(data, str) else fitz.open("pdf", data) for data in generated]
+        try:
+            # Placed from as few source documents as possible: objects shared
+            # between a source's pages stay shared
+            placements = [(source, i) for source in sources for i in range(len(source))]
+            if len(placements) != len(edit_plan["pages"]):
+                raise ValueError(f"Expected {len(edit_plan['pages'])} generated pages, got {len(placements)}")
+
+            generated_pages = {}  # original page index -> index of its replacement
+            for entry, (source, i) in zip(edit_plan["pages"], placements):
+                plan = entry["overlay"]
+                if plan is None:
+                    rect = source[i].rect
+                    page = doc.new_page(width=rect.width, height=rect.height)
+                    generated_pages[entry["page"]] = len(doc) - 1
+                else:
+                    page = doc[entry["page"]]
+                    clear_changed(page, plan)
+                    if not plan["draw"]:
+                        continue  # Only deletions
+                page.show_pdf_page(page.rect, source, i)
+        finally:
+            for source in sources:
+                source.close()
+
+        # Unedited pages stay as they are, without being copied
+        doc.select([generated_pages.get(page_idx, page_idx) for page_idx in edit_plan["pageOrder"]])
+        # garbage=1 leaves out the objects of pages that were replaced; pages
+        # generated in separate documents each embed their own copy of shared
+        # images and fonts, which garbage=4 merges back into one
+        garbage = 4 if len(generated) > 1 else 1
+        if output_path:
+            doc.save(output_path, garbage=garbage)
+            return output_path
+        return doc.tobytes(garbage=garbage)
@@ -0,0 +1,181 @@
+import hashlib
+import os
+import tempfile
+import threading
+from pathlib import Path
+
+CACHE_DIR = Path("cache/results")
+DEFAULT_MAX_BYTES = 2 * 1024 * 1024 * 1024  # 2 GB
+# Share of max_bytes a directory is trimmed to, so we don't rescan on every following write
+EVICT_TO = 0.9
+
+_hash_lock = threading.Lock()
+_hash_memo = {}  # (path, mtime_ns, size) -> sha256 hex
+
+
+def file_sha256(path: str) -> str:
+    """
+    Returns the sha256 of a file's contents.
+    Memoised per (path, mtime, size) so repeated lookups don't re-read the file.
+    """
+    path = os.path.abspath(path)
+    st = os.stat(path)
+    memo_key = (path, st.st_mtime_ns, st.st_size)
+
+    with _hash_lock:
+        cached = _hash_memo.get(memo_key)
+    if cached:
+        return cached
+
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    digest = h.hexdigest()
+
+    with _hash_lock:
+        # Forget digests of older versions of this file
+        for k in [k for k in _hash_memo if k[0] == path]:
+            del _hash_memo[k]
+        _hash_memo[memo_key] = digest
+    return digest
+
+
+class BoundedDirectory:
+    """
+    Keeps the entry files under root (two levels down, matching
+    entry_glob) within max_bytes, evicting least recently used first.
+
+    A file's mtime is its last-access time: subclasses bump it on every
+    hit and call _added after every write. The directory is only scanned
+    when the running size estimate passes max_bytes, and then trimmed to
+    EVICT_TO of it. Several processes may share one directory; each keeps
+    its own estimate.
+    """
+
+    entry_glob = "*/*"
+
+    def __init__(self, root: Path, max_bytes: int):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # Size estimate since the last directory scan; rescanning on every put would be O(files)
+        self._estimated_bytes = None
+
+    @staticmethod
+    def _touch(path: Path):
+        try:
+            os.utime(path)
+        except OSError:
+            pass  # Evicted by another worker in between, the data we read is still valid
+
+    def _added(self, nbytes: int):
+        with self._lock:
+            if self._estimated_bytes is not None:
+                self._estimated_bytes += nbytes
+            if self._estimated_bytes is None or self._estimated_bytes > self.max_bytes:
+                self._evict()
+
+    def _scan(self):
+        entries = []
+        for path in self.root.glob(self.entry_glob):
+            if path.suffix == ".tmp":
+                continue  # Being written
+            try:
+                st = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def _evict(self):
+        entries = self._scan()
+        total = sum(size for _, size, _ in entries)
+
+        if total > self.max_bytes:
+            target = self.max_bytes * EVICT_TO
+            entries.sort()
+            for _, size, path in entries:
+                if total <= target:
+                    break
+                try:
+                    path.unlink()
+                except FileNotFoundError:
+                    pass  # Another worker got there first
+                total -= size
+
+        self._estimated_bytes = total
+
+
+class ResultCache(BoundedDirectory):
+    """
+    Content-addressed on-disk cache of serialized extraction results.
+
+    Entries are plain files named by key, written atomically (temp file +
+    os.replace), so several uvicorn workers can share one cache directory and
+    it survives restarts. A file's mtime is bumped on every hit and used as
+    its last-access time for LRU eviction once the directory exceeds max_bytes.
+    """
+
+    entry_glob = "*/*.json"
+
+    def __init__(self, root: Path = CACHE_DIR, max_bytes: int = DEFAULT_MAX_BYTES):
+        super().__init__(root, max_bytes)
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(doc_hash: str, page_num: int, version, variant: str = "") -> str:
+        raw = f"{doc_hash}:{page_num}:{version}:{variant}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> Path:
+        # Fan out into subdirectories to keep directory listings small
+        return self.root / key[:2] / f"{key}.json"
+
+    def get(self, key: str):
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+
+        self._touch(path)
+        self.hits += 1
+        return data
+
+    def contains(self, key: str) -> bool:
+        """
+        Whether key has an entry, without counting a hit or touching it.
+        """
+        return self._path(key).exists()
+
+    def put(self, key: str, data: bytes):
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except Exception:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+
+        self._added(len(data))
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "estimated_bytes": self._estimated_bytes,
+        }
+
+
+result_cache = ResultCache()
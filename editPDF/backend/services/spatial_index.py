@@ -0,0 +1,136 @@
+import math
+
+
+class ContainmentIndex:
+    """
+    Loose quadtree over axis-aligned boxes, for "which boxes contain this
+    point" queries.
+
+    Each box lives on the level whose cell size is between a quarter and a
+    half of its extent, so it touches at most 5x5 cells there. A point query
+    looks at one cell per level, which makes it proportional to the number
+    of levels plus the number of nearby boxes, instead of to the total
+    number of boxes. Buckets keep the insertion order of their items.
+    """
+
+    MAX_LEVELS = 20
+    # Levels below the one where cell size ~= box extent; finer cells mean
+    # fewer false candidates per query at the cost of more copies per box
+    SUBDIVISION = 1
+
+    def __init__(self, boxes):
+        """
+        boxes: list of (x0, y0, x1, y1, item) with x0 <= x1 and y0 <= y1.
+        """
+        self._cells = {}  # (level, ix, iy) -> [item, ...]
+        self._levels = set()
+        if not boxes:
+            return
+
+        self._bx = min(b[0] for b in boxes)
+        self._by = min(b[1] for b in boxes)
+        span = max(
+            max(b[2] for b in boxes) - self._bx,
+            max(b[3] for b in boxes) - self._by,
+            1.0,
+        )
+        self._cell_sizes = [span / (2 ** level) for level in range(self.MAX_LEVELS + 1)]
+
+        for x0, y0, x1, y1, item in boxes:
+            extent = max(x1 - x0, y1 - y0)
+            if extent > 0:
+                level = int(math.floor(math.log2(span / extent))) + self.SUBDIVISION
+                level = min(self.MAX_LEVELS, max(0, level))
+            else:
+                level = self.MAX_LEVELS
+            size = self._cell_sizes[level]
+
+            ix0, ix1 = self._cell(x0, self._bx, size), self._cell(x1, self._bx, size)
+            iy0, iy1 = self._cell(y0, self._by, size), self._cell(y1, self._by, size)
+            for ix in range(ix0, ix1 + 1):
+                for iy in range(iy0, iy1 + 1):
+                    self._cells.setdefault((level, ix, iy), []).append(item)
+            self._levels.add(level)
+
+        # Finest first: small boxes are the likeliest tight containers
+        self._levels = sorted(self._levels, reverse=True)
+
+    @staticmethod
+    def _cell(v, origin, size):
+        return int(math.floor((v - origin) / size))
+
+    def buckets(self, x, y):
+        """
+        Yields lists of items, one per level from the finest to the coarsest,
+        which together include every item whose box contains (x, y), plus
+        possibly some nearby items that don't; callers must still test
+        containment.
+        """
+        if not self._cells:
+            return
+        # Same arithmetic as _cell, inlined: this is the hot path
+        dx, dy = x - self._bx, y - self._by
+        cells, sizes, floor = self._cells, self._cell_sizes, math.floor
+        for level in self._levels:
+            size = sizes[level]
+            bucket = cells.get((level, int(floor(dx / size)), int(floor(dy / size))))
+            if bucket:
+                yield bucket
+
+
+class IntervalIndex:
+    """
+    Static augmented interval tree over closed 1-D intervals.
+
+    Intervals are sorted by start and every node of an implicit balanced
+    tree over that order stores the largest end below it, so whole subtrees
+    that end before the query (or start after it) are skipped.
+    """
+
+    # Below this many intervals a node is scanned linearly
+    LEAF_SIZE = 8
+
+    def __init__(self, intervals):
+        """
+        intervals: list of (start, end, item) with start <= end.
+        """
+        intervals = sorted(intervals, key=lambda iv: iv[0])
+        self._starts = [iv[0] for iv in intervals]
+        self._ends = [iv[1] for iv in intervals]
+        self._items = [iv[2] for iv in intervals]
+        self._max_end = {}
+        if intervals:
+            self._build(0, 0, len(intervals))
+
+    def __len__(self):
+        return len(self._items)
+
+    def _build(self, node, lo, hi):
+        if hi - lo <= self.LEAF_SIZE:
+            self._max_end[node] = max(self._ends[lo:hi])
+        else:
+            mid = (lo + hi) // 2
+            self._build(2 * node + 1, lo, mid)
+            self._build(2 * node + 2, mid, hi)
+            self._max_end[node] = max(self._max_end[2 * node + 1], self._max_end[2 * node + 2])
+        return self._max_end[node]
+
+    def overlapping(self, lo, hi):
+        """
+        Yields the items whose interval intersects [lo, hi].
+        """
+        starts, ends, items = self._starts, self._ends, self._items
+        stack = [(0, 0, len(items))] if items else []
+        while stack:
+            node, a, b = stack.pop()
+            # Sorted by start: if the first one starts after hi, they all do
+            if starts[a] > hi or self._max_end[node] < lo:
+                continue
+            if b - a <= self.LEAF_SIZE:
+                for k in range(a, b):
+                    if starts[k] <= hi and ends[k] >= lo:
+                        yield items[k]
+            else:
+                mid = (a + b) // 2
+                stack.append((2 * node + 1, a, mid))
+                stack.append((2 * node + 2, mid, b))
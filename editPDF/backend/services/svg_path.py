@@ -0,0 +1,292 @@
+import math
+import re
+
+
+class PathEncoder:
+    """
+    Builds compact SVG path data.
+
+    Coordinates are quantized to `precision` decimal places and kept as
+    integers internally, so relative offsets are exact and rounding never
+    accumulates along a path. Output uses relative commands, h/v shorthands
+    for axis-aligned lines, s for smooth curves and implicit command repeats,
+    and drops separators wherever the SVG grammar allows.
+    """
+
+    def __init__(self, precision: int = 2):
+        self.precision = precision
+        self.scale = 10 ** precision
+        self._parts = []
+        self._last_cmd = None
+        self._needs_sep = False
+        # Current point, subpath start and last curve control point, in integer units
+        self._cx = self._cy = 0
+        self._sx = self._sy = 0
+        self._ctrl = None
+        self._has_point = False
+        self._formatted = {}
+
+    def quantize(self, v) -> int:
+        return round(v * self.scale)
+
+    def _fmt(self, n: int) -> str:
+        s = self._formatted.get(n)
+        if s is not None:
+            return s
+        if self.precision == 0 or n % self.scale == 0:
+            s = str(n // self.scale)
+        else:
+            sign = "-" if n < 0 else ""
+            whole, frac = divmod(abs(n), self.scale)
+            frac = str(frac).rjust(self.precision, "0").rstrip("0")
+            # ".5" rather than "0.5"
+            s = f"{sign}{whole or ''}.{frac}"
+        self._formatted[n] = s
+        return s
+
+    def _emit(self, cmd, *nums):
+        # A repeated command (or "l" straight after "m") can be left implicit
+        implicit = cmd == self._last_cmd and cmd not in ("m", "z") or (cmd == "l" and self._last_cmd == "m")
+        parts = self._parts
+        if not implicit:
+            parts.append(cmd)
+            self._needs_sep = False
+        for n in nums:
+            s = self._fmt(n)
+            if self._needs_sep and s[0] != "-":
+                parts.append(" ")
+            parts.append(s)
+            self._needs_sep = True
+        self._last_cmd = "l" if implicit and cmd == "l" else cmd
+
+    def move_to(self, x: int, y: int):
+        # A leading "m" is absolute; _cx/_cy start at 0 so the same offset works
+        self._emit("m", x - self._cx, y - self._cy)
+        self._cx, self._cy = self._sx, self._sy = x, y
+        self._ctrl = None
+        self._has_point = True
+
+    def line_to(self, x: int, y: int):
+        dx, dy = x - self._cx, y - self._cy
+        if dy == 0:
+            self._emit("h", dx)
+        elif dx == 0:
+            self._emit("v", dy)
+        else:
+            self._emit("l", dx, dy)
+        self._cx, self._cy = x, y
+        self._ctrl = None
+
+    def curve_to(self, x1: int, y1: int, x2: int, y2: int, x: int, y: int):
+        cx, cy = self._cx, self._cy
+        # First control point mirrors the previous curve's second one: use "s"
+        if self._ctrl is not None and (x1, y1) == (2 * cx - self._ctrl[0], 2 * cy - self._ctrl[1]):
+            self._emit("s", x2 - cx, y2 - cy, x - cx, y - cy)
+        else:
+            self._emit("c", x1 - cx, y1 - cy, x2 - cx, y2 - cy, x - cx, y - cy)
+        self._cx, self._cy = x, y
+        self._ctrl = (x2, y2)
+
+    def close(self):
+        self._emit("z")
+        self._cx, self._cy = self._sx, self._sy
+        self._ctrl = None
+
+    def rect(self, x0: int, y0: int, x1: int, y1: int):
+        self.move_to(x0, y0)
+        self._emit("h", x1 - x0)
+        self._emit("v", y1 - y0)
+        self._emit("h", x0 - x1)
+        self._cx, self._cy = x0, y1
+        self.close()
+
+    def break_subpath(self):
+        """
+        Forgets the pen position so the next segment starts with a move,
+        even if it begins where the previous one ended.
+        """
+        self._has_point = False
+        self._ctrl = None
+
+    @property
+    def current_point(self):
+        """
+        The pen position, or None before the first move_to.
+        """
+        return (self._cx, self._cy) if self._has_point else None
+
+    def getvalue(self) -> str:
+        return "".join(self._parts)
+
+
+_TOKEN_RE = re.compile(r"\s*,?\s*(?:([MmLlHhVvCcSsQqTtAaZz])|([+-]?(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?))")
+_FLAG_RE = re.compile(r"\s*,?\s*([01])")
+# Numbers each command takes per repeat
+_ARG_COUNTS = {"m": 2, "l": 2, "h": 1, "v": 1, "c": 6, "s": 4, "q": 4, "t": 2, "a": 7, "z": 0}
+
+
+def _tokens(d: str):
+    """
+    Yields (command, args) for each command of SVG path data, splitting
+    implicit repeats into separate commands. Stops quietly at the first
+    malformed token; like browsers, everything before it is kept.
+    """
+    pos = 0
+    cmd = None
+    end = len(d.rstrip())
+    while pos < end:
+        match = _TOKEN_RE.match(d, pos)
+        if match is None:
+            return
+        if match.group(1):
+            cmd = match.group(1)
+            pos = match.end()
+            if cmd in "zZ":
+                yield cmd, ()
+                continue
+        elif cmd is None or cmd in "zZ":
+            return
+        args = []
+        for i in range(_ARG_COUNTS[cmd.lower()]):
+            # Arc flags are single digits and may run into the next number
+            regex = _FLAG_RE if cmd in "aA" and i in (3, 4) else _TOKEN_RE
+            match = regex.match(d, pos)
+            if match is None or (regex is _TOKEN_RE and match.group(2) is None):
+                return
+            args.append(float(match.group(match.lastindex)))
+            pos = match.end()
+        yield cmd, args
+        # Pairs after a move are line segments
+        if cmd == "m":
+            cmd = "l"
+        elif cmd == "M":
+            cmd = "L"
+
+
+def parse_path(d: str) -> list:
+    """
+    Parses SVG path data into absolute segments:
+    ("M", x, y), ("L", x, y), ("C", x1, y1, x2, y2, x, y) and ("Z",).
+    Shorthands, quadratic curves and arcs are converted to these.
+    """
+    ops = []
+    cx = cy = 0.0  # Current point
+    sx = sy = 0.0  # Subpath start
+    last_cubic = last_quad = None  # Control points reflected by S and T
+
+    for cmd, args in _tokens(d or ""):
+        rel = cmd.islower()
+        op = cmd.upper()
+        ox, oy = (cx, cy) if rel else (0.0, 0.0)
+        cubic = quad = None
+
+        if op == "Z":
+            ops.append(("Z",))
+            cx, cy = sx, sy
+        elif op == "M":
+            cx, cy = ox + args[0], oy + args[1]
+            sx, sy = cx, cy
+            ops.append(("M", cx, cy))
+        elif op in "LHV":
+            if op == "L":
+                x, y = ox + args[0], oy + args[1]
+            elif op == "H":
+                x, y = ox + args[0], cy
+            else:
+                x, y = cx, (cy if rel else 0.0) + args[0]
+            ops.append(("L", x, y))
+            cx, cy = x, y
+        elif op in "CS":
+            if op == "C":
+                x1, y1 = ox + args[0], oy + args[1]
+                rest = args[2:]
+            else:
+                x1, y1 = (2 * cx - last_cubic[0], 2 * cy - last_cubic[1]) if last_cubic else (cx, cy)
+                rest = args
+            x2, y2 = ox + rest[0], oy + rest[1]
+            x, y = ox + rest[2], oy + rest[3]
+            ops.append(("C", x1, y1, x2, y2, x, y))
+            cubic = (x2, y2)
+            cx, cy = x, y
+        elif op in "QT":
+            if op == "Q":
+                qx, qy = ox + args[0], oy + args[1]
+                x, y = ox + args[2], oy + args[3]
+            else:
+                qx, qy = (2 * cx - last_quad[0], 2 * cy - last_quad[1]) if last_quad else (cx, cy)
+                x, y = ox + args[0], oy + args[1]
+            # Degree elevation: the same curve as a cubic
+            ops.append(("C", cx + 2 / 3 * (qx - cx), cy + 2 / 3 * (qy - cy),
+                        x + 2 / 3 * (qx - x), y + 2 / 3 * (qy - y), x, y))
+            quad = (qx, qy)
+            cx, cy = x, y
+        elif op == "A":
+            x, y = ox + args[5], oy + args[6]
+            ops.extend(_arc_to_curves(cx, cy, args[0], args[1], args[2], bool(args[3]), bool(args[4]), x, y))
+            cx, cy = x, y
+
+        last_cubic, last_quad = cubic, quad
+    return ops
+
+
+def _arc_to_curves(x1, y1, rx, ry, angle, large_arc, sweep, x2, y2):
+    """
+    Cubic segments approximating an SVG elliptical arc, converted to center
+    parameterization as in the SVG spec (implementation notes F.6.5/F.6.6).
+    """
+    if (x1, y1) == (x2, y2):
+        return []
+    rx, ry = abs(rx), abs(ry)
+    if rx == 0 or ry == 0:
+        return [("L", x2, y2)]
+
+    phi = math.radians(angle % 360)
+    cos_phi, sin_phi = math.cos(phi), math.sin(phi)
+    dx, dy = (x1 - x2) / 2, (y1 - y2) / 2
+    x1p = cos_phi * dx + sin_phi * dy
+    y1p = -sin_phi * dx + cos_phi * dy
+
+    # Radii too small to reach the end point are scaled up
+    scale = (x1p / rx) ** 2 + (y1p / ry) ** 2
+    if scale > 1:
+        rx, ry = rx * math.sqrt(scale), ry * math.sqrt(scale)
+
+    num = rx * rx * ry * ry - rx * rx * y1p * y1p - ry * ry * x1p * x1p
+    den = rx * rx * y1p * y1p + ry * ry * x1p * x1p
+    coef = math.sqrt(max(0.0, num / den)) if den else 0.0
+    if large_arc == sweep:
+        coef = -coef
+    cxp, cyp = coef * rx * y1p / ry, -coef * ry * x1p / rx
+    center_x = cos_phi * cxp - sin_phi * cyp + (x1 + x2) / 2
+    center_y = sin_phi * cxp + cos_phi * cyp + (y1 + y2) / 2
+
+    start = math.atan2((y1p - cyp) / ry, (x1p - cxp) / rx)
+    delta = math.atan2((-y1p - cyp) / ry, (-x1p - cxp) / rx) - start
+    if sweep and delta < 0:
+        delta += 2 * math.pi
+    elif not sweep and delta > 0:
+        delta -= 2 * math.pi
+
+    # At most a quarter turn per cubic keeps the error well below a pixel
+    count = max(1, math.ceil(abs(delta) / (math.pi / 2) - 1e-9))
+    step = delta / count
+    k = 4 / 3 * math.tan(step / 4)
+
+    def point(t):
+        return (center_x + rx * math.cos(t) * cos_phi - ry * math.sin(t) * sin_phi,
+                center_y + rx * math.cos(t) * sin_phi + ry * math.sin(t) * cos_phi)
+
+    def derivative(t):
+        return (-rx * math.sin(t) * cos_phi - ry * math.cos(t) * sin_phi,
+                -rx * math.sin(t) * sin_phi + ry * math.cos(t) * cos_phi)
+
+    curves = []
+    t = start
+    px, py = x1, y1
+    for i in range(count):
+        t2 = t + step
+        ex, ey = (x2, y2) if i == count - 1 else point(t2)
+        d1, d2 = derivative(t), derivative(t2)
+        curves.append(("C", px + k * d1[0], py + k * d1[1], ex - k * d2[0], ey - k * d2[1], ex, ey))
+        t, px, py = t2, ex, ey
+    return curves
@@ -0,0 +1,177 @@
+import hashlib
+import io
+import math
+from pathlib import Path
+from PIL import Image, features
+import fitz  # PyMuPDF
+from services.result_cache import file_sha256
+from services.image_store import ImageStore
+from services.layer_extraction_service import document_cache
+
+THUMBNAIL_DIR = Path("cache/thumbnails")
+THUMBNAIL_MAX_BYTES = 512 * 1024 * 1024  # 512 MB
+
+# Page reorder tiles are ~150 CSS px wide, so 36 DPI (306 px for US Letter)
+# stays sharp on 2x screens
+DEFAULT_THUMBNAIL_DPI = 36
+MIN_THUMBNAIL_DPI = 8
+MAX_THUMBNAIL_DPI = 150
+# Longest side cap, so poster-sized pages don't produce huge thumbnails
+MAX_THUMBNAIL_PX = 512
+WEBP_QUALITY = 80
+# libwebp can't encode an image with a longer side; taller sprite sheets are PNG
+WEBP_MAX_PX = 16383
+SPRITE_COLUMNS = 8
+
+THUMBNAIL_FORMATS = ("webp", "png") if features.check("webp") else ("png",)
+DEFAULT_THUMBNAIL_FORMAT = THUMBNAIL_FORMATS[0]
+
+# Rendered pages are write-once files, like extracted images; evicted
+# ones are simply rendered again
+thumbnail_store = ImageStore(THUMBNAIL_DIR, THUMBNAIL_MAX_BYTES)
+
+
+class PageOutOfRange(ValueError):
+    """
+    Raised when a requested page isn't in the document. Handlers turn it
+    into a 404; any other error is a 500.
+    """
+
+
+def thumbnail_options(dpi: float = None, fmt: str = None):
+    """
+    Normalizes request parameters to (dpi, format). DPI is rounded and
+    clamped so near-identical requests share a cache entry; unknown formats
+    fall back to the default.
+    """
+    dpi = round(dpi) if dpi else DEFAULT_THUMBNAIL_DPI
+    dpi = min(max(dpi, MIN_THUMBNAIL_DPI), MAX_THUMBNAIL_DPI)
+    fmt = (fmt or "").lower()
+    if fmt not in THUMBNAIL_FORMATS:
+        fmt = DEFAULT_THUMBNAIL_FORMAT
+    return dpi, fmt
+
+
+def thumbnail_key(doc_hash: str, page_num: int, dpi: int, fmt: str) -> str:
+    return hashlib.sha256(f"{doc_hash}:{page_num}:{dpi}:{fmt}".encode("utf-8")).hexdigest()
+
+
+def sprite_key(doc_hash: str, pages: list, dpi: int, fmt: str, columns: int) -> str:
+    page_list = ",".join(str(p) for p in pages)
+    return hashlib.sha256(f"{doc_hash}:sprite:{page_list}:{dpi}:{fmt}:{columns}".encode("utf-8")).hexdigest()
+
+
+def _encode(img: Image.Image, fmt: str) -> bytes:
+    buffer = io.BytesIO()
+    if fmt == "webp":
+        img.save(buffer, "WEBP", quality=WEBP_QUALITY)
+    else:
+        img.save(buffer, "PNG", optimize=True)
+    return buffer.getvalue()
+
+
+def _thumbnail_matrix(page, dpi: int):
+    scale = min(dpi / 72, MAX_THUMBNAIL_PX / max(page.rect.width, page.rect.height, 1))
+    return fitz.Matrix(scale, scale)
+
+
+def find_thumbnail(pdf_path: str, page_num: int, dpi: int = DEFAULT_THUMBNAIL_DPI, fmt: str = DEFAULT_THUMBNAIL_FORMAT):
+    """
+    Returns (path, key) of an already rendered thumbnail, or None. Reads
+    only the file hash and the store, never the document, so it can run
+    outside the workers.
+    """
+    key = thumbnail_key(file_sha256(pdf_path), page_num, dpi, fmt)
+    path = thumbnail_store.find(key)
+    return (path, key) if path is not None else None
+
+
+def render_thumbnail(pdf_path: str, page_num: int, dpi: int = DEFAULT_THUMBNAIL_DPI, fmt: str = DEFAULT_THUMBNAIL_FORMAT):
+    """
+    Returns (path, key) of a page rendered at dpi, rendering and storing it
+    the first time. Keyed by the document's content hash, so a re-uploaded
+    file never gets a stale thumbnail.
+    Raises PageOutOfRange if page_num is out of range.
+    """
+    doc = document_cache.get(pdf_path)
+    if not 0 <= page_num < len(doc):
+        raise PageOutOfRange("Page number out of range")
+
+    key = thumbnail_key(file_sha256(pdf_path), page_num, dpi, fmt)
+    path = thumbnail_store.find(key)
+    if path is not None:
+        return path, key
+
+    # No annotations: the editor shows page content only
+    page = doc[page_num]
+    pix = page.get_pixmap(matrix=_thumbnail_matrix(page, dpi), alpha=False, annots=False)
+    if fmt == "png":
+        data = pix.tobytes("png")
+    else:
+        data = _encode(Image.frombytes("RGB", (pix.width, pix.height), pix.samples), fmt)
+    return thumbnail_store.put(key, data, fmt), key
+
+
+def sprite_layout(pdf_path: str, pages: list, dpi: int, columns: int = SPRITE_COLUMNS) -> dict:
+    """
+    Where each page's thumbnail sits in a sprite sheet: a grid of equal
+    cells sized to the largest page, thumbnails at each cell's top-left.
+    Computed from the page boxes alone, without rendering.
+    """
+    doc = document_cache.get(pdf_path)
+    sizes = []
+    for page_num in pages:
+        # Same rounding as get_pixmap; page.rect already accounts for rotation
+        page = doc[page_num]
+        irect = (page.rect * _thumbnail_matrix(page, dpi)).round()
+        sizes.append((irect.width, irect.height))
+
+    columns = max(1, min(columns, len(pages)))
+    cell_width = max((w for w, _ in sizes), default=0)
+    cell_height = max((h for _, h in sizes), default=0)
+    tiles = []
+    for i, (page_num, (w, h)) in enumerate(zip(pages, sizes)):
+        row, col = divmod(i, columns)
+        tiles.append({"page": page_num, "x": col * cell_width, "y": row * cell_height, "width": w, "height": h})
+
+    return {
+        "columns": columns,
+        "cellWidth": cell_width,
+        "cellHeight": cell_height,
+        "width": columns * cell_width,
+        "height": math.ceil(len(pages) / columns) * cell_height,
+        "tiles": tiles,
+    }
+
+
+def render_sprite(pdf_path: str, pages: list = None, dpi: int = DEFAULT_THUMBNAIL_DPI, fmt: str = DEFAULT_THUMBNAIL_FORMAT, columns: int = SPRITE_COLUMNS):
+    """
+    Returns (path, key, layout) of a sprite sheet holding the thumbnails of
+    pages (all if None; duplicates and pages out of range are dropped), so
+    the reorder view can fetch every page in one request.
+    Tiles come from the per-page thumbnail cache, so a sheet over
+    pre-generated thumbnails costs no page rendering.
+    The sheet is PNG instead of WebP when it is too large for WebP (a few
+    hundred pages at the default columns).
+    Raises PageOutOfRange if no page is left.
+    """
+    page_count = len(document_cache.get(pdf_path))
+    pages = [p for p in dict.fromkeys(range(page_count) if pages is None else pages) if 0 <= p < page_count]
+    if not pages:
+        raise PageOutOfRange("No pages in range")
+
+    layout = sprite_layout(pdf_path, pages, dpi, columns)
+    key = sprite_key(file_sha256(pdf_path), pages, dpi, fmt, layout["columns"])
+    path = thumbnail_store.find(key)
+    if path is not None:
+        return path, key, layout
+
+    sheet_fmt = fmt
+    if fmt == "webp" and max(layout["width"], layout["height"]) > WEBP_MAX_PX:
+        sheet_fmt = "png"
+    sheet = Image.new("RGB", (max(1, layout["width"]), max(1, layout["height"])), "white")
+    for tile in layout["tiles"]:
+        tile_path, _ = render_thumbnail(pdf_path, tile["page"], dpi, fmt)
+        with Image.open(tile_path) as img:
+            sheet.paste(img.convert("RGB"), (tile["x"], tile["y"]))
+    return thumbnail_store.put(key, _encode(sheet, sheet_fmt), sheet_fmt), key, layout
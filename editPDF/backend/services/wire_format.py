@@ -0,0 +1,169 @@
+import gzip
+import io
+import json
+
+try:
+    import msgpack
+except ImportError:  # JSON only
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:  # gzip only
+    zstandard = None
+
+JSON_MEDIA_TYPE = "application/json"
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+# Also seen in the wild for the same format
+MSGPACK_MEDIA_TYPES = (MSGPACK_MEDIA_TYPE, "application/x-msgpack", "application/vnd.msgpack")
+
+# Bodies smaller than this aren't worth compressing
+MIN_COMPRESS_SIZE = 1024
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+# Largest request body accepted once decompressed: a few KB of gzip/zstd
+# could otherwise expand to gigabytes in the API process
+MAX_DECOMPRESSED_SIZE = 256 * 1024 * 1024
+DECOMPRESS_CHUNK = 1024 * 1024
+
+
+class RequestTooLarge(ValueError):
+    """
+    Raised when a request body decompresses past MAX_DECOMPRESSED_SIZE.
+    Handlers turn it into a 413.
+    """
+
+
+def _media_ranges(header: str):
+    """
+    Parses an Accept / Accept-Encoding header into {token: q}.
+    """
+    ranges = {}
+    for part in (header or "").split(","):
+        token, _, params = part.strip().partition(";")
+        token = token.strip().lower()
+        if not token:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        ranges[token] = q
+    return ranges
+
+
+def wants_msgpack(accept: str) -> bool:
+    """
+    True if the client explicitly accepts MessagePack at least as much as
+    JSON. Wildcards don't count: JSON stays the default.
+    """
+    if msgpack is None:
+        return False
+    ranges = _media_ranges(accept)
+    q_msgpack = max((ranges.get(t, 0.0) for t in MSGPACK_MEDIA_TYPES), default=0.0)
+    return q_msgpack > 0 and q_msgpack >= ranges.get(JSON_MEDIA_TYPE, 0.0)
+
+
+def choose_encoding(accept_encoding: str):
+    """
+    Picks the Content-Encoding for a response: zstd if both sides have it,
+    then gzip, else None (identity).
+    """
+    ranges = _media_ranges(accept_encoding)
+    wildcard = ranges.get("*", 0.0)
+    if zstandard is not None and ranges.get("zstd", wildcard) > 0:
+        return "zstd"
+    if ranges.get("gzip", wildcard) > 0:
+        return "gzip"
+    return None
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    if encoding == "gzip":
+        return gzip.compress(data, compresslevel=GZIP_LEVEL)
+    return data
+
+
+def _read_limited(stream, max_size: int) -> bytes:
+    chunks = []
+    total = 0
+    while True:
+        chunk = stream.read(min(DECOMPRESS_CHUNK, max_size + 1 - total))
+        if not chunk:
+            return b"".join(chunks)
+        chunks.append(chunk)
+        total += len(chunk)
+        if total > max_size:
+            raise RequestTooLarge(f"Request body larger than {max_size} bytes once decompressed")
+
+
+def decompress(data: bytes, encoding: str, max_size: int = MAX_DECOMPRESSED_SIZE) -> bytes:
+    """
+    Undoes a Content-Encoding, reading at most max_size bytes of output.
+    Raises RequestTooLarge past that.
+    """
+    encoding = (encoding or "identity").strip().lower()
+    if encoding == "zstd":
+        if zstandard is None:
+            raise ValueError("zstd request bodies are not supported (zstandard is not installed)")
+        reader = zstandard.ZstdDecompressor().stream_reader(io.BytesIO(data), read_across_frames=True)
+        return _read_limited(reader, max_size)
+    if encoding == "gzip":
+        return _read_limited(gzip.GzipFile(fileobj=io.BytesIO(data)), max_size)
+    if encoding == "identity":
+        if len(data) > max_size:
+            raise RequestTooLarge(f"Request body larger than {max_size} bytes")
+        return data
+    raise ValueError(f"Unsupported Content-Encoding: {encoding}")
+
+
+def pack(obj) -> bytes:
+    """
+    MessagePack encoding of the layer model. Floats stay float64: layers
+    come back to /export-all as the client received them, and export
+    compares them with the extracted originals to find what was edited.
+    """
+    return msgpack.packb(obj)
+
+
+def unpack(data: bytes):
+    return msgpack.unpackb(data, raw=False, strict_map_key=False)
+
+
+def encode_response(result_json: bytes, accept: str = "", accept_encoding: str = ""):
+    """
+    Encodes an already serialized JSON payload for the client.
+    Returns (body, media_type, headers).
+    """
+    if wants_msgpack(accept):
+        body, media_type = pack(json.loads(result_json)), MSGPACK_MEDIA_TYPE
+    else:
+        body, media_type = result_json, JSON_MEDIA_TYPE
+
+    # The body depends on both headers, so caches must key on them
+    headers = {"Vary": "Accept, Accept-Encoding"}
+    encoding = choose_encoding(accept_encoding) if len(body) >= MIN_COMPRESS_SIZE else None
+    if encoding:
+        body = compress(body, encoding)
+        headers["Content-Encoding"] = encoding
+    return body, media_type, headers
+
+
+def decode_request(body: bytes, content_type: str = "", content_encoding: str = ""):
+    """
+    Decodes a JSON or MessagePack request body, optionally gzip/zstd
+    compressed.
+    """
+    body = decompress(body, content_encoding)
+    media_type = (content_type or "").split(";")[0].strip().lower()
+    if media_type in MSGPACK_MEDIA_TYPES:
+        if msgpack is None:
+            raise ValueError("MessagePack request bodies are not supported (msgpack is not installed)")
+        return unpack(body)
+    return json.loads(body)
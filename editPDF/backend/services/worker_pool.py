@@ -0,0 +1,254 @@
+import multiprocessing
+import os
+import sys
+import threading
+import time
+import zlib
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from services.metrics import collect_phases, record_phases, worker_stats
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Worker processes for PDF work (extraction, generation, export)
+WORKER_POOL_SIZE = int(os.environ.get("EDITPDF_WORKERS") or os.cpu_count() or 1)
+# Tasks (running + waiting) one worker accepts before requests get a 503
+MAX_QUEUE_DEPTH = int(os.environ.get("EDITPDF_MAX_QUEUE_DEPTH") or 8)
+
+# Workers are forked from a single-threaded server process, never from the
+# API process: its threads (ingest dispatcher, asyncio.to_thread) may hold
+# locks that a forked child would inherit held. Windows only has spawn.
+START_METHOD = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+_mp_context = multiprocessing.get_context(START_METHOD)
+if START_METHOD == "forkserver":
+    # Imported once in the server, so new workers start with PyMuPDF loaded
+    _mp_context.set_forkserver_preload(["services.layer_extraction_service"])
+
+
+class PoolSaturated(Exception):
+    """
+    Raised instead of queueing more work than the pool accepts.
+    Handlers turn it into a 503 with Retry-After.
+    """
+
+
+def _reset_peak_rss():
+    # Linux only: resets the process's VmHWM to its current RSS
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def _peak_rss() -> int:
+    """
+    Peak RSS (bytes) of this process since _reset_peak_rss, or since it
+    started where the peak can't be reset.
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    if resource is None:
+        return 0
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _run_timed(fn, args):
+    # Wall clock, so the parent can compare it with its own submit time.
+    # Phase timings come back with the result; the metrics live in the parent.
+    # A lane runs one task at a time, so the peak RSS is this task's own.
+    # The worker's cache counters come back too, as of the end of the task.
+    _reset_peak_rss()
+    started = time.time()
+    with collect_phases() as phases:
+        result = fn(*args)
+    return started, time.time(), result, phases, _peak_rss(), worker_stats()
+
+
+class _Timing:
+    __slots__ = ("count", "total", "max")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def as_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "total_seconds": round(self.total, 6),
+            "mean_seconds": round(self.total / self.count, 6) if self.count else None,
+            "max_seconds": round(self.max, 6),
+        }
+
+
+class _Lane:
+    __slots__ = ("executor", "pending", "worker_stats")
+
+    def __init__(self):
+        self.executor = ProcessPoolExecutor(max_workers=1, mp_context=_mp_context)
+        self.pending = 0
+        self.worker_stats = {}  # The worker's latest metrics.worker_stats()
+
+
+class WorkerPool:
+    """
+    Fixed set of single-process lanes for CPU-bound PDF work, so the
+    event loop never runs PyMuPDF/ReportLab code itself.
+
+    Work with an affinity key (normally the document path) always goes to
+    the same lane, so that worker's document_cache already has the file
+    open. Work without one goes to the least loaded lane. A lane holding
+    max_queue_depth tasks rejects more with PoolSaturated rather than
+    letting latency grow without bound.
+    """
+
+    def __init__(self, size: int = WORKER_POOL_SIZE, max_queue_depth: int = MAX_QUEUE_DEPTH):
+        self.size = max(1, size)
+        self.max_queue_depth = max_queue_depth
+        self._lanes = [_Lane() for _ in range(self.size)]
+        self._lock = threading.Lock()
+        self.queue_wait = _Timing()
+        self.run_time = _Timing()
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+
+    def lane_for(self, affinity) -> int:
+        return zlib.crc32(str(affinity).encode("utf-8")) % self.size
+
+    def least_loaded_lane(self) -> int:
+        with self._lock:
+            return min(range(self.size), key=lambda i: self._lanes[i].pending)
+
+    def submit(self, fn, *args, affinity=None, lane: int = None, bounded: bool = True) -> Future:
+        """
+        Runs fn(*args) in a worker process. Returns a Future for its result;
+        once done, its "phases" attribute holds the (name, seconds, layers,
+        bytes) phase records of the run, queue wait first, and "peak_rss"
+        the worker's peak RSS in bytes while running it.
+        Raises PoolSaturated if the target lane is full, unless bounded is
+        False (for callers that limit their own in-flight work).
+        """
+        if lane is None:
+            lane = self.lane_for(affinity) if affinity is not None else self.least_loaded_lane()
+        future = Future()
+        submitted = time.time()
+
+        with self._lock:
+            entry = self._lanes[lane]
+            if bounded and entry.pending >= self.max_queue_depth:
+                self.rejected += 1
+                raise PoolSaturated(f"Worker {lane} has {entry.pending} tasks queued")
+            entry.pending += 1
+            try:
+                try:
+                    inner = entry.executor.submit(_run_timed, fn, args)
+                except BrokenProcessPool:
+                    # The worker died (e.g. OOM killed); start a fresh one
+                    entry.executor = ProcessPoolExecutor(max_workers=1, mp_context=_mp_context)
+                    inner = entry.executor.submit(_run_timed, fn, args)
+            except Exception:
+                entry.pending -= 1
+                raise
+
+        inner.add_done_callback(lambda f: self._on_done(lane, submitted, f, future))
+        return future
+
+    def _on_done(self, lane, submitted, inner, future):
+        if inner.cancelled():
+            error = RuntimeError("Worker pool shut down")
+        else:
+            error = inner.exception()
+
+        with self._lock:
+            self._lanes[lane].pending -= 1
+            if error is None:
+                started, finished, result, phases, peak_rss, stats = inner.result()
+                self._lanes[lane].worker_stats = stats
+                queue_wait = max(0.0, started - submitted)
+                self.queue_wait.add(queue_wait)
+                self.run_time.add(finished - started)
+                self.completed += 1
+            else:
+                self.failed += 1
+
+        if error is None:
+            future.phases = [("queue_wait", queue_wait, 0, 0)] + phases
+            future.peak_rss = peak_rss
+            record_phases(future.phases)
+            future.set_result(result)
+        else:
+            future.set_exception(error)
+
+    def shutdown(self):
+        for entry in self._lanes:
+            entry.executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "workers": self.size,
+                "max_queue_depth": self.max_queue_depth,
+                "pending": [entry.pending for entry in self._lanes],
+                "completed": self.completed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+                "queue_wait": self.queue_wait.as_dict(),
+                "run_time": self.run_time.as_dict(),
+            }
+
+    def worker_stats(self) -> dict:
+        """
+        The workers' registered stats (see metrics.register_worker_stats)
+        as of each one's latest task, added up across workers.
+        """
+        with self._lock:
+            snapshots = [entry.worker_stats for entry in self._lanes]
+        totals = {}
+        for snapshot in snapshots:
+            for name, values in snapshot.items():
+                merged = totals.setdefault(name, {})
+                for key, value in values.items():
+                    if isinstance(value, (int, float)):
+                        merged[key] = merged.get(key, 0) + value
+        return totals
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_worker_pool() -> WorkerPool:
+    """
+    Lazily creates the shared worker pool. Each worker keeps its own
+    document_cache, so routing by document keeps handles warm.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = WorkerPool()
+        return _pool
+
+
+def shutdown_worker_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown()
+            _pool = None
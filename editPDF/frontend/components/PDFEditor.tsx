@@ -2,6 +2,7 @@
 
 import { useState, useRef, useEffect, useCallback } from "react";
 import { cn } from "@/lib/utils";
+import { MSGPACK_MEDIA_TYPE, encode, gzip, readPayload } from "@/lib/msgpack";
 import { EditorSidebar } from "./Editor/EditorSidebar";
 import { FileUpload } from "./FileUpload";
 import dynamic from "next/dynamic";
@@ -291,10 +292,10 @@ export function PDFEditor() {
             // Page is 0-indexed for backend usually, but UI is 1-indexed. Let's assume backend expects 0-indexed.
             const res = await fetch(`${process.env.NEXT_PUBLIC_API_URL}/process-page`, {
                 method: "POST",
-                headers: { "Content-Type": "application/json" },
+                headers: { "Content-Type": "application/json", "Accept": MSGPACK_MEDIA_TYPE },
                 body: JSON.stringify({ filename, page: editPage - 1 })
             });
-            const data = await res.json();
+            const data = await readPayload(res);
             if (data.error) {
                 console.error("Analysis Error:", data.error);
                 alert(`Error analyzing page: ${data.error}`);
@@ -333,14 +334,20 @@ export function PDFEditor() {
                 modifications[backendIndex.toString()] = data;
             });
 
+            // Layer payloads are large: send them as (gzipped) MessagePack
+            const packed = encode({
+                filename,
+                modifications,
+                pageOrder // Pass reordered indices (0-based)
+            });
+            const gzipped = await gzip(packed);
+            const headers: Record<string, string> = { "Content-Type": MSGPACK_MEDIA_TYPE };
+            if (gzipped) headers["Content-Encoding"] = "gzip";
+
             const res = await fetch(`${process.env.NEXT_PUBLIC_API_URL}/export-all`, {
                 method: "POST",
-                headers: { "Content-Type": "application/json" },
-                body: JSON.stringify({
-                    filename,
-                    modifications,
-                    pageOrder // Pass reordered indices (0-based)
-                })
+                headers,
+                body: (gzipped || packed) as BodyInit
             });
 
             if (res.ok) {
@@ -378,7 +385,7 @@ export function PDFEditor() {
                     isOpen={isReorderModalOpen}
                     onClose={() => setIsReorderModalOpen(false)}
                     onExport={handleExport}
-                    pdfUrl={pdfUrl || ""}
+                    filename={filename || ""}
                     numPages={numPages}
                 />
 
@@ -392,6 +399,12 @@ export function PDFEditor() {
                         {analyzedPages[editPage] ? (
                             <div className="flex flex-1 h-full overflow-hidden">
                                 <div className="flex-1 h-full overflow-auto bg-slate-200/50 relative">
+                                    {/* Pages too complex to edit in full are partly flattened by the backend */}
+                                    {analyzedPages[editPage].strategy?.reason && (
+                                        <div className="sticky top-0 z-10 px-3 py-2 text-xs font-medium text-amber-800 bg-amber-50 border-b border-amber-200">
+                                            {analyzedPages[editPage].strategy.reason}
+                                        </div>
+                                    )}
                                     <LayerCanvas
                                         initialLayers={analyzedPages[editPage].layers}
                                         width={analyzedPages[editPage].width}
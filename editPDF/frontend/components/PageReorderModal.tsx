@@ -1,22 +1,16 @@
 "use client";
 
 import { useState, useEffect } from "react";
-import { Document, Page, pdfjs } from "react-pdf";
 import { DndProvider, useDrag, useDrop } from "react-dnd";
 import { HTML5Backend } from "react-dnd-html5-backend";
 import { X, Save } from "lucide-react";
 import { cn } from "@/lib/utils";
 
-// Configure worker (redundant if already in PDFViewer, but safe to set again)
-if (typeof window !== 'undefined') {
-    pdfjs.GlobalWorkerOptions.workerSrc = `//unpkg.com/pdfjs-dist@${pdfjs.version}/build/pdf.worker.min.mjs`;
-}
-
 interface PageReorderModalProps {
     isOpen: boolean;
     onClose: () => void;
     onExport: (pageOrder: number[]) => void;
-    pdfUrl: string;
+    filename: string;
     numPages: number;
 }
 
@@ -24,10 +18,10 @@ interface DraggablePageProps {
     pageNumber: number;
     index: number;
     movePage: (dragIndex: number, hoverIndex: number) => void;
-    pdfUrl: string;
+    filename: string;
 }
 
-const DraggablePage = ({ pageNumber, index, movePage, pdfUrl }: DraggablePageProps) => {
+const DraggablePage = ({ pageNumber, index, movePage, filename }: DraggablePageProps) => {
     const ref = (node: HTMLDivElement | null) => {
         drag(drop(node));
     };
@@ -63,16 +57,15 @@ const DraggablePage = ({ pageNumber, index, movePage, pdfUrl }: DraggablePagePro
             )}
         >
             <div className="aspect-[1/1.4] overflow-hidden pointer-events-none rounded-t bg-slate-100 flex items-center justify-center">
-                {/* Thumbnail */}
-                <Document file={pdfUrl} loading={<div className="w-full h-full bg-slate-200 animate-pulse" />}>
-                    <Page
-                        pageNumber={pageNumber}
-                        width={150}
-                        renderTextLayer={false}
-                        renderAnnotationLayer={false}
-                        className="shadow-sm"
-                    />
-                </Document>
+                {/* Thumbnail: low-DPI render cached by the backend (0-based page) */}
+                {/* eslint-disable-next-line @next/next/no-img-element */}
+                <img
+                    src={`${process.env.NEXT_PUBLIC_API_URL}/thumbnails/${encodeURIComponent(filename)}/${pageNumber - 1}`}
+                    alt={`Page ${pageNumber}`}
+                    loading="lazy"
+                    draggable={false}
+                    className="max-w-full max-h-full object-contain shadow-sm bg-white"
+                />
             </div>
             <div className="p-2 text-center text-xs font-medium text-slate-600 border-t bg-slate-50 rounded-b flex justify-between items-center">
                 <span>Pg {index + 1}</span>
@@ -82,7 +75,7 @@ const DraggablePage = ({ pageNumber, index, movePage, pdfUrl }: DraggablePagePro
     );
 };
 
-export function PageReorderModal({ isOpen, onClose, onExport, pdfUrl, numPages }: PageReorderModalProps) {
+export function PageReorderModal({ isOpen, onClose, onExport, filename, numPages }: PageReorderModalProps) {
     // pageOrder stores the *original* 1-based page numbers in their new order
     // e.g. [1, 2, 3] -> [3, 1, 2]
     const [pageOrder, setPageOrder] = useState<number[]>([]);
@@ -126,7 +119,7 @@ export function PageReorderModal({ isOpen, onClose, onExport, pdfUrl, numPages }
                                 pageNumber={originalPageNum}
                                 index={index}
                                 movePage={movePage}
-                                pdfUrl={pdfUrl}
+                                filename={filename}
                             />
                         ))}
                     </div>
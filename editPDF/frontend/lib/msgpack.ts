@@ -0,0 +1,255 @@
+// Minimal MessagePack codec for the backend's layer payloads (see
+// backend/services/wire_format.py). Decodes every standard type; ext values
+// are returned as { type, data } since the backend never emits them.
+
+export const MSGPACK_MEDIA_TYPE = "application/msgpack";
+
+const textDecoder = new TextDecoder();
+const textEncoder = new TextEncoder();
+
+class Decoder {
+    private view: DataView;
+    private pos = 0;
+
+    constructor(private bytes: Uint8Array) {
+        this.view = new DataView(bytes.buffer, bytes.byteOffset, bytes.byteLength);
+    }
+
+    decode(): any {
+        const value = this.read();
+        if (this.pos !== this.bytes.length) {
+            throw new Error("msgpack: trailing bytes after value");
+        }
+        return value;
+    }
+
+    private read(): any {
+        const view = this.view;
+        const b = this.u8();
+
+        if (b <= 0x7f) return b; // positive fixint
+        if (b >= 0xe0) return b - 0x100; // negative fixint
+        if ((b & 0xf0) === 0x80) return this.map(b & 0x0f);
+        if ((b & 0xf0) === 0x90) return this.array(b & 0x0f);
+        if ((b & 0xe0) === 0xa0) return this.str(b & 0x1f);
+
+        let v: any;
+        switch (b) {
+            case 0xc0: return null;
+            case 0xc2: return false;
+            case 0xc3: return true;
+            case 0xc4: return this.bin(this.u8());
+            case 0xc5: return this.bin(this.u16());
+            case 0xc6: return this.bin(this.u32());
+            case 0xc7: return this.ext(this.u8());
+            case 0xc8: return this.ext(this.u16());
+            case 0xc9: return this.ext(this.u32());
+            case 0xca: v = view.getFloat32(this.pos); this.pos += 4; return v;
+            case 0xcb: v = view.getFloat64(this.pos); this.pos += 8; return v;
+            case 0xcc: return this.u8();
+            case 0xcd: return this.u16();
+            case 0xce: return this.u32();
+            case 0xcf: v = Number(view.getBigUint64(this.pos)); this.pos += 8; return v;
+            case 0xd0: v = view.getInt8(this.pos); this.pos += 1; return v;
+            case 0xd1: v = view.getInt16(this.pos); this.pos += 2; return v;
+            case 0xd2: v = view.getInt32(this.pos); this.pos += 4; return v;
+            case 0xd3: v = Number(view.getBigInt64(this.pos)); this.pos += 8; return v;
+            case 0xd4: return this.ext(1);
+            case 0xd5: return this.ext(2);
+            case 0xd6: return this.ext(4);
+            case 0xd7: return this.ext(8);
+            case 0xd8: return this.ext(16);
+            case 0xd9: return this.str(this.u8());
+            case 0xda: return this.str(this.u16());
+            case 0xdb: return this.str(this.u32());
+            case 0xdc: return this.array(this.u16());
+            case 0xdd: return this.array(this.u32());
+            case 0xde: return this.map(this.u16());
+            case 0xdf: return this.map(this.u32());
+        }
+        throw new Error(`msgpack: invalid type byte 0x${b.toString(16)} at ${this.pos - 1}`);
+    }
+
+    private u8() {
+        return this.view.getUint8(this.pos++);
+    }
+
+    private u16() {
+        const v = this.view.getUint16(this.pos);
+        this.pos += 2;
+        return v;
+    }
+
+    private u32() {
+        const v = this.view.getUint32(this.pos);
+        this.pos += 4;
+        return v;
+    }
+
+    private take(n: number) {
+        if (this.pos + n > this.bytes.length) throw new Error("msgpack: truncated input");
+        const out = this.bytes.subarray(this.pos, this.pos + n);
+        this.pos += n;
+        return out;
+    }
+
+    private str(n: number) {
+        return textDecoder.decode(this.take(n));
+    }
+
+    private bin(n: number) {
+        return this.take(n).slice();
+    }
+
+    private ext(n: number) {
+        const type = this.view.getInt8(this.pos++);
+        return { type, data: this.bin(n) };
+    }
+
+    private array(n: number) {
+        const out = new Array(n);
+        for (let i = 0; i < n; i++) out[i] = this.read();
+        return out;
+    }
+
+    private map(n: number) {
+        const out: Record<string, any> = {};
+        for (let i = 0; i < n; i++) {
+            const key = this.read();
+            out[String(key)] = this.read();
+        }
+        return out;
+    }
+}
+
+export function decode(bytes: Uint8Array): any {
+    return new Decoder(bytes).decode();
+}
+
+class Encoder {
+    private buf = new Uint8Array(1024);
+    private view = new DataView(this.buf.buffer);
+    private pos = 0;
+
+    finish() {
+        return this.buf.subarray(0, this.pos);
+    }
+
+    private ensure(n: number) {
+        if (this.pos + n <= this.buf.length) return;
+        let size = this.buf.length * 2;
+        while (size < this.pos + n) size *= 2;
+        const next = new Uint8Array(size);
+        next.set(this.buf.subarray(0, this.pos));
+        this.buf = next;
+        this.view = new DataView(next.buffer);
+    }
+
+    private u8(v: number) {
+        this.ensure(1);
+        this.view.setUint8(this.pos++, v);
+    }
+
+    private head(fixBase: number, fixMax: number, code8: number | null, code16: number, code32: number, n: number) {
+        if (n <= fixMax) {
+            this.u8(fixBase | n);
+        } else if (code8 !== null && n <= 0xff) {
+            this.u8(code8);
+            this.u8(n);
+        } else if (n <= 0xffff) {
+            this.u8(code16);
+            this.ensure(2);
+            this.view.setUint16(this.pos, n);
+            this.pos += 2;
+        } else {
+            this.u8(code32);
+            this.ensure(4);
+            this.view.setUint32(this.pos, n);
+            this.pos += 4;
+        }
+    }
+
+    write(value: any): void {
+        if (value === null || value === undefined) {
+            this.u8(0xc0);
+        } else if (value === false || value === true) {
+            this.u8(value ? 0xc3 : 0xc2);
+        } else if (typeof value === "number") {
+            this.number(value);
+        } else if (typeof value === "string") {
+            const bytes = textEncoder.encode(value);
+            this.head(0xa0, 0x1f, 0xd9, 0xda, 0xdb, bytes.length);
+            this.bytes(bytes);
+        } else if (value instanceof Uint8Array) {
+            this.head(0, -1, 0xc4, 0xc5, 0xc6, value.length);
+            this.bytes(value);
+        } else if (Array.isArray(value)) {
+            this.head(0x90, 0x0f, null, 0xdc, 0xdd, value.length);
+            for (const item of value) this.write(item);
+        } else if (typeof value === "object") {
+            // Like JSON.stringify: skip undefined members
+            const entries = Object.entries(value).filter(([, v]) => v !== undefined);
+            this.head(0x80, 0x0f, null, 0xde, 0xdf, entries.length);
+            for (const [k, v] of entries) {
+                this.write(k);
+                this.write(v);
+            }
+        } else {
+            throw new Error(`msgpack: cannot encode ${typeof value}`);
+        }
+    }
+
+    private number(v: number) {
+        this.ensure(9);
+        const view = this.view;
+        if (Number.isInteger(v) && v >= -0x80000000 && v <= 0xffffffff) {
+            if (v >= 0 && v <= 0x7f) {
+                view.setUint8(this.pos++, v);
+            } else if (v < 0 && v >= -0x20) {
+                view.setInt8(this.pos++, v);
+            } else if (v >= 0) {
+                if (v <= 0xff) { view.setUint8(this.pos, 0xcc); view.setUint8(this.pos + 1, v); this.pos += 2; }
+                else if (v <= 0xffff) { view.setUint8(this.pos, 0xcd); view.setUint16(this.pos + 1, v); this.pos += 3; }
+                else { view.setUint8(this.pos, 0xce); view.setUint32(this.pos + 1, v); this.pos += 5; }
+            } else {
+                if (v >= -0x80) { view.setUint8(this.pos, 0xd0); view.setInt8(this.pos + 1, v); this.pos += 2; }
+                else if (v >= -0x8000) { view.setUint8(this.pos, 0xd1); view.setInt16(this.pos + 1, v); this.pos += 3; }
+                else { view.setUint8(this.pos, 0xd2); view.setInt32(this.pos + 1, v); this.pos += 5; }
+            }
+        } else {
+            // Edited layer geometry goes back at full precision
+            view.setUint8(this.pos, 0xcb);
+            view.setFloat64(this.pos + 1, v);
+            this.pos += 9;
+        }
+    }
+
+    private bytes(bytes: Uint8Array) {
+        this.ensure(bytes.length);
+        this.buf.set(bytes, this.pos);
+        this.pos += bytes.length;
+    }
+}
+
+export function encode(value: any): Uint8Array {
+    const encoder = new Encoder();
+    encoder.write(value);
+    return encoder.finish();
+}
+
+// Reads a response that may be JSON or MessagePack, by its Content-Type.
+// Content-Encoding (gzip/zstd) is undone by the browser before this sees it.
+export async function readPayload(res: Response): Promise<any> {
+    const type = res.headers.get("Content-Type") || "";
+    if (type.startsWith(MSGPACK_MEDIA_TYPE)) {
+        return decode(new Uint8Array(await res.arrayBuffer()));
+    }
+    return res.json();
+}
+
+// Gzips a request body where CompressionStream exists; returns null otherwise
+export async function gzip(bytes: Uint8Array): Promise<Uint8Array | null> {
+    if (typeof CompressionStream === "undefined") return null;
+    const stream = new Blob([bytes as BlobPart]).stream().pipeThrough(new CompressionStream("gzip"));
+    return new Uint8Array(await new Response(stream).arrayBuffer());
+}
@@ -40,7 +40,8 @@ export interface TextLayerData extends BaseLayer {
 
 export interface ImageLayerData extends BaseLayer {
     type: 'image';
-    src: string; // Data URL
+    src: string; // Data URL or backend /images/{hash} URL
+    originalSrc?: string; // Full resolution image when src is a downsampled tier
     opacity?: number;
 }
 